@@ -0,0 +1,99 @@
+'''
+Fork server for the Python service, see PythonForkServer.java
+
+Starting python_service_runscript.py means starting an interpreter and
+importing numpy and scisoftpy, which can take seconds. This does that once,
+then for each connection reads the address a new service is to serve on,
+forks, and runs python_service_runscript.py in the child, which is then
+ready in milliseconds.
+
+The first argument is the port to listen on, on localhost, or the path of a
+Unix domain socket. A client sends one line, the port or socket path for the
+service, and gets back the pid of the child. The child lives as long as that
+connection: it exits when the client closes it, or dies. Conversely the
+client sees the connection end when the child exits.
+'''
+
+import os, sys, socket, signal, threading, time, traceback
+import fcntl
+import runpy
+
+# What takes the time, imported once here rather than in every service
+import scisoftpy #@UnresolvedImport @UnusedImport
+import scisoftpy.rpc #@UnresolvedImport @UnusedImport
+
+runScriptPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'python_service_runscript.py')
+
+def runService(conn, address):
+    '''
+    Run python_service_runscript.py serving on address, in a forked child,
+    until conn is closed
+    '''
+    # The service's worker processes must be waited for as usual
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    # Programs a script runs must not hold the connection open
+    fcntl.fcntl(conn.fileno(), fcntl.F_SETFD,
+                fcntl.fcntl(conn.fileno(), fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    def exitWithConnection():
+        try:
+            while conn.recv(4096):
+                pass
+        except socket.error:
+            pass
+        # Stopped as PythonService stops a service it started, so that it
+        # closes its server and removes its socket file and shared memory
+        os.kill(os.getpid(), signal.SIGTERM)
+        # unless it is stuck
+        time.sleep(30)
+        os._exit(1)
+    watcher = threading.Thread(target=exitWithConnection)
+    watcher.daemon = True
+    watcher.start()
+
+    sys.argv = [runScriptPath, address, "-1"]
+    runpy.run_path(runScriptPath, run_name='__main__')
+
+def serve(address):
+    if address.isdigit():
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('127.0.0.1', int(address)))
+    else:
+        if os.path.exists(address):
+            os.remove(address)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(address)
+    server.listen(16)
+    # Children are not waited for, they exit on their own
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    while True:
+        conn, _ = server.accept()
+        try:
+            # Don't let a client that sends nothing hold up the others
+            conn.settimeout(10)
+            request = conn.makefile('rb').readline().strip()
+            conn.settimeout(None)
+            if not request:
+                continue
+            pid = os.fork()
+            if pid == 0:
+                # The child leaves by SystemExit rather than returning to
+                # the loop, so it exits as the service would on its own
+                server.close()
+                try:
+                    runService(conn, request)
+                except SystemExit:
+                    raise
+                except:
+                    traceback.print_exc()
+                    sys.exit(1)
+                sys.exit(0)
+            conn.sendall("%d\n" % pid)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            conn.close()
+
+serve(sys.argv[1])
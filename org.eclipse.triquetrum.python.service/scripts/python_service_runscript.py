@@ -12,64 +12,172 @@ This script is designed to be passed to scisoftpy.rpc's addHandler, see PythonRu
 '''
 
 import os, sys, threading
-
-sys_path_0_lock = threading.Lock()
-sys_path_0_set = False
+import signal
+import types
+import traceback
+from multiprocessing.pool import ThreadPool
 
 import time
-import os, sys
 
 '''
 Import the rpc part which we will use for workflows.
 '''
 import scisoftpy.rpc as rpc #@UnresolvedImport
-rpcserver = rpc.rpcserver(int(sys.argv[1]))
+
+'''
+If SCISOFT_RPC_PROCESSES is set to a positive number, runScript is run in a
+pool of that many forked worker processes so CPU bound scripts can run in
+parallel instead of being serialised by the GIL.
+'''
+try:
+    runScriptProcesses = int(os.getenv('SCISOFT_RPC_PROCESSES', '0'))
+except ValueError:
+    runScriptProcesses = 0
+
+# The first argument is the port, or the path of a Unix domain socket, to serve on
+rpcAddress = sys.argv[1]
+if rpcAddress.isdigit():
+    rpcAddress = int(rpcAddress)
+rpcserver = rpc.rpcserver(rpcAddress, processes=runScriptProcesses or None)
 
 def isActive(dummy):
     return True
 
 rpcserver.add_handler("isActive",  isActive)
 
-def runScript(scriptPath, inputs, funcName='run'):
+'''
+Compiled user scripts by path, with the mtime and size of the file they were
+compiled from, so that a script run many times is only read and compiled once.
+A script is compiled again when its file changes.
+
+If SCISOFT_RPC_KEEP_NAMESPACE is set to 1, the namespace the script's module
+level code makes is kept too, so that code (its imports in particular) is only
+run once as well. The script then sees any module level state left by earlier
+runs, so this is off by default.
+'''
+keepScriptNamespaces = os.getenv('SCISOFT_RPC_KEEP_NAMESPACE', '') in ('1', 'true', 'True')
+compiledScripts = dict()
+compiledScriptsLock = threading.Lock()
+compiledScriptsHits = 0
+compiledScriptsMisses = 0
+
+def compileScript(scriptPath):
     '''
-    scriptPath  - is the path to the user script that should be run
-    inputs      - is a dictionary of input objects 
+    Return (stamp, code, namespaces) for the script at scriptPath, compiling
+    it unless the cached code is for the file as it is now. namespaces holds
+    the namespaces kept for it by function name.
+    '''
+    global compiledScriptsHits, compiledScriptsMisses
+    stat = os.stat(scriptPath)
+    stamp = (stat.st_mtime, stat.st_size)
+    compiledScriptsLock.acquire()
+    try:
+        entry = compiledScripts.get(scriptPath)
+        if entry is not None and entry[0] == stamp:
+            compiledScriptsHits += 1
+            return entry
+        compiledScriptsMisses += 1
+    finally:
+        compiledScriptsLock.release()
+
+    # Read as execfile does, with universal newlines
+    f = open(scriptPath, 'rU')
+    try:
+        source = f.read()
+    finally:
+        f.close()
+    entry = (stamp, compile(source, scriptPath, 'exec'), dict())
+    compiledScriptsLock.acquire()
+    try:
+        compiledScripts[scriptPath] = entry
+    finally:
+        compiledScriptsLock.release()
+    return entry
+
+def runScriptCacheStats(dummy=None):
     '''
+    Return the number of runScript calls that found their script compiled
+    (hits) and that had to compile it (misses), and the number of scripts
+    cached. With SCISOFT_RPC_PROCESSES each worker process has a cache of its
+    own and these are the counts of the process that serves this call.
+    '''
+    compiledScriptsLock.acquire()
+    try:
+        return {'hits': compiledScriptsHits,
+                'misses': compiledScriptsMisses,
+                'scripts': len(compiledScripts)}
+    finally:
+        compiledScriptsLock.release()
+
+rpcserver.add_handler("runScriptCacheStats", runScriptCacheStats, process=runScriptProcesses > 0)
+
+'''
+Scripts are run without changing sys.path, so scripts from different
+directories can run at the same time in one process. Instead each directory
+gets a package of its own, __scriptdir<n>__, whose __path__ is the directory,
+and a script runs with that package as its __package__. Python 2's implicit
+relative imports then look for the modules a script imports in its directory
+first, and then as usual, as putting the directory first on sys.path would.
+Modules found there are loaded by the normal import machinery, so .pyc files,
+extension modules and packages work as anywhere else, and are kept in
+sys.modules under the package, so scripts in different directories can each
+have a module of the same name. Imports not made by a script, e.g. numpy's
+own, are not affected.
 
-    # Add the directory of the Python script to PYTHONPATH
-    # Doing this introduces a potential race condition that
-    # we protect against, if multiple calls
-    # to runScript are done in parallel there is no control
-    # over which one will be set when the execfile below actually
-    # runs. We protect against that race condition by ensuring
-    # that the sys.path[0] isn't changed unexpectedly.
-    # See the Python PyDev Workflow actor (PythonPydevScript#getService)
-    # for an implementation of when to spawn new Python executables
-    # and when they can be reused.
-    global sys_path_0_lock
-    global sys_path_0_set
-    sys_path_0_lock.acquire()
+A script that uses from __future__ import absolute_import must import the
+modules next to it with explicit relative imports, "from . import helper".
+'''
+scriptPackages = dict()
+scriptPackagesLock = threading.Lock()
+
+def getScriptPackage(directory):
+    '''
+    Return the name of the package of directory, creating it on first use
+    '''
+    scriptPackagesLock.acquire()
     try:
-        scriptDir = os.path.dirname(scriptPath)
-        sys_path_0 = sys.path[0]
-        if sys_path_0_set and scriptDir != sys_path_0:
-            raise Exception("runScript attempted to change sys.path[0] in a way that " +
-                            "could cause a race condition. Current sys.path[0] is %r, " +
-                            "trying to set to %r" % (sys_path_0, scriptDir) )
-        else:
-            sys.path[0] = scriptDir
-            sys_path_0_set = True
+        name = scriptPackages.get(directory)
+        if name is None:
+            name = "__scriptdir%d__" % len(scriptPackages)
+            package = types.ModuleType(name)
+            package.__path__ = [directory]
+            package.__package__ = name
+            sys.modules[name] = package
+            scriptPackages[directory] = name
+        return name
     finally:
-        sys_path_0_lock.release()
+        scriptPackagesLock.release()
 
-    # We don't use globals() to creating vars because we are not
-    # trying to run within the context of this method
-    vars = {'__name__': '<script>',
-            '__file__': scriptPath,
-            'runScriptFuncName': funcName}
+def loadScript(scriptPath, funcName):
+    '''
+    Return the namespace of the script at scriptPath, in which its function
+    funcName is to be called, running its module level code unless a
+    namespace is kept for it
+    '''
+    (stamp, code, namespaces) = compileScript(scriptPath)
+    vars = namespaces.get(funcName) if keepScriptNamespaces else None
+    if vars is None:
+        # We don't use globals() to creating vars because we are not
+        # trying to run within the context of this method
+        # __package__ has the script import modules next to it, see
+        # getScriptPackage
+        vars = {'__name__': '<script>',
+                '__file__': scriptPath,
+                '__package__': getScriptPackage(os.path.dirname(os.path.abspath(scriptPath))),
+                'runScriptFuncName': funcName}
 
-    # Run the script, this generates a function to call
-    execfile(scriptPath, vars)
+        # Run the script, this generates a function to call
+        exec code in vars
+        if keepScriptNamespaces:
+            vars = namespaces.setdefault(funcName, vars)
+    return vars
+
+def runScript(scriptPath, inputs, funcName='run'):
+    '''
+    scriptPath  - is the path to the user script that should be run
+    inputs      - is a dictionary of input objects 
+    '''
+    vars = loadScript(scriptPath, funcName)
 
     # Run the function generated, in the Java interface, the runScript method
     # is declared as returning a Map<String, Object>, but that is not enforced
@@ -78,8 +186,119 @@ def runScript(scriptPath, inputs, funcName='run'):
 
     return result
 
-rpcserver.add_handler("runScript", runScript)
+rpcserver.add_handler("runScript", runScript, process=runScriptProcesses > 0)
+
+'''
+Threads runScriptBatch calls functions on, shared by all batches so that a
+batch doesn't start threads of its own. The pool is replaced by a bigger one
+when a batch asks for more threads than it has. Batches still running on the
+pool replaced keep it, it is closed once the last of them is done.
+'''
+batchPool = None
+batchPoolSize = 0
+# The number of batches running on each pool
+batchPoolUsers = dict()
+batchPoolLock = threading.Lock()
+
+def acquireBatchPool(size):
+    '''
+    Return a pool of at least size threads, to give back to releaseBatchPool
+    '''
+    global batchPool, batchPoolSize
+    batchPoolLock.acquire()
+    try:
+        if batchPoolSize < size:
+            replaced = batchPool
+            batchPool = ThreadPool(size)
+            batchPoolSize = size
+            batchPoolUsers[batchPool] = 0
+            if replaced is not None and batchPoolUsers[replaced] == 0:
+                del batchPoolUsers[replaced]
+                replaced.close()
+        batchPoolUsers[batchPool] += 1
+        return batchPool
+    finally:
+        batchPoolLock.release()
+
+def releaseBatchPool(pool):
+    batchPoolLock.acquire()
+    try:
+        batchPoolUsers[pool] -= 1
+        if pool is not batchPool and batchPoolUsers[pool] == 0:
+            # Replaced meanwhile, its threads exit once closed
+            del batchPoolUsers[pool]
+            pool.close()
+    finally:
+        batchPoolLock.release()
+
+def runScriptBatch(scriptPath, inputsList, parallelism=1, funcName='run'):
+    '''
+    scriptPath  - is the path to the user script that should be run
+    inputsList  - is a list of dictionaries of input objects
+    parallelism - is the number of threads to call the function on
+    
+    Run the script once and call its function for each dictionary in
+    inputsList, returning what each call returned, in the same order. A call
+    that raises has its exception returned in its place, so one failing input
+    doesn't lose the results of the others.
+    
+    Threads help where the function spends its time outside the GIL, e.g. in
+    numpy or I/O. With SCISOFT_RPC_PROCESSES the whole batch is run in one
+    worker process, as runScript is.
+    '''
+    function = loadScript(scriptPath, funcName)[funcName]
+
+    def call(inputs):
+        try:
+            return function(**inputs)
+        except Exception, e:
+            (_etype, _value, tb) = sys.exc_info()
+            try:
+                # Without this frame, as the flattener would send it
+                e.flatten_traceback = [s + ("",) for s in traceback.extract_tb(tb)[1:]]
+            finally:
+                _etype = _value = tb = None
+            return e
+
+    if parallelism > 1 and len(inputsList) > 1:
+        # Each task takes the next input until there are none left, so the
+        # batch uses no more threads than asked for, whatever the pool's size
+        tasks = min(parallelism, len(inputsList))
+        results = [None] * len(inputsList)
+        items = enumerate(inputsList)
+        itemsLock = threading.Lock()
+        def callEach(_task):
+            while True:
+                itemsLock.acquire()
+                try:
+                    item = next(items, None)
+                finally:
+                    itemsLock.release()
+                if item is None:
+                    return
+                results[item[0]] = call(item[1])
+        pool = acquireBatchPool(tasks)
+        try:
+            pool.map(callEach, range(tasks), 1)
+        finally:
+            releaseBatchPool(pool)
+        return results
+    return map(call, inputsList)
+
+rpcserver.add_handler("runScriptBatch", runScriptBatch, process=runScriptProcesses > 0)
+
+'''
+PythonService.stop() ends the service with SIGTERM. Exit through the normal
+path then, so that the server is closed: its socket file and shared memory
+segments are removed.
+'''
+def stopService(signum, frame):
+    raise SystemExit(0)
+signal.signal(signal.SIGTERM, stopService)
 
 # Run the server's main loop
 #print "Starting python service on port "+str(sys.argv[1])
-rpcserver.serve_forever()
+try:
+    rpcserver.serve_forever()
+finally:
+    rpcserver.close()
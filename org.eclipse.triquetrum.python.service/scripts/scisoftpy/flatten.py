@@ -30,4 +30,10 @@ unflatten=_flatten.unflatten
 canflatten=_flatten.canflatten
 canunflatten=_flatten.canunflatten
 settemplocation=_flatten.settemplocation
+setsharedmemory=_flatten.setsharedmemory
+setmemorymap=_flatten.setmemorymap
+setbundle=_flatten.setbundle
+setinlinethreshold=_flatten.setinlinethreshold
+setpackedtype=_flatten.setpackedtype
 addhelper=_flatten.addhelper
+registerfields=_flatten.registerfields
@@ -122,6 +122,8 @@ plotmode = _plotmode()
 class axismapbean(object):   
     _AXIS_ID = 'axisID'
     _AXIS_NAMES = 'axisNames'
+    # Attributes sent when flattened, see pyflatten.fieldsHelper
+    _FIELDS = ((_AXIS_ID, None), (_AXIS_NAMES, None))
     
     DIRECT = 0
     FULL = 1
@@ -151,6 +153,7 @@ class axismapbean(object):
 class datasetwithaxisinformation(object):
     _DATA = "data"
     _AXIS_MAP = "axisMap"
+    _FIELDS = ((_DATA, None), (_AXIS_MAP, None))
     
     def __init__(self, data=None, axisMap=None):
         '''
@@ -176,6 +179,7 @@ class datasetwithaxisinformation(object):
 class databean(object):
     _DATA = "data"
     _AXIS_DATA = "axisData"
+    _FIELDS = ((_DATA, None), (_AXIS_DATA, None))
     
     def __init__(self, data=None, axisData=None):
         self.data = data or []
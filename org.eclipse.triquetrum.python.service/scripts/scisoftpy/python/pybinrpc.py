@@ -0,0 +1,202 @@
+###
+# Copyright 2011 Diamond Light Source Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+'''
+Compact binary encoding of AnalysisRpc calls, used instead of XML when
+both ends support it. See Java BinaryRpcCodec, which must be kept in step.
+
+Only values of flattened form (see pyflatten) are carried. Each value is a
+one byte tag followed by its payload, all numbers are little-endian:
+  'N'                             None
+  'T', 'F'                        True, False
+  'i' int32                       int in 32 bit range
+  'q' int64                       other int or long
+  'd' float64                     float
+  's' uint32 length, bytes        str (UTF-8)
+  'b' uint32 length, bytes        binarywrapper
+  'l' uint32 n, n values          list or tuple
+  'm' uint32 n, n (key, value)    dict, keys as uint32 length, bytes
+  'D' uint32 n, n float64         list of only floats
+  'Q' uint32 n, n int64           list of only ints
+A request is the method name as a 's' value followed by a 'l' of params.
+A response is OK followed by the value, or FAULT followed by an 'i' fault
+code and a 's' fault string.
+'''
+
+import struct
+import xmlrpclib
+
+NAME = "binary1"
+PATH = "/ARPC"
+CONTENT_TYPE = "application/x-analysisrpc"
+
+OK = '\x00'
+FAULT = '\x01'
+
+_INT32 = struct.Struct('<i')
+_INT64 = struct.Struct('<q')
+_UINT32 = struct.Struct('<I')
+_FLOAT64 = struct.Struct('<d')
+
+def _encode_list(value, out):
+    n = len(value)
+    if n > 0:
+        if all(type(v) is float for v in value):
+            out.append('D' + _UINT32.pack(n) + struct.pack('<%dd' % n, *value))
+            return
+        if all(type(v) is int for v in value):
+            try:
+                packed = struct.pack('<%dq' % n, *value)
+            except struct.error:
+                pass
+            else:
+                out.append('Q' + _UINT32.pack(n) + packed)
+                return
+    out.append('l' + _UINT32.pack(n))
+    for v in value:
+        _encode(v, out)
+
+def _encode(value, out):
+    if value is None:
+        out.append('N')
+    elif isinstance(value, bool):
+        out.append(value and 'T' or 'F')
+    elif isinstance(value, (int, long)):
+        if -0x80000000 <= value <= 0x7fffffff:
+            out.append('i' + _INT32.pack(value))
+        else:
+            try:
+                out.append('q' + _INT64.pack(value))
+            except struct.error:
+                raise OverflowError("int exceeds 64 bits")
+    elif isinstance(value, float):
+        out.append('d' + _FLOAT64.pack(value))
+    elif isinstance(value, str):
+        out.append('s' + _UINT32.pack(len(value)))
+        out.append(value)
+    elif isinstance(value, unicode):
+        _encode(value.encode('utf-8'), out)
+    elif isinstance(value, xmlrpclib.Binary):
+        out.append('b' + _UINT32.pack(len(value.data)))
+        out.append(value.data)
+    elif isinstance(value, (list, tuple)):
+        _encode_list(value, out)
+    elif isinstance(value, dict):
+        out.append('m' + _UINT32.pack(len(value)))
+        for k, v in value.iteritems():
+            if isinstance(k, unicode):
+                k = k.encode('utf-8')
+            elif not isinstance(k, str):
+                raise TypeError("dictionary key must be string")
+            out.append(_UINT32.pack(len(k)))
+            out.append(k)
+            _encode(v, out)
+    else:
+        raise TypeError("cannot marshal %s objects" % type(value))
+
+def _decode_bytes(data, pos):
+    n = _UINT32.unpack_from(data, pos)[0]
+    pos += 4
+    end = pos + n
+    if end > len(data):
+        raise ValueError("Truncated binary RPC message")
+    return data[pos:end], end
+
+def _decode(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == 'i':
+        return _INT32.unpack_from(data, pos)[0], pos + 4
+    if tag == 'd':
+        return _FLOAT64.unpack_from(data, pos)[0], pos + 8
+    if tag == 's':
+        return _decode_bytes(data, pos)
+    if tag == 'm':
+        n = _UINT32.unpack_from(data, pos)[0]
+        pos += 4
+        rval = dict()
+        for _i in xrange(n):
+            k, pos = _decode_bytes(data, pos)
+            rval[k], pos = _decode(data, pos)
+        return rval, pos
+    if tag == 'l':
+        n = _UINT32.unpack_from(data, pos)[0]
+        pos += 4
+        rval = []
+        for _i in xrange(n):
+            v, pos = _decode(data, pos)
+            rval.append(v)
+        return rval, pos
+    if tag == 'D' or tag == 'Q':
+        n = _UINT32.unpack_from(data, pos)[0]
+        pos += 4
+        fmt = '<%d%s' % (n, tag == 'D' and 'd' or 'q')
+        return list(struct.unpack_from(fmt, data, pos)), pos + 8 * n
+    if tag == 'q':
+        return _INT64.unpack_from(data, pos)[0], pos + 8
+    if tag == 'T':
+        return True, pos
+    if tag == 'F':
+        return False, pos
+    if tag == 'N':
+        return None, pos
+    if tag == 'b':
+        b, pos = _decode_bytes(data, pos)
+        return xmlrpclib.Binary(b), pos
+    raise ValueError("Unknown binary RPC tag %r" % tag)
+
+def _loads(data, pos):
+    try:
+        return _decode(data, pos)
+    except (struct.error, IndexError):
+        raise ValueError("Truncated binary RPC message")
+
+def dumps_request(methodname, params):
+    out = []
+    _encode(methodname, out)
+    _encode_list(params, out)
+    return ''.join(out)
+
+def loads_request(data):
+    methodname, pos = _loads(data, 0)
+    params, pos = _loads(data, pos)
+    if not isinstance(methodname, str) or not isinstance(params, list):
+        raise ValueError("Malformed binary RPC request")
+    return methodname, params
+
+def dumps_response(value):
+    out = [OK]
+    _encode(value, out)
+    return ''.join(out)
+
+def dumps_fault(faultCode, faultString):
+    out = [FAULT]
+    _encode(faultCode, out)
+    _encode(faultString, out)
+    return ''.join(out)
+
+def loads_response(data):
+    '''
+    Return the value of a response, or raise xmlrpclib.Fault if the
+    response is a fault
+    '''
+    if data[:1] == FAULT:
+        faultCode, pos = _loads(data, 1)
+        faultString, pos = _loads(data, pos)
+        raise xmlrpclib.Fault(faultCode, faultString)
+    if data[:1] != OK:
+        raise ValueError("Malformed binary RPC response")
+    return _loads(data, 1)[0]
@@ -23,16 +23,24 @@ public for the purpose of testing, see pyflatten_test.py
 import scisoftpy.python.pyroi as _roi
 import scisoftpy.python.pybeans as _beans
 import scisoftpy.python.pywrapper as _wrapper
+import scisoftpy.python.pyshm as _shm
 import numpy as _np #@UnresolvedImport
 from tempfile import mkstemp
 import os
 import sys
 import copy
 import uuid
+import re as _re
+import array
 import traceback
+import threading
+from itertools import izip, repeat
 
 TYPE = "__type__"
 CONTENT = "content"
+# Key given to the flattened form of an object met more than once by one call
+# to flatten, see referenceHelper
+ID = "__id__"
 
 _TEMP_LOCATION_SET = False
 _TEMP_LOCATION = None
@@ -51,112 +59,218 @@ def settemplocation(loc=None):
     _TEMP_LOCATION = loc
     _TEMP_LOCATION_SET = True
 
-class flatteningHelper(object):
-    def __init__(self, typeObj, typeName):
-        self.typeObj = typeObj
-        self.typeName = typeName
+def _templocation():
+    global _TEMP_LOCATION, _TEMP_LOCATION_SET
+    if not _TEMP_LOCATION_SET:
+        _TEMP_LOCATION = os.getenv('SCISOFT_RPC_TEMP')
+        _TEMP_LOCATION_SET = True
+    if _TEMP_LOCATION == "":
+        _TEMP_LOCATION = None
+    return _TEMP_LOCATION
 
-    def canunflatten(self, obj):
-        return isinstance(obj, dict) and obj.get(TYPE) == self.typeName
-    
-    def canflatten(self, obj):
-        return isinstance(obj, self.typeObj)
+_SHARED_MEMORY_SET = False
+_SHARED_MEMORY = False
 
-class roiHelper(flatteningHelper):
+def setsharedmemory(enabled=True):
+    '''
+     Send ndarrays of numbers in shared memory segments (see pyshm) instead of temp files, avoiding the disk. The
+     unflattener at the other end must understand the shared memory form, so this is off unless enabled here or by
+     setting SCISOFT_RPC_SHM=1. Has no effect where shared memory is not available.
+    '''
+    global _SHARED_MEMORY, _SHARED_MEMORY_SET
+    _SHARED_MEMORY = enabled and _shm.available()
+    _SHARED_MEMORY_SET = True
 
-    def __init__(self, typeObj, typeName):
-        super(roiHelper, self).__init__(typeObj, typeName)
-        
-    def flatten(self, thisRoiBase):
-        d = copy.deepcopy(thisRoiBase.__dict__)
-        rval = dict()
-        for k, v in d.iteritems():
-            rval[k] = flatten(v)
-        rval[TYPE] = self.typeName
-        return rval
-    
-    def unflatten(self, obj):
-        unflattenedObj = dict()
-        for k, v in obj.iteritems():
-            if k == TYPE:
-                continue
-            v = unflatten(v)
-            unflattenedObj[k] = v
-        return self.typeObj(**unflattenedObj)
+def _usesharedmemory():
+    if not _SHARED_MEMORY_SET:
+        setsharedmemory(os.getenv('SCISOFT_RPC_SHM', '') in ('1', 'true', 'True'))
+    return _SHARED_MEMORY
 
-    @staticmethod
-    def getROIBaseHelper():
-        return roiHelper(_roi.roibase, "org.eclipse.triquetrum.scisoft.analysis.roi.ROIBase")
-        
-    @staticmethod
-    def getPointHelper():
-        return roiHelper(_roi.point, "org.eclipse.triquetrum.scisoft.analysis.roi.PointROI")
-        
-    @staticmethod
-    def getRectangleHelper():
-        return roiHelper(_roi.rectangle, "org.eclipse.triquetrum.scisoft.analysis.roi.RectangularROI")
-        
-    @staticmethod
-    def getSectorHelper():
-        return roiHelper(_roi.sector, "org.eclipse.triquetrum.scisoft.analysis.roi.SectorROI")
+_INLINE_THRESHOLD_SET = False
+_INLINE_THRESHOLD = 0
 
-    @staticmethod
-    def getLineHelper():
-        return roiHelper(_roi.line, "org.eclipse.triquetrum.scisoft.analysis.roi.LinearROI")
+def setinlinethreshold(nbytes=16384):
+    '''
+     Send ndarrays of numbers of at most nbytes inside the message, as a binarywrapper of their data, instead of in a
+     temp file or shared memory. For small arrays this saves creating, writing and removing a file. The unflattener
+     at the other end must understand the inline form, so this is off (0) unless set here or by setting
+     SCISOFT_RPC_INLINE_BYTES.
+    '''
+    global _INLINE_THRESHOLD, _INLINE_THRESHOLD_SET
+    _INLINE_THRESHOLD = nbytes
+    _INLINE_THRESHOLD_SET = True
 
-    @staticmethod
-    def getCircleHelper():
-        return roiHelper(_roi.circle, "org.eclipse.triquetrum.scisoft.analysis.roi.CircularROI")
+def _inlinethreshold():
+    if not _INLINE_THRESHOLD_SET:
+        try:
+            setinlinethreshold(int(os.getenv('SCISOFT_RPC_INLINE_BYTES', '0')))
+        except ValueError:
+            setinlinethreshold(0)
+    return _INLINE_THRESHOLD
 
-    @staticmethod
-    def getEllipseHelper():
-        return roiHelper(_roi.ellipse, "org.eclipse.triquetrum.scisoft.analysis.roi.EllipticalROI")
+_MEMORY_MAP_SET = False
+_MEMORY_MAP = False
 
+def setmemorymap(enabled=True):
+    '''
+     Unflatten ndarrays sent in temp files as read-only memory maps of the file instead of reading the file into
+     memory. Pages are then only read when used, so a handler that uses part of a large input doesn't pay for all of
+     it. A temp file is unlinked as soon as it is mapped, its storage is freed once the last reference to the array
+     (or any view of it) is dropped.
+     
+     Off unless enabled here or by setting SCISOFT_RPC_MMAP=1. Not available on Windows, where a mapped file can't be
+     removed.
+    '''
+    global _MEMORY_MAP, _MEMORY_MAP_SET
+    _MEMORY_MAP = enabled and os.name != 'nt'
+    _MEMORY_MAP_SET = True
 
-class axisMapBeanHelper(flatteningHelper):
+def _usememorymap():
+    if not _MEMORY_MAP_SET:
+        setmemorymap(os.getenv('SCISOFT_RPC_MMAP', '') in ('1', 'true', 'True'))
+    return _MEMORY_MAP
 
-    TYPE_NAME = "org.eclipse.triquetrum.scisoft.analysis.plotserver.AxisMapBean"
-    
-    def __init__(self):
-        super(axisMapBeanHelper, self).__init__(_beans.axismapbean, self.TYPE_NAME)
-    
-    def flatten(self, thisAxisMapBean):
-        rval = dict()
-        rval[TYPE] = self.TYPE_NAME
-        rval[_beans.axismapbean._AXIS_ID] = thisAxisMapBean.axisID
-        rval[_beans.axismapbean._AXIS_NAMES] = thisAxisMapBean.axisNames
-        return rval
-    
-    def unflatten(self, obj):
-        unflattenedMap = dict()
-        unflattenedMap[_beans.axismapbean._AXIS_ID] = unflatten(obj[_beans.axismapbean._AXIS_ID])
-        unflattenedMap[_beans.axismapbean._AXIS_NAMES] = unflatten(obj[_beans.axismapbean._AXIS_NAMES])
-        return _beans.axismapbean(**unflattenedMap)
-        
-class datasetWithAxisInformationHelper(flatteningHelper):
+_BUNDLE_SET = False
+_BUNDLE = False
 
-    TYPE_NAME = "org.eclipse.triquetrum.scisoft.analysis.plotserver.DataSetWithAxisInformation"
-    
-    def __init__(self):
-        super(datasetWithAxisInformationHelper, self).__init__(_beans.datasetwithaxisinformation, self.TYPE_NAME)
-        
-    def flatten(self, thisDatasetWithAxisInformation):
-        rval = dict()
-        rval[TYPE] = self.TYPE_NAME
-        rval[_beans.datasetwithaxisinformation._DATA] = flatten(thisDatasetWithAxisInformation.data)
-        rval[_beans.datasetwithaxisinformation._AXIS_MAP] = flatten(thisDatasetWithAxisInformation.axisMap)
-        return rval
+def setbundle(enabled=True):
+    '''
+     Write all the ndarrays one call to flatten sends in temp files to a single bundle file, one after the other, instead
+     of a file each. Each flattened ndarray then gives the offset of its array in the bundle, and the unflattener at the
+     other end opens the bundle once and removes it when the call to unflatten is done. A call with many arrays then
+     costs one file to create and remove rather than one per array. Arrays sent inline or in shared memory are not
+     affected.
+     
+     The unflattener at the other end must understand bundles, so this is off unless enabled here or by setting
+     SCISOFT_RPC_BUNDLE=1.
+    '''
+    global _BUNDLE, _BUNDLE_SET
+    _BUNDLE = enabled
+    _BUNDLE_SET = True
+
+def _usebundle():
+    if not _BUNDLE_SET:
+        setbundle(os.getenv('SCISOFT_RPC_BUNDLE', '') in ('1', 'true', 'True'))
+    return _BUNDLE
+
+_PACKED_TYPE_SET = False
+_PACKED_TYPE = "array"
+
+def setpackedtype(typename="array"):
+    '''
+     Choose what packed numeric sequences (Java double[] and int[]) unflatten to: "array" for array.array, or
+     "ndarray" for a one dimensional numpy ndarray. Either way the elements are copied once from the bytes received,
+     with no Python object per element.
+     
+     Defaults to "array" unless set here or by setting SCISOFT_RPC_PACKED_TYPE.
+    '''
+    if typename not in ("array", "ndarray"):
+        raise ValueError("Packed type must be 'array' or 'ndarray', not " + repr(typename))
+    global _PACKED_TYPE, _PACKED_TYPE_SET
+    _PACKED_TYPE = typename
+    _PACKED_TYPE_SET = True
+
+def _packedtype():
+    if not _PACKED_TYPE_SET:
+        try:
+            setpackedtype(os.getenv('SCISOFT_RPC_PACKED_TYPE', 'array'))
+        except ValueError:
+            setpackedtype()
+    return _PACKED_TYPE
+
+class flatteningHelper(object):
+    # True if canflatten depends on nothing but the type of the object, and
+    # canunflatten on nothing but its type and, for a dict, its __type__. The
+    # helper flatten and unflatten pick for such objects is then remembered,
+    # see _flattener. A subclass that looks at more must set this False.
+    DISPATCH_BY_TYPE = True
+    # True if an object this helper flattens is only flattened once by each
+    # call to flatten, however often it is met, see referenceHelper. The
+    # flattened form must then be a dict.
+    SHARED = False
+
+    def __init__(self, typeObj, typeName):
+        self.typeObj = typeObj
+        self.typeName = typeName
+
+    def canunflatten(self, obj):
+        return isinstance(obj, dict) and obj.get(TYPE) == self.typeName
     
-    def unflatten(self, obj):
-        unflattenedMap = dict()
-        unflattenedMap[_beans.datasetwithaxisinformation._DATA] = unflatten(obj[_beans.datasetwithaxisinformation._DATA])
-        unflattenedMap[_beans.datasetwithaxisinformation._AXIS_MAP] = unflatten(obj[_beans.datasetwithaxisinformation._AXIS_MAP])        
-        return _beans.datasetwithaxisinformation(**unflattenedMap)
-            
+    def canflatten(self, obj):
+        return isinstance(obj, self.typeObj)
+
+class fieldsHelper(flatteningHelper):
+    '''
+    Flattens objects of a class to a dict of their attributes named in a
+    declared list of fields, and unflattens them without calling the class's
+    constructor. The flatten and unflatten methods are generated for the class
+    when the helper is made, so no attribute is looked up by name at run time
+    and nothing is copied that isn't sent.
+
+    The fields are (name, kind) pairs, name being both the attribute and its
+    key in the flattened form. The kind says how the value is converted:
+      "float"   float
+      "floats"  list of floats
+      "int"     int
+      "bool"    bool
+      None      any value, flattened and unflattened as usual
+    If the fields are not given they are taken from the class's _FIELDS. A
+    field missing from a flattened form is given the value it has in an
+    instance of the class made with no arguments, so the class must allow
+    that.
+
+    See registerfields to add one for another class.
+    '''
+    _FLATTEN = {"float": "float(%s)", "floats": "[float(p) for p in %s]", "int": "int(%s)", "bool": "bool(%s)",
+                None: "flatten(%s)"}
+    _UNFLATTEN = {"float": "float(%s)", "floats": "_floats(%s)", "int": "int(%s)", "bool": "bool(%s)",
+                  None: "unflatten(%s)"}
+
+    def __init__(self, typeObj, typeName, fields=None):
+        super(fieldsHelper, self).__init__(typeObj, typeName)
+        if fields is None:
+            fields = typeObj._FIELDS
+        self.fields = tuple(fields)
+        for name, kind in self.fields:
+            if not _re.match(r"[A-Za-z_]\w*$", name) or kind not in self._FLATTEN:
+                raise ValueError("Invalid field %r of kind %r" % (name, kind))
+        prototype = typeObj()
+        self._defaults = dict((name, getattr(prototype, name)) for name, _kind in self.fields)
+
+        # Compiled in this module's globals, so the functions call this
+        # module's flatten and unflatten, with what is particular to this
+        # class bound as default arguments
+        flattenlines = ["def flatten(obj, _typeName=_typeName):", "    return {TYPE: _typeName,"]
+        unflattenlines = ["def unflatten(d, _typeObj=_typeObj, _new=_new, _default=_default):",
+                          "    obj = _new(_typeObj)"]
+        for name, kind in self.fields:
+            flattenlines.append("        %r: %s," % (name, self._FLATTEN[kind] % ("obj." + name)))
+            unflattenlines.append("    if %r in d:" % name)
+            unflattenlines.append("        obj.%s = %s" % (name, self._UNFLATTEN[kind] % ("d[%r]" % name)))
+            unflattenlines.append("    else:")
+            unflattenlines.append("        obj.%s = _default(%r)" % (name, name))
+        flattenlines.append("    }")
+        unflattenlines.append("    return obj")
+
+        namespace = {"_typeName": typeName, "_typeObj": typeObj, "_new": object.__new__, "_default": self._default}
+        exec "\n".join(flattenlines + unflattenlines) in globals(), namespace
+        self.flatten = namespace["flatten"]
+        self.unflatten = namespace["unflatten"]
+
+    def _default(self, name):
+        return copy.copy(self._defaults[name])
+
+def _floats(obj):
+    if type(obj) is list:
+        # Elements of a flattened list of numbers need no unflattening
+        return [float(p) for p in obj]
+    return [float(p) for p in unflatten(obj)]
+
 class dictHelper(flatteningHelper):
     TYPE_NAME = "java.util.Map"
     KEYS = "keys"
     VALUES = "values"
+    SHARED = True
     
     def __init__(self):
         super(dictHelper, self).__init__(dict, self.TYPE_NAME)
@@ -178,6 +292,8 @@ class dictHelper(flatteningHelper):
         return rval
 
 class passThroughHelper(object):
+    DISPATCH_BY_TYPE = True
+
     def flatten(self, obj):
         return obj
     
@@ -191,6 +307,8 @@ class passThroughHelper(object):
         return self.canflatten(obj)
 
 class unicodeHelper(object):
+    DISPATCH_BY_TYPE = True
+
     def flatten(self, obj):
         return str(obj)
     
@@ -209,21 +327,45 @@ class ndArrayHelper(flatteningHelper):
     DELETEFILEAFTERLOAD = "deletefile"
     INDEX = "index"
     NAME = "name"
+    SHMNAME = "shmname"
+    OFFSET = "offset"
+    DTYPE = "dtype"
+    SHAPE = "shape"
+    DATA = "data"
+    # Little-endian dtypes that can be sent inline or in shared memory, those
+    # the Java NDArray has a type for. Others go through temp files.
+    SHM_DTYPES = frozenset(("<f8", "<f4", "<i8", "<u8", "<i4", "<u4", "<i2", "<u2", "|i1", "|u1", "|b1"))
+    SHARED = True
     
     def __init__(self):
         super(ndArrayHelper, self).__init__(_np.ndarray, self.TYPE_NAME)
     
+    def _hasshmdtype(self, obj):
+        return isinstance(obj, _np.ndarray) and obj.dtype.newbyteorder('<').str in self.SHM_DTYPES
+
     def flatten(self, obj):
         rval = dict()
-        if isinstance(obj, _np.ndarray):
-            global _TEMP_LOCATION, _TEMP_LOCATION_SET
-            if not _TEMP_LOCATION_SET:
-                _TEMP_LOCATION = os.getenv('SCISOFT_RPC_TEMP')
-                _TEMP_LOCATION_SET = True
-            if _TEMP_LOCATION == "":
-                _TEMP_LOCATION = None
-                 
-            (osfd, filename) = mkstemp(suffix='.npy', prefix='scisofttmp-', dir=_TEMP_LOCATION)
+        if self._hasshmdtype(obj) and obj.nbytes <= _inlinethreshold():
+            dtype = obj.dtype.newbyteorder('<')
+            rval[self.DATA] = _wrapper.binarywrapper(_np.ascontiguousarray(obj, dtype).tostring())
+            rval[self.DTYPE] = dtype.str
+            rval[self.SHAPE] = list(obj.shape)
+        elif self._hasshmdtype(obj) and _usesharedmemory():
+            dtype = obj.dtype.newbyteorder('<')
+            segment = _shm.getpool().acquire(obj.nbytes)
+            # Copy straight into the segment, in C order and little-endian
+            # as the Java side expects
+            _np.ndarray(obj.shape, dtype, buffer=segment.map, offset=_shm.HEADER_SIZE)[...] = obj
+            rval[self.SHMNAME] = segment.name
+            rval[self.OFFSET] = _shm.HEADER_SIZE
+            rval[self.DTYPE] = dtype.str
+            rval[self.SHAPE] = list(obj.shape)
+        elif (isinstance(obj, _np.ndarray) and _usebundle()
+                and getattr(_local, 'flattening', None) is not None):
+            rval[self.FILENAME], rval[self.OFFSET] = _local.flattening.write(obj)
+            rval[self.DELETEFILEAFTERLOAD] = True
+        elif isinstance(obj, _np.ndarray):
+            (osfd, filename) = mkstemp(suffix='.npy', prefix='scisofttmp-', dir=_templocation())
             os.close(osfd)
             try:
                 _np.save(filename, _np.asarray(obj, order='C')) # convert to C order as Java loader cannot cope otherwise
@@ -248,10 +390,40 @@ class ndArrayHelper(flatteningHelper):
         return rval
 
     def unflatten(self, obj):
+        if self.DATA in obj:
+            data = obj[self.DATA]
+            if isinstance(data, _wrapper.binarywrapper):
+                data = data.data
+            # Copied so that the result is writable as other arrays are
+            return _np.frombuffer(data, _np.dtype(obj[self.DTYPE])).reshape(tuple(obj[self.SHAPE])).copy()
+        if self.SHMNAME in obj:
+            mapped = _shm.openmapped(obj[self.SHMNAME])
+            try:
+                view = _np.ndarray(tuple(obj[self.SHAPE]), _np.dtype(obj[self.DTYPE]),
+                                   buffer=mapped, offset=obj[self.OFFSET])
+                rval = view.copy()
+                del view
+            finally:
+                # Free for reuse even if the array could not be read
+                mapped[0] = _shm.FREE
+            return rval
+        if self.OFFSET in obj:
+            return _local.unflattening.read(obj[self.FILENAME], obj[self.OFFSET],
+                                            obj.get(self.DELETEFILEAFTERLOAD, False))
         filename = obj[self.FILENAME]
         deletefile = False
         if self.DELETEFILEAFTERLOAD in obj:
             deletefile = obj[self.DELETEFILEAFTERLOAD]
+        if _usememorymap():
+            try:
+                mapped = _np.load(filename, mmap_mode='r')
+            except ValueError:
+                # e.g. object arrays, which can't be mapped
+                mapped = None
+            if isinstance(mapped, _np.ndarray):
+                if deletefile:
+                    os.remove(filename)
+                return mapped
         try:
             return _np.load(filename)
         finally:
@@ -261,6 +433,60 @@ class ndArrayHelper(flatteningHelper):
     def canflatten(self, obj):
         return isinstance(obj, (_np.ndarray, _wrapper.abstractdatasetdescriptor))
 
+class packedArrayHelper(flatteningHelper):
+    '''
+    The packed form of a sequence of numbers: its elements as little-endian
+    bytes and their dtype. Java flattens double[] and int[] this way and this
+    flattens array.arrays to them. Which of the two a given array.array is
+    sent as depends on its typecode, so either helper flattens both.
+    '''
+    DTYPE = "dtype"
+    DATA = "data"
+    def __init__(self, typeName, dtype, typecode):
+        super(packedArrayHelper, self).__init__(array.array, typeName)
+        self.dtype = dtype
+        self.typecode = typecode
+
+    def flatten(self, obj):
+        if obj.typecode in "fd":
+            helper = _packedDoubleArrayHelper
+        else:
+            helper = _packedIntArrayHelper
+        if obj.typecode != helper.typecode:
+            try:
+                obj = array.array(helper.typecode, obj)
+            except OverflowError:
+                # Too big for a Java int, send as a list of numbers
+                return [flatten(v) for v in obj]
+        if sys.byteorder != 'little':
+            obj = array.array(obj.typecode, obj)
+            obj.byteswap()
+        rval = dict()
+        rval[TYPE] = helper.typeName
+        rval[self.DTYPE] = helper.dtype
+        rval[self.DATA] = _wrapper.binarywrapper(obj.tostring())
+        return rval
+
+    def unflatten(self, obj):
+        data = obj[self.DATA]
+        if isinstance(data, _wrapper.binarywrapper):
+            data = data.data
+        dtype = _np.dtype(obj[self.DTYPE])
+        if _packedtype() == "ndarray" or dtype.str != self.dtype:
+            # Copied so that the result is writable
+            rval = _np.frombuffer(data, dtype).copy()
+            if _packedtype() == "ndarray":
+                return rval
+            return array.array(self.typecode, rval.tolist())
+        rval = array.array(self.typecode)
+        rval.fromstring(data)
+        if sys.byteorder != 'little':
+            rval.byteswap()
+        return rval
+
+_packedDoubleArrayHelper = packedArrayHelper("double[]", "<f8", "d")
+_packedIntArrayHelper = packedArrayHelper("int[]", "<i4", "i")
+
 class guiBeanHelper(flatteningHelper):
     TYPE_NAME = "org.eclipse.triquetrum.scisoft.analysis.plotserver.GuiBean"
     
@@ -363,7 +589,65 @@ class roiListHelper(flatteningHelper):
     def getEllipseListHelper():
         return roiListHelper(_roi.ellipse_list, "org.eclipse.triquetrum.scisoft.analysis.roi.EllipticalROIList")
 
+class roiArrayHelper(flatteningHelper):
+    '''
+    Flattens a pyroi.roi_array to a dict of its columns, each flattened as a
+    whole: an ndarray for each numeric field and a list for the others
+    '''
+    def flatten(self, obj):
+        rval = dict()
+        rval[TYPE] = self.typeName
+        for name, _kind in obj._pcls._FIELDS:
+            rval[name] = self._flattencolumn(obj.column(name))
+        return rval
+
+    def unflatten(self, obj):
+        columns = dict()
+        for k, v in obj.iteritems():
+            if k != TYPE:
+                columns[k] = self._unflattencolumn(v)
+        return self.typeObj.fromcolumns(**columns)
+
+    @staticmethod
+    def _flattencolumn(column):
+        # Names are usually all strings, which need no flattening
+        if isinstance(column, list) and all(type(v) is str for v in column):
+            return column
+        return flatten(column)
+
+    @staticmethod
+    def _unflattencolumn(column):
+        if isinstance(column, list) and all(type(v) is str for v in column):
+            return column
+        return unflatten(column)
+
+    @staticmethod
+    def getPointArrayHelper():
+        return roiArrayHelper(_roi.point_array, "org.eclipse.triquetrum.scisoft.analysis.roi.PointROIArray")
+
+    @staticmethod
+    def getLineArrayHelper():
+        return roiArrayHelper(_roi.line_array, "org.eclipse.triquetrum.scisoft.analysis.roi.LinearROIArray")
+
+    @staticmethod
+    def getRectangleArrayHelper():
+        return roiArrayHelper(_roi.rectangle_array, "org.eclipse.triquetrum.scisoft.analysis.roi.RectangularROIArray")
+
+    @staticmethod
+    def getSectorArrayHelper():
+        return roiArrayHelper(_roi.sector_array, "org.eclipse.triquetrum.scisoft.analysis.roi.SectorROIArray")
+
+    @staticmethod
+    def getCircleArrayHelper():
+        return roiArrayHelper(_roi.circle_array, "org.eclipse.triquetrum.scisoft.analysis.roi.CircularROIArray")
+
+    @staticmethod
+    def getEllipseArrayHelper():
+        return roiArrayHelper(_roi.ellipse_array, "org.eclipse.triquetrum.scisoft.analysis.roi.EllipticalROIArray")
+
 class listAndTupleHelper(object):
+    DISPATCH_BY_TYPE = True
+
     def flatten(self, obj):
         outList = []
         for thisItem in obj:
@@ -383,24 +667,129 @@ class listAndTupleHelper(object):
     def canunflatten(self, obj):
         return isinstance(obj, (list, tuple))
 
-class dataBeanHelper(flatteningHelper):
-    TYPE_NAME = "org.eclipse.triquetrum.scisoft.analysis.plotserver.DataBean"
-    
+class referenceHelper(flatteningHelper):
+    '''
+    Stands for an object met before by the same call to flatten, so that an
+    object found several times in what is flattened, such as the same axis
+    ndarray for several lines, is sent and unflattened once and comes back as
+    one object shared by all the places it was in. The first flattened form
+    of the object is given an ID, which references to it repeat. References
+    are only made for objects of helpers that are SHARED.
+    '''
+    TYPE_NAME = "__ref__"
+    REF_ID = "id"
+
     def __init__(self):
-        super(dataBeanHelper, self).__init__(_beans.databean, self.TYPE_NAME)
+        super(referenceHelper, self).__init__(None, self.TYPE_NAME)
+
+    def flatten(self, obj):
+        raise NotImplementedError()
 
-    def flatten(self, thisDataBean):
-        rval = dict()
-        rval[TYPE] = self.TYPE_NAME
-        rval[_beans.databean._AXIS_DATA] = flatten(thisDataBean.axisData)
-        rval[_beans.databean._DATA] = flatten(thisDataBean.data)
-        return rval
-    
     def unflatten(self, obj):
-        unflattenedMap = dict()
-        unflattenedMap[_beans.databean._AXIS_DATA] = unflatten(obj[_beans.databean._AXIS_DATA])
-        unflattenedMap[_beans.databean._DATA] = unflatten(obj[_beans.databean._DATA])
-        return _beans.databean(**unflattenedMap)
+        unflattening = getattr(_local, 'unflattening', None)
+        shared = unflattening.shared if unflattening is not None else ()
+        if obj[self.REF_ID] not in shared:
+            raise ValueError("Reference to object " + repr(obj[self.REF_ID]) + " met before the object, "
+                             "objects that contain themselves cannot be unflattened")
+        return shared[obj[self.REF_ID]]
+
+    def canflatten(self, obj):
+        return False
+
+class _flattening(object):
+    '''
+    What one call to flatten has done so far: the objects of SHARED helpers
+    it has met, with their flattened form, and the bundle file it writes
+    ndarrays to, see setbundle
+    '''
+    __slots__ = ('seen', 'count', 'bundle', 'filename')
+
+    def __init__(self):
+        self.seen = dict()
+        self.count = 0
+        self.bundle = None
+        self.filename = None
+
+    def reference(self, obj):
+        '''
+        Return a reference to obj if it has been met before, else None
+        '''
+        seen = self.seen.get(id(obj))
+        if seen is None:
+            return None
+        flat = seen[1]
+        n = flat.get(ID)
+        if n is None:
+            n = flat[ID] = self.count
+            self.count += 1
+        return {TYPE: referenceHelper.TYPE_NAME, referenceHelper.REF_ID: n}
+
+    def add(self, obj, flat):
+        if isinstance(flat, dict):
+            # obj is held so that its id is not given to another object
+            self.seen[id(obj)] = (obj, flat)
+
+    def write(self, obj):
+        '''
+        Append obj to the bundle, created on first use, and return the
+        bundle's filename and the offset obj was written at
+        '''
+        if self.bundle is None:
+            (osfd, self.filename) = mkstemp(suffix='.npys', prefix='scisofttmp-', dir=_templocation())
+            self.bundle = os.fdopen(osfd, 'wb')
+        offset = self.bundle.tell()
+        _np.save(self.bundle, _np.asarray(obj, order='C'))
+        return self.filename, offset
+
+    def close(self, completed):
+        '''
+        Close the bundle, removing it if the call to flatten failed
+        '''
+        if self.bundle is not None:
+            self.bundle.close()
+            if not completed:
+                os.remove(self.filename)
+
+class _unflattening(object):
+    '''
+    What one call to unflatten has done so far: the objects unflattened
+    with an ID, by ID, and the bundle files it has read ndarrays from
+    '''
+    __slots__ = ('shared', 'bundles')
+
+    def __init__(self):
+        self.shared = dict()
+        self.bundles = dict()
+
+    def read(self, filename, offset, deletefile):
+        '''
+        Return the ndarray written at offset in the named bundle, which is
+        opened once and removed by close if deletefile
+        '''
+        opened = self.bundles.get(filename)
+        if opened is None:
+            opened = self.bundles[filename] = (open(filename, 'rb'), deletefile)
+        f = opened[0]
+        f.seek(offset)
+        if _usememorymap():
+            version = _np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = _np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran, dtype = _np.lib.format.read_array_header_2_0(f)
+            else:
+                dtype = None
+            # Empty arrays can't be mapped
+            if dtype is not None and not dtype.hasobject and dtype.itemsize and all(shape):
+                return _np.memmap(filename, dtype, 'r', f.tell(), shape, 'F' if fortran else 'C')
+            f.seek(offset)
+        return _np.lib.format.read_array(f)
+
+    def close(self):
+        for f, deletefile in self.bundles.itervalues():
+            f.close()
+            if deletefile:
+                os.remove(f.name)
 
 class noneHelper(flatteningHelper):
     TYPE_NAME = "__None__"
@@ -449,6 +838,7 @@ class uuidHelper(flatteningHelper):
         return uuid.UUID(obj[CONTENT])
 
 class stackTraceElementHelper(object):
+    DISPATCH_BY_TYPE = True
     TYPE_NAME = "java.lang.StackTraceElement"
     DECLARINGCLASS = "declaringClass"
     METHODNAME = "methodName"
@@ -582,44 +972,244 @@ class exceptionHelper(flatteningHelper):
         else:
             return Exception(excheader)
     
-helpers = [noneHelper(), roiListHelper.getLineListHelper(), roiListHelper.getPointListHelper(),
+# Containers and plain values are handled by flatten and unflatten
+# themselves rather than by calling these, see _flattenall
+_dictHelper = dictHelper()
+_passThroughHelper = passThroughHelper()
+_listAndTupleHelper = listAndTupleHelper()
+
+helpers = [noneHelper(), referenceHelper(), roiListHelper.getLineListHelper(), roiListHelper.getPointListHelper(),
            roiListHelper.getSectorListHelper(), roiListHelper.getRectangleListHelper(),
            roiListHelper.getCircleListHelper(), roiListHelper.getEllipseListHelper(),
-           roiHelper.getRectangleHelper(), roiHelper.getSectorHelper(),
-           roiHelper.getCircleHelper(), roiHelper.getEllipseHelper(),
-           roiHelper.getLineHelper(), roiHelper.getPointHelper(), roiHelper.getROIBaseHelper(), 
-           ndArrayHelper(), guiBeanHelper(),
-           guiParametersHelper(), plotModeHelper(), axisMapBeanHelper(),
-           datasetWithAxisInformationHelper(), dataBeanHelper(),
-           dictHelper(), passThroughHelper(), listAndTupleHelper(),
+           roiArrayHelper.getLineArrayHelper(), roiArrayHelper.getPointArrayHelper(),
+           roiArrayHelper.getSectorArrayHelper(), roiArrayHelper.getRectangleArrayHelper(),
+           roiArrayHelper.getCircleArrayHelper(), roiArrayHelper.getEllipseArrayHelper(),
+           fieldsHelper(_roi.rectangle, "org.eclipse.triquetrum.scisoft.analysis.roi.RectangularROI"),
+           fieldsHelper(_roi.sector, "org.eclipse.triquetrum.scisoft.analysis.roi.SectorROI"),
+           fieldsHelper(_roi.circle, "org.eclipse.triquetrum.scisoft.analysis.roi.CircularROI"),
+           fieldsHelper(_roi.ellipse, "org.eclipse.triquetrum.scisoft.analysis.roi.EllipticalROI"),
+           fieldsHelper(_roi.line, "org.eclipse.triquetrum.scisoft.analysis.roi.LinearROI"),
+           fieldsHelper(_roi.point, "org.eclipse.triquetrum.scisoft.analysis.roi.PointROI"),
+           fieldsHelper(_roi.roibase, "org.eclipse.triquetrum.scisoft.analysis.roi.ROIBase"),
+           ndArrayHelper(), _packedDoubleArrayHelper, _packedIntArrayHelper, guiBeanHelper(),
+           guiParametersHelper(), plotModeHelper(),
+           fieldsHelper(_beans.axismapbean, "org.eclipse.triquetrum.scisoft.analysis.plotserver.AxisMapBean"),
+           fieldsHelper(_beans.datasetwithaxisinformation,
+                        "org.eclipse.triquetrum.scisoft.analysis.plotserver.DataSetWithAxisInformation"),
+           fieldsHelper(_beans.databean, "org.eclipse.triquetrum.scisoft.analysis.plotserver.DataBean"),
+           _dictHelper, _passThroughHelper, _listAndTupleHelper,
            uuidHelper(), exceptionHelper(), stackTraceElementHelper(), unicodeHelper()]
 
+# The helper found for each type of object flattened, and for each __type__
+# of dict (or type of other object) unflattened. Only filled in when the
+# helper, and all helpers before it, have DISPATCH_BY_TYPE, so that any other
+# object with the same key would be given the same helper.
+_flatteners = dict()
+_unflatteners = dict()
+
 def addhelper(helper):
     helpers.insert(0, helper)
+    _flatteners.clear()
+    _unflatteners.clear()
 
-def flatten(obj):
+def registerfields(typeObj, typeName, fields=None):
+    '''
+    Flatten instances of typeObj to a dict of the attributes named in fields,
+    with __type__ typeName, and unflatten such dicts back to instances of
+    typeObj. See fieldsHelper for the form of fields. The helper made is added
+    before all others, as by addhelper.
+    '''
+    addhelper(fieldsHelper(typeObj, typeName, fields))
+
+def _findhelper(cache, key, can, obj):
+    '''
+    Return the first helper for which can(helper, obj) is true, or None,
+    remembering it in cache under key if that is allowed
+    '''
+    bytype = key is not None
     for thisHelper in helpers:
-        if thisHelper.canflatten(obj):
-            return thisHelper.flatten(obj)
-    raise TypeError("Object " + repr(obj) + " cannot be flattened")
-        
+        bytype = bytype and getattr(thisHelper, 'DISPATCH_BY_TYPE', False)
+        if can(thisHelper, obj):
+            if bytype:
+                cache[key] = thisHelper
+            return thisHelper
+    return None
+
+def _flattener(obj):
+    key = type(obj)
+    helper = _flatteners.get(key)
+    if helper is None:
+        helper = _findhelper(_flatteners, key, _canflatten, obj)
+    return helper
+
+def _unflattener(obj):
+    key = type(obj)
+    if key is dict:
+        key = obj.get(TYPE)
+        if not isinstance(key, basestring):
+            key = dict
+    elif isinstance(obj, dict):
+        # A subclass of dict, which may be told apart by its __type__ too
+        return _findhelper(None, None, _canunflatten, obj)
+    helper = _unflatteners.get(key)
+    if helper is None:
+        helper = _findhelper(_unflatteners, key, _canunflatten, obj)
+    return helper
+
+def _canflatten(helper, obj):
+    return helper.canflatten(obj)
+
+def _canunflatten(helper, obj):
+    return helper.canunflatten(obj)
+
+# The _flattening of the call to flatten, and the _unflattening of the call
+# to unflatten, each thread is in. Calls made by helpers for what an object
+# contains are part of the outermost call.
+_local = threading.local()
+
+def flatten(obj):
+    flattening = getattr(_local, 'flattening', None)
+    if flattening is None:
+        _local.flattening = flattening = _flattening()
+        completed = False
+        try:
+            rval = flatten(obj)
+            completed = True
+        finally:
+            _local.flattening = None
+            flattening.close(completed)
+        return rval
+    thisHelper = _flattener(obj)
+    if thisHelper is _listAndTupleHelper or thisHelper is _dictHelper:
+        return _flattenall(obj, flattening)
+    if thisHelper is None:
+        raise TypeError("Object " + repr(obj) + " cannot be flattened")
+    return _flattenwith(thisHelper, obj, flattening)
+
+def _flattenwith(helper, obj, flattening):
+    if not getattr(helper, 'SHARED', False):
+        return helper.flatten(obj)
+    flat = flattening.reference(obj)
+    if flat is None:
+        flat = helper.flatten(obj)
+        flattening.add(obj, flat)
+    return flat
+
 def unflatten(obj):
-    for thisHelper in helpers:
-        if thisHelper.canunflatten(obj):
-            return thisHelper.unflatten(obj)
-    raise TypeError("Object " + repr(obj) + " cannot be unflattened")
+    unflattening = getattr(_local, 'unflattening', None)
+    if unflattening is None:
+        _local.unflattening = unflattening = _unflattening()
+        try:
+            return unflatten(obj)
+        finally:
+            _local.unflattening = None
+            unflattening.close()
+    shared = unflattening.shared
+    thisHelper = _unflattener(obj)
+    if thisHelper is _listAndTupleHelper or thisHelper is _dictHelper:
+        return _unflattenall(obj, shared)
+    if thisHelper is None:
+        raise TypeError("Object " + repr(obj) + " cannot be unflattened")
+    return _unflattenwith(thisHelper, obj, shared)
+
+def _unflattenwith(helper, obj, shared):
+    rval = helper.unflatten(obj)
+    if isinstance(obj, dict) and ID in obj:
+        shared[obj[ID]] = rval
+    return rval
+
+def _shareddict(keys, values, append, shared, n):
+    rval = dict(izip(keys, values))
+    append(rval)
+    if n is not None:
+        shared[n] = rval
+
+# _flattenall and _unflattenall walk nested lists, tuples and dicts with a
+# stack of their own instead of recursing, so the depth of a payload is not
+# limited by the recursion limit and costs no Python call per level. Their
+# output is the same as that of listAndTupleHelper and dictHelper. Other
+# helpers are called as usual, and recurse for what they contain.
+#
+# The stack holds an iterator of (item, append) pairs for each container
+# being worked through, append adding the item's flattened form to where it
+# belongs, and a function to call once the container is done, or None.
+
+def _flattenall(obj, flattening):
+    rval = []
+    stack = [(izip((obj,), repeat(rval.append)), None)]
+    while stack:
+        for item, append in stack[-1][0]:
+            thisHelper = _flattener(item)
+            if thisHelper is _passThroughHelper:
+                append(item)
+            elif thisHelper is _listAndTupleHelper:
+                outList = []
+                append(outList)
+                stack.append((izip(item, repeat(outList.append)), None))
+                break
+            elif thisHelper is _dictHelper:
+                outDict = flattening.reference(item)
+                if outDict is not None:
+                    append(outDict)
+                    continue
+                outDict = dict()
+                outDict[TYPE] = dictHelper.TYPE_NAME
+                outDict[dictHelper.KEYS] = keys = []
+                outDict[dictHelper.VALUES] = values = []
+                append(outDict)
+                flattening.add(item, outDict)
+                # Keys first, as dictHelper does
+                stack.append((izip(item.itervalues(), repeat(values.append)), None))
+                stack.append((izip(item.iterkeys(), repeat(keys.append)), None))
+                break
+            elif thisHelper is None:
+                raise TypeError("Object " + repr(item) + " cannot be flattened")
+            else:
+                append(_flattenwith(thisHelper, item, flattening))
+        else:
+            stack.pop()
+    return rval[0]
+
+def _unflattenall(obj, shared):
+    rval = []
+    stack = [(izip((obj,), repeat(rval.append)), None)]
+    while stack:
+        items, done = stack[-1]
+        for item, append in items:
+            thisHelper = _unflattener(item)
+            if thisHelper is _passThroughHelper:
+                append(item)
+            elif thisHelper is _listAndTupleHelper:
+                outList = []
+                append(outList)
+                stack.append((izip(item, repeat(outList.append)), None))
+                break
+            elif thisHelper is _dictHelper:
+                # Keys must be complete before going in the dict, so it is
+                # made once they and the values are unflattened, when the
+                # values are done
+                keys = []
+                values = []
+                finish = lambda keys=keys, values=values, append=append, n=item.get(ID): \
+                    _shareddict(keys, values, append, shared, n)
+                stack.append((izip(item[dictHelper.VALUES], repeat(values.append)), finish))
+                stack.append((izip(item[dictHelper.KEYS], repeat(keys.append)), None))
+                break
+            elif thisHelper is None:
+                raise TypeError("Object " + repr(item) + " cannot be unflattened")
+            else:
+                append(_unflattenwith(thisHelper, item, shared))
+        else:
+            stack.pop()
+            if done is not None:
+                done()
+    return rval[0]
 
 def canflatten(obj):
-    for thisHelper in helpers:
-        if thisHelper.canflatten(obj):
-            return True
-    return False
+    return _flattener(obj) is not None
         
 def canunflatten(obj):
-    for thisHelper in helpers:
-        if thisHelper.canunflatten(obj):
-            return True
-    return False
+    return _unflattener(obj) is not None
         
 
         
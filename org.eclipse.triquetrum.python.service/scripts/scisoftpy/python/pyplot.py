@@ -24,32 +24,52 @@ via a temporary file written in NumPy file format.
 
 import scisoftpy.python.pyrpc as _rpc
 import os
+import threading
 
 _RPC_CONNECTION_PORT = 0
+_RPC_MAX_CONNECTIONS = 4
 _RPC_CLIENT = None
-
-def setremoteport(rpcport=0, **kwargs):
-    '''Sets the Analysis RPC Connection Port to the rpcport arg'''
-    global _RPC_CONNECTION_PORT
-    _RPC_CONNECTION_PORT = rpcport
-    global _RPC_CLIENT
-    _RPC_CLIENT = None # ditch cached client
+_RPC_CLIENT_LOCK = threading.Lock()
+
+def setremoteport(rpcport=0, maxconnections=None, **kwargs):
+    '''Sets the Analysis RPC Connection Port to the rpcport arg.
+    maxconnections, if given, limits how many plot calls from different
+    threads can be in flight at once'''
+    global _RPC_CONNECTION_PORT, _RPC_MAX_CONNECTIONS, _RPC_CLIENT
+    _RPC_CLIENT_LOCK.acquire()
+    try:
+        _RPC_CONNECTION_PORT = rpcport
+        if maxconnections is not None:
+            _RPC_MAX_CONNECTIONS = maxconnections
+        if _RPC_CLIENT is not None:
+            _RPC_CLIENT.close()
+        _RPC_CLIENT = None # ditch cached client
+    finally:
+        _RPC_CLIENT_LOCK.release()
         
 def _get_rpcclient():
     '''Get an RPC Client for the currently selected port. This implementation allows the port
-    number to be changed at runtime'''
+    number to be changed at runtime. The client is shared by all threads, each
+    concurrent call gets its own pooled connection'''
     global _RPC_CLIENT
-    if _RPC_CLIENT is None:
-        if _RPC_CONNECTION_PORT == 0:
-            try:
-                port = int(os.getenv('SCISOFT_RPC_PORT'))
-            except:
-                raise Exception("Failed to determine correct port, either ensure SCISOFT_RPC_PORT or call scisoftpy.plot.setremoteport(...)")
-        else:
-            port = _RPC_CONNECTION_PORT
-            
-        _RPC_CLIENT = _rpc.rpcclient(port)
-    return _RPC_CLIENT
+    client = _RPC_CLIENT
+    if client is not None:
+        return client
+    _RPC_CLIENT_LOCK.acquire()
+    try:
+        if _RPC_CLIENT is None:
+            if _RPC_CONNECTION_PORT == 0:
+                try:
+                    port = int(os.getenv('SCISOFT_RPC_PORT'))
+                except:
+                    raise Exception("Failed to determine correct port, either ensure SCISOFT_RPC_PORT or call scisoftpy.plot.setremoteport(...)")
+            else:
+                port = _RPC_CONNECTION_PORT
+                
+            _RPC_CLIENT = _rpc.rpcclient(port, _RPC_MAX_CONNECTIONS)
+        return _RPC_CLIENT
+    finally:
+        _RPC_CLIENT_LOCK.release()
 
         
 _plot_name_remapper = {
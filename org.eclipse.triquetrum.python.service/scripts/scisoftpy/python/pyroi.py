@@ -15,14 +15,24 @@
 ###
 
 import math as _math
+from operator import attrgetter as _attrgetter
+import numpy as _np #@UnresolvedImport
 
 class _iroi(object):
-    pass
+    __slots__ = ()
 
 class roibase(_iroi):
+    '''
+    Base of all ROIs. The attributes of a ROI are its _FIELDS and are held in
+    __slots__, so a ROI has no __dict__ unless it is of a subclass that does
+    not declare __slots__ itself.
+    '''
     _NAME = "name"
     _SPT = "spt"
     _PLOT = "plot"
+    # Attributes sent when flattened and their kinds, see pyflatten.fieldsHelper
+    _FIELDS = ((_NAME, None), (_SPT, "floats"), (_PLOT, "bool"))
+    __slots__ = (_NAME, _SPT, _PLOT)
 
     def __init__(self, name='', point=[0.0,0.0], spt=None, plot=False, **kwargs):
         super(roibase, self).__init__()
@@ -35,13 +45,25 @@ class roibase(_iroi):
     
     def __eq__(self, other):
         return (isinstance(other, self.__class__)
-            and self.__dict__ == other.__dict__)
+            and self._getfields(self) == other._getfields(other)
+            # only subclasses without __slots__ have a __dict__ to compare
+            and (not self.__class__.__dictoffset__ or self.__dict__ == other.__dict__))
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __repr__(self):
-        return "%s(%s)" % (self.__class__.__name__, self.__dict__.__repr__())
+        return "%s(%s)" % (self.__class__.__name__, self.__getstate__().__repr__())
+
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', ()))
+        for name, _kind in self._FIELDS:
+            state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            setattr(self, k, v)
 
     def getPoint(self):
         return self.spt
@@ -58,10 +80,18 @@ class roibase(_iroi):
         self.plot = bool(p)
 
     def copy(self):
-        from copy import deepcopy
-        return deepcopy(self)
+        rval = object.__new__(self.__class__)
+        for name, _kind in self._FIELDS:
+            value = getattr(self, name)
+            setattr(rval, name, value[:] if isinstance(value, list) else value)
+        if hasattr(self, '__dict__'):
+            from copy import deepcopy
+            rval.__dict__.update(deepcopy(self.__dict__))
+        return rval
 
 class point(roibase):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super(point, self).__init__(**kwargs)
 
@@ -69,6 +99,8 @@ class line(roibase):
     _LEN = "len"
     _ANG = "ang"
     _CROSS_HAIR = "crossHair"
+    _FIELDS = roibase._FIELDS + ((_LEN, "float"), (_ANG, "float"), (_CROSS_HAIR, "bool"))
+    __slots__ = (_LEN, _ANG, _CROSS_HAIR)
 
     def __init__(self, length=0.0, len=None, angle=0.0, ang=None, angledegrees=None, crossHair=False, **kwargs): #@ReservedAssignment
         super(line, self).__init__(**kwargs)
@@ -106,6 +138,8 @@ class rectangle(roibase):
     _LEN = "len"
     _ANG = "ang"
     _CLIPPING_COMPENSATION = "clippingCompensation"
+    _FIELDS = roibase._FIELDS + ((_LEN, "floats"), (_ANG, "float"), (_CLIPPING_COMPENSATION, "bool"))
+    __slots__ = (_LEN, _ANG, _CLIPPING_COMPENSATION)
     
     def __init__(self, lengths=[0.0,0.0], len=None, angle=0.0, ang=None, angledegrees=None, clippingCompensation=False, **kwargs): #@ReservedAssignment
         super(rectangle, self).__init__(**kwargs)
@@ -146,6 +180,9 @@ class sector(roibase):
     _SYMMETRY = "symmetry"
     _COMBINE_SYMMETRY = "combineSymmetry"
     _AVERAGE_AREA = "averageArea"
+    _FIELDS = roibase._FIELDS + ((_ANG, "floats"), (_RAD, "floats"), (_CLIPPING_COMPENSATION, "bool"),
+                                 (_SYMMETRY, "int"), (_COMBINE_SYMMETRY, "bool"), (_AVERAGE_AREA, "bool"))
+    __slots__ = (_ANG, _RAD, _CLIPPING_COMPENSATION, _SYMMETRY, _COMBINE_SYMMETRY, _AVERAGE_AREA)
     
     # Symmetry options
     NONE = 0
@@ -215,6 +252,8 @@ class sector(roibase):
 
 class circle(roibase):
     _RAD = "rad"
+    _FIELDS = roibase._FIELDS + ((_RAD, "float"),)
+    __slots__ = (_RAD,)
     
     def __init__(self, radius=1.0, rad=None, **kwargs): #@ReservedAssignment
         super(circle, self).__init__(**kwargs)
@@ -231,6 +270,8 @@ class circle(roibase):
 class ellipse(roibase):
     _SAXIS = "saxis"
     _ANG = "ang"
+    _FIELDS = roibase._FIELDS + ((_SAXIS, "floats"), (_ANG, "float"))
+    __slots__ = (_SAXIS, _ANG)
     
     def __init__(self, semiaxes=[0.0,0.0], saxis=None, angle=0.0, ang=None, angledegrees=None, **kwargs): #@ReservedAssignment
         super(ellipse, self).__init__(**kwargs)
@@ -263,6 +304,11 @@ class ellipse(roibase):
 
     angledegrees = property(getAngleDegrees, setAngleDegrees)
 
+# Return the values of the fields of a ROI as a tuple, for __eq__
+for _cls in (roibase, point, line, rectangle, sector, circle, ellipse):
+    _cls._getfields = staticmethod(_attrgetter(*[name for name, _kind in _cls._FIELDS]))
+del _cls
+
 class roi_list(list):
     def __init__(self):
         super(roi_list, self).__init__()
@@ -298,4 +344,192 @@ class circle_list(roi_list):
 class ellipse_list(roi_list):
     _pcls = ellipse
 
+# dtype and shape of one element of the column of a field of each kind, see
+# roibase._FIELDS. Fields of kind None are held in a list
+_COLUMN_KINDS = {"float": (_np.float64, ()), "floats": (_np.float64, (2,)), "int": (_np.int32, ()),
+                 "bool": (_np.bool_, ())}
+
+class roi_array(object):
+    '''
+    A list of ROIs of one class held as a column per field rather than as ROI
+    objects: a numpy array for each numeric or boolean field (2 columns wide
+    for fields such as spt that hold a pair) and a list for the rest. Much
+    smaller than a roi_list of many ROIs and flattened as a whole column at a
+    time.
+
+    Indexing and iterating return new ROI objects made from the columns, so
+    changing one does not change the roi_array, assign it back to do that.
+    '''
+    def __init__(self, rois=None):
+        self._size = 0
+        self._columns = dict()
+        for name, kind in self._pcls._FIELDS:
+            if kind is None:
+                self._columns[name] = []
+            else:
+                dtype, shape = _COLUMN_KINDS[kind]
+                self._columns[name] = _np.empty((0,) + shape, dtype)
+        if rois is not None:
+            self.extend(rois)
+
+    @classmethod
+    def fromcolumns(cls, **columns):
+        '''
+        Make a roi_array from its columns, given by field name. All must have
+        the same length, fields not given get the value of a default ROI.
+        Arrays of the right dtype are used as they are, not copied.
+        '''
+        rval = cls()
+        sizes = set(len(c) for c in columns.itervalues())
+        if len(sizes) > 1:
+            raise ValueError("Columns must all have the same length")
+        size = sizes.pop() if sizes else 0
+        default = cls._pcls()
+        for name, kind in cls._pcls._FIELDS:
+            column = columns.get(name)
+            if kind is None:
+                rval._columns[name] = list(column) if column is not None else [getattr(default, name)] * size
+                continue
+            dtype, shape = _COLUMN_KINDS[kind]
+            if column is None:
+                column = _np.empty((size,) + shape, dtype)
+                column[...] = getattr(default, name)
+            else:
+                column = _np.asarray(column, dtype)
+                if column.shape != (size,) + shape:
+                    raise ValueError("Column %s must have shape %s" % (name, (size,) + shape))
+                if not column.flags.writeable:
+                    column = column.copy()
+            rval._columns[name] = column
+        rval._size = size
+        return rval
+
+    def column(self, name):
+        '''
+        Return the column of the named field, a view that changes with this
+        roi_array (or a list, for non-numeric fields)
+        '''
+        return self._columns[name][:self._size]
+
+    @property
+    def points(self):
+        return self.column(roibase._SPT)
+
+    def __len__(self):
+        return self._size
+
+    def _index(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("roi_array index out of range")
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            columns = dict()
+            for name, kind in self._pcls._FIELDS:
+                column = self.column(name)[index]
+                columns[name] = column if kind is None else column.copy()
+            return self.fromcolumns(**columns)
+        index = self._index(index)
+        rval = object.__new__(self._pcls)
+        for name, kind in self._pcls._FIELDS:
+            value = self._columns[name][index]
+            if kind == "floats":
+                value = value.tolist()
+            elif kind is not None:
+                value = value.item()
+            setattr(rval, name, value)
+        return rval
+
+    def __setitem__(self, index, item):
+        if not isinstance(item, self._pcls):
+            raise TypeError, "Item is wrong type"
+        index = self._index(index)
+        for name, _kind in self._pcls._FIELDS:
+            self._columns[name][index] = getattr(item, name)
+
+    def __iter__(self):
+        for i in xrange(self._size):
+            yield self[i]
+
+    def append(self, item):
+        if not isinstance(item, self._pcls):
+            raise TypeError, "Item is wrong type"
+        capacity = len(self._columns[roibase._SPT])
+        if self._size == capacity:
+            capacity = max(16, 2 * capacity)
+            for name, kind in self._pcls._FIELDS:
+                if kind is not None:
+                    old = self._columns[name]
+                    new = _np.empty((capacity,) + old.shape[1:], old.dtype)
+                    new[:self._size] = old[:self._size]
+                    self._columns[name] = new
+        for name, kind in self._pcls._FIELDS:
+            if kind is None:
+                self._columns[name].append(getattr(item, name))
+            else:
+                self._columns[name][self._size] = getattr(item, name)
+        self._size += 1
+
+    add = append # cover Java list usage
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def tolist(self):
+        '''
+        Return the ROIs in a roi_list of the matching class
+        '''
+        rval = self._lcls()
+        for item in self:
+            rval.append(item)
+        return rval
+
+    # mutable, not hashable
+    __hash__ = None
+
+    def __eq__(self, other):
+        if not isinstance(other, self.__class__) or len(other) != len(self):
+            return False
+        for name, kind in self._pcls._FIELDS:
+            if kind is None:
+                if self.column(name) != other.column(name):
+                    return False
+            elif not _np.array_equal(self.column(name), other.column(name)):
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, list(self))
+
+class point_array(roi_array):
+    _pcls = point
+    _lcls = point_list
+
+class line_array(roi_array):
+    _pcls = line
+    _lcls = line_list
+
+class rectangle_array(roi_array):
+    _pcls = rectangle
+    _lcls = rectangle_list
+
+class sector_array(roi_array):
+    _pcls = sector
+    _lcls = sector_list
+
+class circle_array(roi_array):
+    _pcls = circle
+    _lcls = circle_list
+
+class ellipse_array(roi_array):
+    _pcls = ellipse
+    _lcls = ellipse_list
+
 from pyprofile import profile  # @UnusedImport
@@ -19,8 +19,23 @@ AnalysisRpc implementation in Python
 '''
 from SocketServer import ThreadingMixIn
 from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
-from xmlrpclib import ServerProxy
+from xmlrpclib import ServerProxy, Transport, Fault, ProtocolError
+import xmlrpclib
+import httplib
+import errno
+import socket
+import threading
+import Queue
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import cPickle
+import os
+import sys
+import time
+import traceback
 import scisoftpy.python.pyflatten as _flatten
+import scisoftpy.python.pybinrpc as _binrpc
+import scisoftpy.python.pyshm as _shm
 
 class _method:
     def __init__(self, send, destination):
@@ -30,27 +45,513 @@ class _method:
         return self._send(self._destination, args)
 
 class RequestHandler(SimpleXMLRPCRequestHandler):
-    rpc_paths = ('/RPC2',)
-    
+    rpc_paths = ('/RPC2', _binrpc.PATH)
+    # Speak HTTP/1.1 so that clients can keep the connection open
+    # across requests instead of reconnecting for every call.
+    protocol_version = "HTTP/1.1"
+    # Buffer the response so the status line, headers and body go out
+    # in one write, and disable Nagle so that write is not held back
+    # waiting for the client's (delayed) ACK of the previous response.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # TCP_NODELAY can't be set on a Unix domain socket
+        if self.server.address_family != socket.AF_INET:
+            self.disable_nagle_algorithm = False
+        SimpleXMLRPCRequestHandler.setup(self)
+
+    def address_string(self):
+        # Unix domain socket clients have no (host, port) address
+        if not isinstance(self.client_address, tuple):
+            return "unix"
+        return SimpleXMLRPCRequestHandler.address_string(self)
+
+    def do_POST(self):
+        if self.path != _binrpc.PATH:
+            return SimpleXMLRPCRequestHandler.do_POST(self)
+        # Same dispatch as XML-RPC, only the encoding differs (see pybinrpc)
+        try:
+            data = self.rfile.read(int(self.headers["content-length"]))
+            try:
+                method, params = _binrpc.loads_request(data)
+                response = _binrpc.dumps_response(self.server._dispatch(method, params))
+            except Fault, fault:
+                response = _binrpc.dumps_fault(fault.faultCode, fault.faultString)
+            except:
+                exc_type, exc_value = sys.exc_info()[:2]
+                response = _binrpc.dumps_fault(1, "%s:%s" % (exc_type, exc_value))
+        except Exception:
+            self.send_response(500)
+            self.send_header("Content-length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-type", _binrpc.CONTENT_TYPE)
+        self.send_header("Content-length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
 class ThreadedSimpleXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
-    pass
+    # A keep-alive connection holds its handler thread until the client
+    # disconnects, don't let idle connections stop the process exiting
+    daemon_threads = True
+
+class PooledRequestHandler(RequestHandler):
+    # A pool worker serves one connection at a time, so an idle keep-alive
+    # connection must not hold on to it forever.
+    timeout = 10
+
+    def end_headers(self):
+        # Give the worker back after this response if other connections
+        # are queued waiting for one.
+        if self.server.has_waiting_connections():
+            self.send_header("Connection", "close")
+        RequestHandler.end_headers(self)
+
+class BusyRequestHandler(RequestHandler):
+    '''
+    Answers every request with 503 Service Unavailable and closes the
+    connection. Used by PooledSimpleXMLRPCServer when its queue is full.
+    '''
+    def do_POST(self):
+        # Read the request fully so that the client gets the response
+        # rather than a connection reset
+        size_remaining = int(self.headers.get("content-length", 0))
+        while size_remaining > 0:
+            chunk = self.rfile.read(min(size_remaining, 64 * 1024))
+            if not chunk:
+                break
+            size_remaining -= len(chunk)
+        self.send_response(503, "Server busy")
+        self.send_header("Retry-After", "1")
+        self.send_header("Content-length", "0")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+class PooledSimpleXMLRPCServer(SimpleXMLRPCServer):
+    '''
+    XML-RPC Server that handles connections on a fixed number of worker
+    threads. Accepted connections wait in a queue of at most queuesize
+    entries, connections accepted while that queue is full are answered
+    with a busy response (see BusyRequestHandler).
+    '''
+    # Time a rejected client is allowed to send its request
+    busy_timeout = 1
+    # Busy responses sent at once, further rejected connections are closed
+    max_rejecting = 16
+
+    def __init__(self, addr, workers, queuesize, requestHandler=PooledRequestHandler, **kwargs):
+        SimpleXMLRPCServer.__init__(self, addr, requestHandler=requestHandler, **kwargs)
+        self._queue = Queue.Queue(queuesize)
+        self._active = set()
+        self._rejecters = set()
+        self._active_lock = threading.Lock()
+        self._closing = False
+        self._rejecting = threading.BoundedSemaphore(self.max_rejecting)
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._process_requests, name="rpcserver-worker-%d" % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _process_requests(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            self._active_lock.acquire()
+            try:
+                self._active.add(request)
+                if self._closing:
+                    self._stop_reading(request)
+            finally:
+                self._active_lock.release()
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            self._active_lock.acquire()
+            try:
+                self._active.discard(request)
+            finally:
+                self._active_lock.release()
+            self.shutdown_request(request)
+
+    def _stop_reading(self, request):
+        # The request being handled is answered, then reading the next one
+        # sees the end of the connection
+        try:
+            request.shutdown(socket.SHUT_RD)
+        except socket.error:
+            pass
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+        except Queue.Full:
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address):
+        # Answered on a thread of its own, so that a slow client doesn't
+        # hold up accepting the next connection
+        if not self._rejecting.acquire(False):
+            self.shutdown_request(request)
+            return
+        thread = None
+        self._active_lock.acquire()
+        try:
+            if self._closing:
+                self._rejecting.release()
+                self.shutdown_request(request)
+                return
+            thread = threading.Thread(target=self._send_busy, args=(request, client_address))
+            thread.daemon = True
+            self._active.add(request)
+            self._rejecters.add(thread)
+            thread.start()
+        except:
+            self._active.discard(request)
+            self._rejecters.discard(thread)
+            self._rejecting.release()
+            self.shutdown_request(request)
+        finally:
+            self._active_lock.release()
+
+    def _send_busy(self, request, client_address):
+        try:
+            try:
+                request.settimeout(self.busy_timeout)
+                BusyRequestHandler(request, client_address, self)
+            except:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+        finally:
+            self._active_lock.acquire()
+            try:
+                self._active.discard(request)
+                self._rejecters.discard(threading.current_thread())
+            finally:
+                self._active_lock.release()
+            self._rejecting.release()
+
+    def has_waiting_connections(self):
+        return not self._queue.empty()
+
+    def server_close(self):
+        SimpleXMLRPCServer.server_close(self)
+        self._active_lock.acquire()
+        try:
+            self._closing = True
+            for request in self._active:
+                self._stop_reading(request)
+            rejecters = list(self._rejecters)
+        finally:
+            self._active_lock.release()
+        # Connections still waiting are not served
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not None:
+                self.shutdown_request(item[0])
+        for _worker in self._workers:
+            self._queue.put(None)
+        current = threading.current_thread()
+        for thread in self._workers + rejecters:
+            if thread is not current:
+                thread.join()
+        self._workers = []
+
+if hasattr(socket, 'AF_UNIX'):
+    class ThreadedUnixXMLRPCServer(ThreadedSimpleXMLRPCServer):
+        address_family = socket.AF_UNIX
+
+    class PooledUnixXMLRPCServer(PooledSimpleXMLRPCServer):
+        address_family = socket.AF_UNIX
+
+class _KeepAliveHTTPConnection(httplib.HTTPConnection):
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+class _UnixHTTPConnection(httplib.HTTPConnection):
+    '''
+    HTTPConnection to a server listening on a Unix domain socket at path
+    '''
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self._path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._path)
+        except:
+            sock.close()
+            raise
+        self.sock = sock
+
+def _unix_connection_factory(path):
+    return lambda host: _UnixHTTPConnection(path)
+
+class KeepAliveTransport(Transport):
+    '''
+    XML-RPC Transport that keeps a single HTTP/1.1 connection open and
+    reuses it for every request. If the cached connection has been
+    closed by the server, Transport.request reconnects and retries once.
+    connection_factory is called with the host to create the connection.
+    '''
+    def __init__(self, connection_factory=_KeepAliveHTTPConnection):
+        Transport.__init__(self)
+        self._connection_factory = connection_factory
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        chost, self._extra_headers, _x509 = self.get_host_info(host)
+        self._connection = host, self._connection_factory(chost)
+        return self._connection[1]
+
+class BinaryServerProxy(object):
+    '''
+    Counterpart of ServerProxy that sends calls in the binary encoding of
+    pybinrpc, over a single keep-alive connection. Remote methods are
+    called as on a ServerProxy, e.g. proxy.Analysis.handler(...)
+    '''
+    def __init__(self, host, connection_factory=_KeepAliveHTTPConnection):
+        self._host = host
+        self._connection_factory = connection_factory
+        self._connection = None
+
+    def _request(self, methodname, params):
+        body = _binrpc.dumps_request(methodname, params)
+        # Retry once if the server closed the kept alive connection
+        for attempt in (0, 1):
+            try:
+                return self._single_request(body)
+            except socket.error, e:
+                if attempt or e.errno not in (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE):
+                    raise
+            except httplib.BadStatusLine:
+                if attempt:
+                    raise
+
+    def _single_request(self, body):
+        if self._connection is None:
+            self._connection = self._connection_factory(self._host)
+        try:
+            self._connection.request("POST", _binrpc.PATH, body,
+                                     {"Content-Type": _binrpc.CONTENT_TYPE})
+            response = self._connection.getresponse(buffering=True)
+            data = response.read()
+        except:
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        if response.status != 200:
+            raise ProtocolError(self._host + _binrpc.PATH, response.status,
+                                response.reason, response.msg)
+        return _binrpc.loads_response(data)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __getattr__(self, name):
+        return xmlrpclib._Method(self._request, name)
+
+class _proxypool(object):
+    '''
+    A bounded pool of ServerProxy instances, each with its own keep-alive
+    connection. A ServerProxy must not be used by two threads at once, so
+    callers checkout a proxy for the duration of one call and checkin
+    afterwards. Proxies are created lazily, up to maxsize; once that many
+    are in use checkout blocks until one is returned.
+    If binary is True the first proxy asks the server which transports it
+    supports and, if it has the binary one, all proxies are created as
+    BinaryServerProxy. Otherwise, or if the server predates the binary
+    transport, ServerProxy (XML-RPC) is used.
+    connection_factory creates the connections, see KeepAliveTransport.
+    '''
+    def __init__(self, url, maxsize, binary=False, connection_factory=_KeepAliveHTTPConnection):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self._url = url
+        self._host = url.split("://", 1)[1]
+        self._connection_factory = connection_factory
+        self._maxsize = maxsize
+        self._binary = binary
+        self._negotiated = not binary
+        self._created = 0
+        self._free = []
+        self._transports = dict()
+        self._cond = threading.Condition()
+
+    def checkout(self):
+        self._cond.acquire()
+        try:
+            while not self._free and self._created >= self._maxsize:
+                self._cond.wait()
+            if self._free:
+                return self._free.pop()
+            self._created += 1
+        finally:
+            self._cond.release()
+        if self._binary and self._negotiated:
+            proxy = BinaryServerProxy(self._host, self._connection_factory)
+            self._transports[id(proxy)] = proxy
+            return proxy
+        transport = KeepAliveTransport(self._connection_factory)
+        proxy = ServerProxy(self._url, transport=transport)
+        if not self._negotiated:
+            proxy = self._negotiate(proxy, transport)
+            if isinstance(proxy, BinaryServerProxy):
+                transport = proxy
+        self._transports[id(proxy)] = transport
+        return proxy
+
+    def _negotiate(self, proxy, transport):
+        try:
+            transports = proxy.Analysis.transports()
+        except Fault:
+            # A server without Analysis.transports only speaks XML-RPC
+            transports = []
+        except Exception:
+            # Server not reachable (yet), ask again with the next proxy
+            return proxy
+        self._binary = _binrpc.NAME in transports
+        self._negotiated = True
+        if not self._binary:
+            return proxy
+        transport.close()
+        return BinaryServerProxy(self._host, self._connection_factory)
+
+    def checkin(self, proxy):
+        self._cond.acquire()
+        try:
+            self._free.append(proxy)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def close(self):
+        '''
+        Close the connections of all proxies not currently checked out.
+        The proxies stay in the pool and reconnect on next use.
+        '''
+        self._cond.acquire()
+        try:
+            for proxy in self._free:
+                self._transports[id(proxy)].close()
+        finally:
+            self._cond.release()
+
+# Handlers registered to run in worker processes, keyed by (id(server), name).
+# The workers are forked after the handlers are registered and look the
+# handler up here, so only the name and the (unflattened) arguments are
+# pickled across.
+_process_handlers = dict()
+
+def _process_worker_init(server_pid):
+    # Pool workers block on a pipe the other workers also hold open, so they
+    # would outlive a server that is killed without closing the pool.
+    def exit_with_server():
+        while os.getppid() == server_pid:
+            time.sleep(1)
+        os._exit(1)
+    watcher = threading.Thread(target=exit_with_server)
+    watcher.daemon = True
+    watcher.start()
+
+def _process_handler_call(key, args):
+    '''
+    Run a process handler in the worker. Returns (True, result) or
+    (False, exception), pickled, with the worker side traceback stored on
+    the exception as flatten_traceback as the flattener would send it.
+    The worker pickles them itself so that the server unpickles them in the
+    thread making the call: an object that fails to unpickle then fails
+    that call, rather than the pool's result thread and with it every call.
+    '''
+    try:
+        return True, cPickle.dumps(_process_handlers[key](*args), cPickle.HIGHEST_PROTOCOL)
+    except Exception, e:
+        (_etype, _value, tb) = sys.exc_info()
+        try:
+            stack = [s + ("",) for s in traceback.extract_tb(tb)[1:]]
+        finally:
+            _etype = _value = tb = None
+        e.flatten_traceback = stack
+        try:
+            # e.g. an exception whose __init__ takes other arguments
+            # pickles but doesn't unpickle
+            data = cPickle.dumps(e, cPickle.HIGHEST_PROTOCOL)
+            cPickle.loads(data)
+        except Exception:
+            e = Exception("%s: %s" % (e.__class__.__name__, e))
+            e.flatten_traceback = stack
+            data = cPickle.dumps(e, cPickle.HIGHEST_PROTOCOL)
+        return False, data
 
 class rpcserver(object):
     '''
     An AnalysisRpc Server to serve up Python functions to other processes via RPC
     '''
-    def __init__(self, port):
+    def __init__(self, port, workers=None, queuesize=None, processes=None):
         '''
         Create a new AnalysisRpc Server listening on the specified port
+        
+        If port is a string it is instead the path of a Unix domain socket
+        to listen on, which is created (replacing any stale socket file) and
+        removed again on close. Only where the platform has Unix domain
+        sockets.
+        
+        By default every connection is handled on a new thread. Pass workers
+        to handle connections on a fixed pool of that many threads instead,
+        with at most queuesize (default 4 * workers) connections waiting;
+        further connections get a busy (HTTP 503) response.
+        
+        processes is the number of worker processes used for handlers added
+        with process=True, default is the number of CPUs.
         '''
-        self._server = ThreadedSimpleXMLRPCServer(("127.0.0.1", port), requestHandler=RequestHandler, logRequests=False)
+        if isinstance(port, basestring):
+            if not hasattr(socket, 'AF_UNIX'):
+                raise ValueError("Unix domain sockets are not available on this platform")
+            self._path = port
+            if os.path.exists(port):
+                os.remove(port)
+            addr = port
+            threadedclass, pooledclass = ThreadedUnixXMLRPCServer, PooledUnixXMLRPCServer
+        else:
+            self._path = None
+            addr = ("127.0.0.1", port)
+            threadedclass, pooledclass = ThreadedSimpleXMLRPCServer, PooledSimpleXMLRPCServer
+        if workers is None:
+            self._server = threadedclass(addr, requestHandler=RequestHandler, logRequests=False)
+        else:
+            if queuesize is None:
+                queuesize = 4 * workers
+            self._server = pooledclass(addr, workers, queuesize, logRequests=False)
         self._server.register_introspection_functions()
         
         self._server.register_function(self._xmlrpchandler, 'Analysis.handler');
         self._server.register_function(self._xmlrpchandler_debug, 'Analysis.handler_debug');
+        self._server.register_function(self._xmlrpchandler_batch, 'Analysis.handler_batch');
         self._server.register_function(self._xmlrpc_is_alive, 'Analysis.is_alive');
+        self._server.register_function(self._xmlrpc_transports, 'Analysis.transports');
         self._server.register_function(self._xmlrpc_set_pydev_settrace_params, 'Analysis.set_pydev_settrace_params');
         self._handlers = dict()
+        self._process_handler_names = set()
+        self._processes = processes
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self._serving = False
+        self._batch_pool = None
 
         self.pydev_settrace_params = dict()
    
@@ -60,7 +561,9 @@ class rpcserver(object):
             if handler is None:
                 ret = Exception("No handler registered for " + destination)
             else:
-                unflattened = map(_flatten.unflatten, args)
+                # Unflattened together, as the arguments were flattened, for
+                # objects shared between them
+                unflattened = _flatten.unflatten(args)
                 if debug:
                     # do the import here, pydevd must already be in the sys.
                     # it is important that the import is within the outer try/except
@@ -82,6 +585,14 @@ class rpcserver(object):
                     # a stack trace, this is probably as high up the stack as you
                     # want to go).
                     pydevd.settrace(suspend=suspend); ret = handler(*unflattened)
+                elif destination in self._process_handler_names:
+                    # A failure in the worker is returned rather than raised
+                    # so the worker's traceback is the one sent back
+                    pool = self._process_pool
+                    if pool is None:
+                        raise Exception("Process handlers only run once the server is serving")
+                    _ok, data = pool.apply(_process_handler_call, ((id(self), destination), unflattened))
+                    ret = cPickle.loads(data)
                 else:
                     ret = handler(*unflattened)
             flatret = _flatten.flatten(ret)
@@ -92,10 +603,21 @@ class rpcserver(object):
         return self._xmlrpchandler_common(destination, args)
     def _xmlrpchandler_debug(self, destination, args, suspend):
         return self._xmlrpchandler_common(destination, args, True, suspend)
+    def _xmlrpchandler_batch(self, calls, parallel=False):
+        # Each call is flattened on its own, so a failing call returns its
+        # flattened exception in place without affecting the others
+        run = lambda call: self._xmlrpchandler_common(call[0], call[1])
+        if parallel and len(calls) > 1:
+            return self._get_batch_pool().map(run, calls)
+        return map(run, calls)
     
     def _xmlrpc_is_alive(self):
         return True
 
+    def _xmlrpc_transports(self):
+        # Transports understood by this server, in order of preference
+        return [_binrpc.NAME, 'xmlrpc']
+
     def _xmlrpc_set_pydev_settrace_params(self, params):
         self.pydev_settrace_params = dict(params)
         # Cannot return None (aka null in java), return value is unused
@@ -103,18 +625,63 @@ class rpcserver(object):
         # handles None
         return 0
 
-    def add_handler(self, name, function):
+    def _start_process_pool(self):
+        # Forked before serving rather than on the first call, so the
+        # workers are not forked from a process with serving threads
+        self._process_pool_lock.acquire()
+        try:
+            old = self._process_pool
+            self._process_pool = None
+            if self._process_handler_names:
+                self._process_pool = multiprocessing.Pool(self._processes, _process_worker_init, (os.getpid(),))
+        finally:
+            self._process_pool_lock.release()
+        if old is not None:
+            # Let the workers finish what they are doing
+            old.close()
+            old.join()
+
+    def _get_batch_pool(self):
+        self._process_pool_lock.acquire()
+        try:
+            if self._batch_pool is None:
+                self._batch_pool = ThreadPool(max(4, multiprocessing.cpu_count()))
+            return self._batch_pool
+        finally:
+            self._process_pool_lock.release()
+
+    def add_handler(self, name, function, process=False):
         '''
         Register a new function with the Server. The function
         will be called when a request to the given name is made
+        
+        If process is True the function is run in a pool of forked worker
+        processes instead of a thread of this one, so that CPU bound Python
+        handlers are not serialised by the GIL. The arguments and return value
+        must be picklable. Only available where os.fork is, elsewhere the
+        function runs in a thread as normal. The workers are forked when
+        serve_forever is called, so such handlers are best added before;
+        adding one later forks new workers straight away.
         '''
         self._handlers[name] = function
+        key = (id(self), name)
+        if process and hasattr(os, 'fork'):
+            _process_handlers[key] = function
+            self._process_handler_names.add(name)
+            # Workers forked earlier don't know about this handler
+            if self._serving:
+                self._start_process_pool()
+        else:
+            _process_handlers.pop(key, None)
+            self._process_handler_names.discard(name)
         
     def serve_forever(self):
         '''
         Serve the RPC forever. The function does not return unless
         shutdown() is called from another thread. 
         '''
+        self._serving = True
+        self._start_process_pool()
         self._server.serve_forever()
         
     def shutdown(self):
@@ -127,9 +694,25 @@ class rpcserver(object):
         
     def close(self):
         '''
-        Close the port related to the server
+        Close the port (or remove the socket file) related to the server,
+        stop any handler worker processes and remove the shared memory
+        segments this process sent arrays in
         '''
         self._server.server_close()
+        if self._path is not None and os.path.exists(self._path):
+            os.remove(self._path)
+        _shm.closepool()
+        self._process_pool_lock.acquire()
+        try:
+            if self._process_pool is not None:
+                self._process_pool.terminate()
+                self._process_pool.join()
+                self._process_pool = None
+            if self._batch_pool is not None:
+                self._batch_pool.close()
+                self._batch_pool = None
+        finally:
+            self._process_pool_lock.release()
         
 
 class rpcclient(object):
@@ -138,25 +721,56 @@ class rpcclient(object):
     in another process.
     Calls to the server can be made either with the request method
     or as an attribute of the rpcclient instance.
+    An rpcclient can be shared between threads, each concurrent call
+    uses its own connection from a pool of at most maxconnections.
     '''
-    def __init__(self, port):
+    def __init__(self, port, maxconnections=4, binary=True):
         ''' 
         Create a new AnalysisRpc Client which will connect on the specified port
+        
+        If port is a string it is instead the path of the Unix domain socket
+        the server listens on.
+        
+        If binary is True (the default) calls use the binary encoding of
+        pybinrpc when the server supports it, falling back to XML-RPC.
         '''
-        self._serverProxy = ServerProxy("http://127.0.0.1:%d" % port)
+        if isinstance(port, basestring):
+            self._pool = _proxypool("http://localhost", maxconnections, binary,
+                                    _unix_connection_factory(port))
+        else:
+            self._pool = _proxypool("http://127.0.0.1:%d" % port, maxconnections, binary)
         self._port = port
+        self._maxconnections = maxconnections
+        self._async_pool = None
+        self._async_pool_lock = threading.Lock()
         
-    def _request_common(self, destination, params, debug=False, suspend=False):
-        flatargs = _flatten.flatten(params)
-        if debug:
-            flatret = self._serverProxy.Analysis.handler_debug(destination, flatargs, suspend)
-        else:
-            flatret = self._serverProxy.Analysis.handler(destination, flatargs)
+    def _send(self, destination, flatargs, debug=False, suspend=False):
+        proxy = self._pool.checkout()
+        try:
+            if debug:
+                flatret = proxy.Analysis.handler_debug(destination, flatargs, suspend)
+            else:
+                flatret = proxy.Analysis.handler(destination, flatargs)
+        finally:
+            self._pool.checkin(proxy)
         unflatret = _flatten.unflatten(flatret)
         if (isinstance(unflatret, Exception)):
             raise unflatret
         return unflatret
 
+    def _request_common(self, destination, params, debug=False, suspend=False):
+        flatargs = _flatten.flatten(params)
+        return self._send(destination, flatargs, debug, suspend)
+
+    def _get_async_pool(self):
+        self._async_pool_lock.acquire()
+        try:
+            if self._async_pool is None:
+                self._async_pool = ThreadPool(self._maxconnections)
+            return self._async_pool
+        finally:
+            self._async_pool_lock.release()
+
     def request(self, destination, params):
         '''
         Perform a request to the Server, directing it at the destination
@@ -165,6 +779,19 @@ class rpcclient(object):
         params must be a tuple or a list of the arguments
         '''
         return self._request_common(destination, params)
+    def request_async(self, destination, params):
+        '''
+        Perform a request to the Server as request does, but return without
+        waiting for the result. The params are flattened before returning,
+        so may be modified afterwards. The call is then sent on one of the
+        pooled connections, so up to maxconnections requests are in flight
+        at once and the caller can flatten the next request while the
+        Server runs this one.
+        Returns a multiprocessing.pool.AsyncResult, get() returns the value
+        of the call or raises its exception.
+        '''
+        flatargs = _flatten.flatten(params)
+        return self._get_async_pool().apply_async(self._send, (destination, flatargs))
     def request_debug(self, destination, params, suspend):
         '''
         Perform a request to the Server starting debug if server supports
@@ -176,12 +803,49 @@ class rpcclient(object):
         '''
         return self._request_common(destination, params, True, suspend)
 
+    def request_batch(self, calls, parallel=False):
+        '''
+        Perform several requests in a single round trip to the Server.
+        calls is a sequence of (destination, params) pairs, each as would
+        be passed to request. The calls are run in order, or concurrently
+        if parallel is True.
+        Returns a list with the result of each call, in the order given. A
+        call that fails has its exception in the list in place of a result,
+        the exception is not raised.
+        '''
+        flatcalls = [(destination, _flatten.flatten(params)) for destination, params in calls]
+        proxy = self._pool.checkout()
+        try:
+            flatrets = proxy.Analysis.handler_batch(flatcalls, parallel)
+        finally:
+            self._pool.checkin(proxy)
+        return map(_flatten.unflatten, flatrets)
+
     def is_alive(self):
+        proxy = self._pool.checkout()
         try:
-            self._serverProxy.Analysis.is_alive()
+            proxy.Analysis.is_alive()
             return True
         except:
             return False
+        finally:
+            self._pool.checkin(proxy)
+
+    def close(self):
+        '''
+        Close the idle connections to the server, and stop the threads of
+        request_async once the requests already made are done. The client
+        remains usable, new connections and threads are started on the next
+        request.
+        '''
+        self._async_pool_lock.acquire()
+        try:
+            if self._async_pool is not None:
+                self._async_pool.close()
+                self._async_pool = None
+        finally:
+            self._async_pool_lock.release()
+        self._pool.close()
     
     def __getattr__(self, destination):
         return _method(self.request, destination)
@@ -0,0 +1,196 @@
+###
+# Copyright 2011 Diamond Light Source Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+'''
+Shared memory segments used by pyflatten to pass ndarrays to the other
+process without going through a file on disk. See Java SharedMemorySegments,
+which must be kept in step.
+
+A segment is a file in /dev/shm. Its first byte is the state of the segment,
+IN_USE while it holds an array the receiver has not read yet and FREE once the
+receiver has copied the array out. The sender only reuses FREE segments, so
+the two processes never need to talk about segments other than by name.
+Arrays are written from HEADER_SIZE onwards.
+
+A segment still IN_USE RECLAIM_SECONDS after it was handed out is taken to
+hold a message that will never be read, e.g. because the receiver failed
+before unflattening it, and is reused.
+
+The segments are removed by closepool, which rpcserver.close calls, or at
+exit. A process killed without either leaves them behind in /dev/shm.
+'''
+
+import mmap
+import os
+import threading
+import atexit
+import time
+from tempfile import mkstemp
+
+SHM_DIR = "/dev/shm"
+HEADER_SIZE = 64
+FREE = '\x00'
+IN_USE = '\x01'
+RECLAIM_SECONDS = 300
+
+# Segments are created at least this big, and in multiples of it, so that
+# arrays of similar size can reuse each other's segment
+_GRANULE = 1 << 20
+
+def available():
+    '''
+    True if shared memory segments can be created on this platform
+    '''
+    return os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK)
+
+class segment(object):
+    def __init__(self, name, size, mapped):
+        self.name = name
+        self.size = size
+        self.map = mapped
+        self.acquired = 0
+
+    def write(self, offset, data):
+        self.map[offset:offset + len(data)] = data
+
+class segmentpool(object):
+    '''
+    The segments this process has created to send arrays in. acquire returns
+    a segment with room for an array, creating one if none is free.
+    '''
+    def __init__(self, prefix='scisoftshm-'):
+        self._prefix = prefix
+        self._pid = os.getpid()
+        self._segments = []
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes):
+        '''
+        Return a segment with room for nbytes from HEADER_SIZE on, marked
+        IN_USE. The receiver marks it FREE again.
+        '''
+        self._lock.acquire()
+        try:
+            now = time.time()
+            for seg in self._segments:
+                if seg.size - HEADER_SIZE >= nbytes and (seg.map[0] == FREE
+                                                         or now - seg.acquired > RECLAIM_SECONDS):
+                    seg.map[0] = IN_USE
+                    seg.acquired = now
+                    return seg
+            seg = self._create(nbytes)
+            seg.map[0] = IN_USE
+            seg.acquired = now
+            self._segments.append(seg)
+            return seg
+        finally:
+            self._lock.release()
+
+    def _create(self, nbytes):
+        size = -(-(nbytes + HEADER_SIZE) // _GRANULE) * _GRANULE
+        (osfd, filename) = mkstemp(prefix=self._prefix, dir=SHM_DIR)
+        try:
+            os.ftruncate(osfd, size)
+            mapped = mmap.mmap(osfd, size)
+        except:
+            os.close(osfd)
+            os.remove(filename)
+            raise
+        os.close(osfd)
+        return segment(os.path.basename(filename), size, mapped)
+
+    def close(self):
+        '''
+        Remove all segments. Receivers that still have one mapped keep it
+        until they unmap it.
+        '''
+        if os.getpid() != self._pid:
+            # Inherited by a forked child, the segments are the parent's
+            return
+        self._lock.acquire()
+        try:
+            for seg in self._segments:
+                seg.map.close()
+                try:
+                    os.remove(os.path.join(SHM_DIR, seg.name))
+                except OSError:
+                    pass
+            self._segments = []
+        finally:
+            self._lock.release()
+
+# Segments of the other process this one has mapped to read from, by name
+_MAX_MAPPED = 64
+_mapped = dict()
+_mapped_lock = threading.Lock()
+
+def openmapped(name):
+    '''
+    Return the mmap of the named segment, mapping it on first use
+    '''
+    if not name or os.sep in name or name.startswith('.'):
+        raise ValueError("Invalid shared memory segment name " + repr(name))
+    _mapped_lock.acquire()
+    try:
+        mapped = _mapped.get(name)
+        if mapped is None:
+            if len(_mapped) >= _MAX_MAPPED:
+                # Not closed here as another thread may be reading one, each
+                # is unmapped once nothing refers to it
+                _mapped.clear()
+            f = open(os.path.join(SHM_DIR, name), 'r+b')
+            try:
+                mapped = mmap.mmap(f.fileno(), 0)
+            finally:
+                f.close()
+            _mapped[name] = mapped
+        return mapped
+    finally:
+        _mapped_lock.release()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def getpool():
+    '''
+    Return this process's segmentpool, created on first use and removed at exit
+    '''
+    global _pool, _pool_pid
+    _pool_lock.acquire()
+    try:
+        # A forked child must not hand out its parent's segments
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = segmentpool()
+            _pool_pid = os.getpid()
+            atexit.register(_pool.close)
+        return _pool
+    finally:
+        _pool_lock.release()
+
+def closepool():
+    '''
+    Remove this process's segments now rather than at exit. A later getpool
+    starts a new pool.
+    '''
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+            _pool = None
+    finally:
+        _pool_lock.release()
@@ -30,6 +30,8 @@ Classes available:
     sector_list (sectlist) is a list of sector ROIs
     circle_list is a list of circular ROIs
     ellipse_list is a list of elliptical ROIs
+    point_array, line_array, rectangle_array, sector_array, circle_array and
+    ellipse_array are lists of ROIs held in a numpy array per field
     roi_dict is a list/dictionary of ROIs
 '''
 
@@ -58,6 +60,13 @@ sector_list = sectlist = _roi.sector_list
 circle_list = _roi.circle_list
 ellipse_list = _roi.ellipse_list
 
+point_array = _roi.point_array
+line_array = _roi.line_array
+rectangle_array = _roi.rectangle_array
+sector_array = _roi.sector_array
+circle_array = _roi.circle_array
+ellipse_array = _roi.ellipse_array
+
 from scisoftpy.dictutils import ListDict
 
 class roi_dict(ListDict):
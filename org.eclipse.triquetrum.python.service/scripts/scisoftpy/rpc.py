@@ -34,13 +34,21 @@ typednone=_wrapper.typednone
 abstractdatasetdescriptor=_wrapper.abstractdatasetdescriptor
 binarywrapper=_wrapper.binarywrapper
 settemplocation=_flatten.settemplocation
+setsharedmemory=_flatten.setsharedmemory
+setmemorymap=_flatten.setmemorymap
+setbundle=_flatten.setbundle
+setinlinethreshold=_flatten.setinlinethreshold
+setpackedtype=_flatten.setpackedtype
 
 
 if __name__ == '__main__':
     # When run as a script, launches an RPC Server
     import sys
 
-    serverPort = int(sys.argv[1])
+    # A port number, or the path of a Unix domain socket
+    serverPort = sys.argv[1]
+    if serverPort.isdigit():
+        serverPort = int(serverPort)
     server = rpcserver(serverPort)
 
     def addHandlers(code, handler_names):
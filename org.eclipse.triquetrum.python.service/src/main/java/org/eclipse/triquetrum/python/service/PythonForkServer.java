@@ -0,0 +1,150 @@
+/*******************************************************************************
+ * Copyright (c) 2014, 2016  Diamond Light Source Ltd.,
+ *                          Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+package org.eclipse.triquetrum.python.service;
+
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.net.Socket;
+import java.util.HashMap;
+import java.util.Map;
+
+import org.eclipse.triquetrum.python.service.util.NetUtils;
+import org.eclipse.triquetrum.python.service.util.cmdline.ManagedCommandline;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+/**
+ * A python_service_forkserver.py process. It imports numpy and scisoftpy once, then forks a ready
+ * python_service_runscript.py for each {@link #fork(String)}. That takes milliseconds rather than the seconds of
+ * starting an interpreter.
+ * <p>
+ * {@link PythonService#openConnection(String)} forks its services from one of these, one per interpreter, when the
+ * property org.foobar.python.fork.server is true.
+ */
+public class PythonForkServer {
+
+  private static final Logger LOG = LoggerFactory.getLogger(PythonForkServer.class);
+
+  private static final Map<String, PythonForkServer> servers = new HashMap<String, PythonForkServer>();
+
+  private final ManagedCommandline command;
+  private final int port;
+  private Thread stopThread;
+
+  /**
+   * @return the running fork server for pythonInterpreter, started on first use or if the last one died
+   */
+  public static synchronized PythonForkServer getForkServer(final String pythonInterpreter) throws Exception {
+    PythonForkServer server = servers.get(pythonInterpreter);
+    if (server == null || !server.isRunning()) {
+      if (server != null) {
+        server.stop();
+      }
+      server = new PythonForkServer(pythonInterpreter);
+      servers.put(pythonInterpreter, server);
+    }
+    return server;
+  }
+
+  private PythonForkServer(final String pythonInterpreter) throws Exception {
+    port = NetUtils.getFreePort(PythonService.getServiceStartPort());
+    String script = PythonService.SYSTEM_SCRIPTS_HOME + "/python_service_forkserver.py";
+
+    command = new ManagedCommandline();
+    command.addArguments(new String[] { pythonInterpreter, "-u", script, String.valueOf(port) });
+    // The services forked inherit it
+    command.setEnv(PythonService.createEnvironment());
+    command.setStreamLogsToLogging(true);
+    command.execute();
+
+    stopThread = new Thread("Stop Python Fork Server") {
+      public void run() {
+        PythonForkServer.this.stop();
+      }
+    };
+    Runtime.getRuntime().addShutdownHook(stopThread);
+
+    waitForServer();
+  }
+
+  /**
+   * Returns once the fork server accepts connections, so that its port is taken before another free one is looked for
+   */
+  private void waitForServer() throws Exception {
+    final int time = System.getProperty(PythonService.PYTHON_RPC_SERVICE_TIMEOUT_PROP_NAME) != null ? Integer.parseInt(System
+        .getProperty(PythonService.PYTHON_RPC_SERVICE_TIMEOUT_PROP_NAME)) : 5000;
+    int count = 0;
+    while (count <= time) {
+      if (!isRunning())
+        throw new Exception("The python fork server did not start!");
+      try {
+        new Socket("127.0.0.1", port).close();
+        return;
+      } catch (IOException ne) {
+        Thread.sleep(100);
+        count += 100;
+      }
+    }
+    stop();
+    throw new Exception("Connect to python fork server timed out after " + time + "ms!");
+  }
+
+  /**
+   * Fork a service serving on address, a port or the path of a Unix domain socket. The service lives as long as the
+   * connection returned: closing it stops the service.
+   */
+  public Socket fork(String address) throws IOException {
+    Socket socket = new Socket("127.0.0.1", port);
+    try {
+      OutputStream out = socket.getOutputStream();
+      out.write((address + "\n").getBytes("UTF-8"));
+      out.flush();
+      // The pid of the service, logged to match the service to its process
+      InputStream in = socket.getInputStream();
+      StringBuilder pid = new StringBuilder();
+      int c;
+      while ((c = in.read()) != '\n') {
+        if (c < 0)
+          throw new IOException("The python fork server did not fork a service");
+        pid.append((char) c);
+      }
+      LOG.debug("Forked python service {} serving on {}", pid, address);
+      return socket;
+    } catch (IOException e) {
+      socket.close();
+      throw e;
+    }
+  }
+
+  public boolean isRunning() {
+    return !command.hasTerminated();
+  }
+
+  /**
+   * Stop the fork server. Services forked from it keep running.
+   */
+  public void stop() {
+    if (command.getProcess() != null) {
+      command.getProcess().destroy();
+    }
+    if (stopThread != null) {
+      try {
+        Runtime.getRuntime().removeShutdownHook(stopThread);
+      } catch (Throwable ne) {
+        // Fails if called during shutdown, when it need not be removed
+      }
+      stopThread = null;
+    }
+  }
+}
@@ -13,6 +13,10 @@
 package org.eclipse.triquetrum.python.service;
 
 import java.io.File;
+import java.io.IOException;
+import java.lang.reflect.Array;
+import java.net.Socket;
+import java.net.SocketTimeoutException;
 import java.util.ArrayList;
 import java.util.Arrays;
 import java.util.HashMap;
@@ -33,11 +37,22 @@ public class PythonService {
   public static final String PYTHON_DEBUG_PORT_PROP_NAME = "org.foobar.python.debug.port";
   public final static String PYTHON_FREE_PORT_PROP_NAME = "org.foobar.python.free.port";
   public final static String PYTHON_RPC_SERVICE_TIMEOUT_PROP_NAME = "org.foobar.python.timeout";
+  /**
+   * Set to false to always connect to the service by TCP port, even where a Unix domain socket could be used.
+   */
+  public final static String PYTHON_UNIX_SOCKET_PROP_NAME = "org.foobar.python.unix.socket";
+  /**
+   * Set to true to fork services from a {@link PythonForkServer}, which has numpy and scisoftpy imported already,
+   * rather than start a new python for each.
+   */
+  public final static String PYTHON_FORK_SERVER_PROP_NAME = "org.foobar.python.fork.server";
   public final static String SYSTEM_SCRIPTS_HOME = System.getProperty("org.foobar.python.scripts.system");
 
   private ManagedCommandline command;
   private AnalysisRpcClient client;
   private Thread stopThread;
+  private File socketFile;
+  private Socket forkConnection;
 
   /**
    * Must use openConnection()
@@ -53,36 +68,41 @@ public class PythonService {
    *          to start a python with numpy in. For instance 'python', 'python2.6', or the full path The port is started at 8613 and a free one is searched for.
    *          The property org.dawb.passerelle.actors.scripts.python.free.port many be used to change the start port if needed. This method also adds a shutdown
    *          hook to ensure that the service is stopped cleanly when the vm is shutdown. Calling the stop() method removes this shutdown hook.
+   *          Where supported (see {@link AnalysisRpcClient#isUnixSocketSupported()}) the service listens on a Unix domain socket in the temp
+   *          directory instead of a port, unless the property org.foobar.python.unix.socket is false.
+   *          If the property org.foobar.python.fork.server is true, the service is forked from a {@link PythonForkServer}
+   *          for pythonInterpreter instead of started, which is much faster once the fork server is up.
    * @return
    */
   public static synchronized PythonService openConnection(final String pythonInterpreter) throws Exception {
 
     final PythonService service = new PythonService();
 
-    // Find the location of python_service.py and
-    // ensure org.eclipse.triquetrum.scisoft.python in PYTHONPATH
-    final Map<String, String> env = new HashMap<String, String>(System.getenv());
-    String pythonPath = env.get("PYTHONPATH");
-
-    StringBuilder pyBuf;
-    if (pythonPath == null) {
-      pyBuf = new StringBuilder();
+    final int port;
+    final String address;
+    if (useUnixSocket()) {
+      // The python side replaces the file with the socket
+      service.socketFile = File.createTempFile("pyservice", ".sock");
+      port = -1;
+      address = service.socketFile.getAbsolutePath();
     } else {
-      pyBuf = new StringBuilder(pythonPath);
-      pyBuf.append(File.pathSeparatorChar);
+      port = NetUtils.getFreePort(getServiceStartPort());
+      address = String.valueOf(port);
     }
-    final int port = NetUtils.getFreePort(getServiceStartPort());
-    String script = SYSTEM_SCRIPTS_HOME + "/python_service_runscript.py";
-
-    service.command = new ManagedCommandline();
-    service.command.addArguments(new String[] { pythonInterpreter, "-u", script, String.valueOf(port), "-1" });
+    if (useForkServer()) {
+      // The service exits when this is closed, see stop()
+      service.forkConnection = PythonForkServer.getForkServer(pythonInterpreter).fork(address);
+    } else {
+      String script = SYSTEM_SCRIPTS_HOME + "/python_service_runscript.py";
 
-    env.put("PYTHONPATH", pyBuf.append(SYSTEM_SCRIPTS_HOME).toString());
-    service.command.setEnv(env);
+      service.command = new ManagedCommandline();
+      service.command.addArguments(new String[] { pythonInterpreter, "-u", script, address, "-1" });
+      service.command.setEnv(createEnvironment());
 
-    // Currently log back python output directly to the log file.
-    service.command.setStreamLogsToLogging(true);
-    service.command.execute();
+      // Currently log back python output directly to the log file.
+      service.command.setStreamLogsToLogging(true);
+      service.command.execute();
+    }
 
     service.stopThread = new Thread("Stop Python Service") {
       public void run() {
@@ -91,11 +111,46 @@ public class PythonService {
     };
     Runtime.getRuntime().addShutdownHook(service.stopThread);
 
-    service.client = service.getActiveClient(port);
+    service.client = service.getActiveClient(port, address);
 
     return service;
   }
 
+  private static boolean useUnixSocket() {
+    return AnalysisRpcClient.isUnixSocketSupported() && !"false".equalsIgnoreCase(System.getProperty(PYTHON_UNIX_SOCKET_PROP_NAME));
+  }
+
+  private static boolean useForkServer() {
+    // There is no fork on Windows
+    return File.separatorChar == '/' && Boolean.getBoolean(PYTHON_FORK_SERVER_PROP_NAME);
+  }
+
+  /**
+   * @return the environment to start python_service_runscript.py, or the fork server, in
+   */
+  static Map<String, String> createEnvironment() {
+    // Find the location of python_service.py and
+    // ensure org.eclipse.triquetrum.scisoft.python in PYTHONPATH
+    final Map<String, String> env = new HashMap<String, String>(System.getenv());
+    String pythonPath = env.get("PYTHONPATH");
+
+    StringBuilder pyBuf;
+    if (pythonPath == null) {
+      pyBuf = new StringBuilder();
+    } else {
+      pyBuf = new StringBuilder(pythonPath);
+      pyBuf.append(File.pathSeparatorChar);
+    }
+    env.put("PYTHONPATH", pyBuf.append(SYSTEM_SCRIPTS_HOME).toString());
+    // Numpy arrays are returned in shared memory rather than temp files only if SCISOFT_RPC_SHM=1 is set: a service
+    // that is killed leaves its segments behind in /dev/shm
+    if (!env.containsKey("SCISOFT_RPC_INLINE_BYTES")) {
+      // and small ones inside the message
+      env.put("SCISOFT_RPC_INLINE_BYTES", "16384");
+    }
+    return env;
+  }
+
   /**
    * Tries to get a dir in the same place as the script, otherwise it tries to get a dir in the user home.
    *
@@ -164,7 +219,23 @@ public class PythonService {
 
     final PythonService service = new PythonService();
 
-    service.client = service.getActiveClient(port);
+    service.client = service.getActiveClient(port, null);
+
+    return service;
+  }
+
+  /**
+   * As {@link #openClient(int)}, for a service listening on the Unix domain socket at socketPath.
+   *
+   * @param socketPath
+   * @return
+   * @throws Exception
+   */
+  public static PythonService openClient(final String socketPath) throws Exception {
+
+    final PythonService service = new PythonService();
+
+    service.client = service.getActiveClient(-1, socketPath);
 
     return service;
   }
@@ -173,10 +244,12 @@ public class PythonService {
    * Tries to connect to the service, only returning when connected. This is more reliable than waiting for a given time.
    *
    * @param port
+   * @param socketPath
+   *          if port is -1, the path of the Unix domain socket to connect to
    * @return
    * @throws InterruptedException
    */
-  private AnalysisRpcClient getActiveClient(int port) throws Exception {
+  private AnalysisRpcClient getActiveClient(int port, String socketPath) throws Exception {
 
     if (!isRunning())
       throw new Exception("The remote python process did not start!");
@@ -184,19 +257,21 @@ public class PythonService {
     int count = 0;
     final int time = System.getProperty(PYTHON_RPC_SERVICE_TIMEOUT_PROP_NAME) != null ? Integer.parseInt(System
         .getProperty(PYTHON_RPC_SERVICE_TIMEOUT_PROP_NAME)) : 5000;
+    // A forked service is up within milliseconds
+    final int step = forkConnection != null ? 10 : 100;
 
     while (count <= time) {
       try {
-        final AnalysisRpcClient client = new AnalysisRpcClient(port);
+        final AnalysisRpcClient client = port < 0 ? new AnalysisRpcClient(socketPath) : new AnalysisRpcClient(port);
         final Object active = client.request("isActive", new Object[] { "unused" }); // Calls the method 'run' in the script with the arguments
         if ((((Boolean) active)).booleanValue())
           return client;
-        Thread.sleep(100);
-        count += 100;
+        Thread.sleep(step);
+        count += step;
         continue;
       } catch (Exception ne) {
-        count += 100;
-        Thread.sleep(100);
+        count += step;
+        Thread.sleep(step);
         continue;
       }
     }
@@ -204,7 +279,7 @@ public class PythonService {
   }
 
   /**
-   * Will be null when openClient(port) is used.
+   * Will be null when openClient(port) is used, or the service was forked from a {@link PythonForkServer}.
    *
    * @return
    */
@@ -217,11 +292,27 @@ public class PythonService {
   }
 
   public void stop() {
-    if (command == null)
-      return;
-    if (command.getProcess() == null)
-      return;
-    command.getProcess().destroy();
+    if (client != null)
+      client.close();
+    if (forkConnection != null) {
+      if (forkConnection.isClosed())
+        return;
+      try {
+        forkConnection.close();
+      } catch (IOException ne) {
+        // The service exits once the connection is gone either way
+      }
+    } else {
+      if (command == null)
+        return;
+      if (command.getProcess() == null)
+        return;
+      command.getProcess().destroy();
+    }
+    if (socketFile != null) {
+      socketFile.delete();
+      socketFile = null;
+    }
     if (stopThread != null) {
       try {
         Runtime.getRuntime().removeShutdownHook(stopThread);
@@ -235,11 +326,43 @@ public class PythonService {
   }
 
   public boolean isRunning() {
+    if (forkConnection != null)
+      return isForkRunning();
     if (command == null)
       return true; // Probably in debug mode
     return !command.hasTerminated();
   }
 
+  /**
+   * A forked service never writes to its connection, so a read only returns once the service has exited, and the
+   * connection with it.
+   */
+  private boolean isForkRunning() {
+    synchronized (forkConnection) {
+      if (forkConnection.isClosed())
+        return false;
+      try {
+        forkConnection.setSoTimeout(1);
+        return forkConnection.getInputStream().read() >= 0;
+      } catch (SocketTimeoutException ne) {
+        return true;
+      } catch (IOException ne) {
+        return false;
+      }
+    }
+  }
+
+  /**
+   * @return true if the service answers requests
+   */
+  public boolean isActive() {
+    try {
+      return Boolean.TRUE.equals(client.request("isActive", new Object[] { "unused" }));
+    } catch (Exception ne) {
+      return false;
+    }
+  }
+
   /**
    * Convenience method for calling
    *
@@ -252,7 +375,8 @@ public class PythonService {
   public Map<String, ? extends Object> runScript(String scriptFullPath, Map<String, ?> data) throws Exception {
 
     final File dir = getWorkingDir(scriptFullPath);
-    command.setWorkingDir(dir);
+    if (command != null)
+      command.setWorkingDir(dir);
     final List<String> additionalPaths = new ArrayList<String>(1);
     additionalPaths.add(new File(scriptFullPath).getParent().toString());
     if (System.getenv("PYTHONPATH") != null) {
@@ -269,6 +393,41 @@ public class PythonService {
     return (Map<String, ? extends Object>) out;
   }
 
+  /**
+   * Runs the script once and calls its run function with each of inputs in turn, in one request instead of one
+   * {@link #runScript(String, Map)} each.
+   *
+   * @param scriptFullPath
+   * @param inputs
+   *          the arguments of each call
+   * @param parallelism
+   *          the number of threads the service calls the function on, 1 to make the calls one after the other
+   * @return the result of each call, in the order of inputs: the Map the function returned, or the
+   *         {@link AnalysisRpcRemoteException} it raised
+   * @throws Exception
+   *           if the batch as a whole fails, e.g. the script can't be loaded
+   */
+  public List<Object> runScriptBatch(String scriptFullPath, List<? extends Map<String, ?>> inputs, int parallelism) throws Exception {
+
+    final File dir = getWorkingDir(scriptFullPath);
+    if (command != null)
+      command.setWorkingDir(dir);
+
+    final Object out = client.request("runScriptBatch", new Object[] { scriptFullPath, inputs.toArray(), parallelism });
+
+    if (dir.exists() && (dir.list() == null || dir.list().length < 1)) {
+      dir.delete();
+    }
+
+    // Results that are all Integers or all Doubles come back as an int[] or double[]
+    final int length = Array.getLength(out);
+    final List<Object> results = new ArrayList<Object>(length);
+    for (int i = 0; i < length; i++) {
+      results.add(Array.get(out, i));
+    }
+    return results;
+  }
+
   public static int getDebugPort() {
     int port = 8613;
     if (System.getProperty(PYTHON_DEBUG_PORT_PROP_NAME) != null) {
@@ -283,7 +442,7 @@ public class PythonService {
    *
    * @return
    */
-  private static int getServiceStartPort() {
+  static int getServiceStartPort() {
     int port = 8613;
     if (System.getProperty(PYTHON_FREE_PORT_PROP_NAME) != null) {
       // In an emergency allow the port to be changed for the debug session.
@@ -0,0 +1,168 @@
+/*******************************************************************************
+ * Copyright (c) 2014, 2016  Diamond Light Source Ltd.,
+ *                          Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+package org.eclipse.triquetrum.python.service;
+
+import java.util.concurrent.BlockingQueue;
+import java.util.concurrent.Executors;
+import java.util.concurrent.LinkedBlockingQueue;
+import java.util.concurrent.ScheduledExecutorService;
+import java.util.concurrent.ThreadFactory;
+import java.util.concurrent.TimeUnit;
+
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+/**
+ * Keeps a number of Python services started, and done importing numpy and scisoftpy, so that {@link #checkout()}
+ * doesn't have to wait seconds for {@link PythonService#openConnection(String)}.
+ * <p>
+ * Services are started, and idle ones checked, in a background thread. A service that is used up or found dead is
+ * replaced there. When no started service is idle, {@link #checkout()} starts one itself, as openConnection does.
+ * <p>
+ * A service is reused as it is left, so one whose process a script has left in a state the next user must not see
+ * should be stopped rather than checked in.
+ */
+public class PythonServicePool {
+
+  private static final Logger LOG = LoggerFactory.getLogger(PythonServicePool.class);
+
+  private final String pythonInterpreter;
+  private final int size;
+  private final BlockingQueue<PythonService> idle = new LinkedBlockingQueue<PythonService>();
+  private final ScheduledExecutorService starter;
+  private volatile boolean closed;
+
+  /**
+   * As {@link #PythonServicePool(String, int, long)}, checking idle services every 30 seconds
+   */
+  public PythonServicePool(final String pythonInterpreter, int size) {
+    this(pythonInterpreter, size, 30);
+  }
+
+  /**
+   * Create a pool and start filling it in the background.
+   *
+   * @param pythonInterpreter
+   *          to start services with, see {@link PythonService#openConnection(String)}
+   * @param size
+   *          the number of idle services to keep
+   * @param checkSeconds
+   *          how often to check that idle services still answer
+   */
+  public PythonServicePool(final String pythonInterpreter, int size, long checkSeconds) {
+    this.pythonInterpreter = pythonInterpreter;
+    this.size = size;
+    starter = Executors.newSingleThreadScheduledExecutor(new ThreadFactory() {
+      public Thread newThread(Runnable r) {
+        Thread thread = new Thread(r, "Python Service Pool");
+        thread.setDaemon(true);
+        return thread;
+      }
+    });
+    starter.scheduleWithFixedDelay(new Runnable() {
+      public void run() {
+        check();
+        replenish();
+      }
+    }, 0, checkSeconds, TimeUnit.SECONDS);
+  }
+
+  /**
+   * @return an idle running service, or a newly started one if there is none
+   */
+  public PythonService checkout() throws Exception {
+    if (closed)
+      throw new IllegalStateException("Python service pool is closed");
+    PythonService service;
+    try {
+      while ((service = idle.poll()) != null) {
+        if (service.isRunning())
+          return service;
+        service.stop();
+      }
+    } finally {
+      replenishLater();
+    }
+    return PythonService.openConnection(pythonInterpreter);
+  }
+
+  /**
+   * Give back a service from {@link #checkout()} for reuse. It is stopped if it has died, the pool is full or closed.
+   */
+  public void checkin(PythonService service) {
+    if (closed || !service.isRunning() || idle.size() >= size || !idle.offer(service)) {
+      service.stop();
+    }
+  }
+
+  /**
+   * Stop all idle services, and any that are checked in later
+   */
+  public void close() {
+    closed = true;
+    starter.shutdownNow();
+    PythonService service;
+    while ((service = idle.poll()) != null) {
+      service.stop();
+    }
+  }
+
+  /**
+   * @return the number of services ready to be checked out
+   */
+  public int getIdleCount() {
+    return idle.size();
+  }
+
+  private void replenishLater() {
+    if (!closed) {
+      try {
+        starter.execute(new Runnable() {
+          public void run() {
+            replenish();
+          }
+        });
+      } catch (RuntimeException e) {
+        // Closed meanwhile
+      }
+    }
+  }
+
+  /**
+   * Start services until there are size idle. Only run by the starter thread, so never starts more than needed.
+   */
+  private void replenish() {
+    while (!closed && idle.size() < size) {
+      PythonService service;
+      try {
+        service = PythonService.openConnection(pythonInterpreter);
+      } catch (Exception e) {
+        LOG.error("Failed to start a Python service for the pool, retrying at the next check", e);
+        return;
+      }
+      checkin(service);
+    }
+  }
+
+  /**
+   * Stop and drop idle services that no longer answer
+   */
+  private void check() {
+    for (PythonService service : idle) {
+      if (!service.isActive() && idle.remove(service)) {
+        LOG.warn("Dropping a Python service of the pool that stopped answering");
+        service.stop();
+      }
+    }
+  }
+}
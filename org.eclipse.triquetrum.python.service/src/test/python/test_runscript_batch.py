@@ -0,0 +1,86 @@
+'''
+Tests of runScriptBatch in python_service_runscript.py, run against a service
+started for the test:
+
+    python test_runscript_batch.py
+'''
+
+import os, sys, shutil, subprocess, tempfile, threading, time
+import unittest
+
+scriptsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'scripts')
+sys.path.insert(0, scriptsDir)
+
+from scisoftpy.rpc import rpcclient #@UnresolvedImport
+
+script = '''
+import sys, time
+
+# Widen the window between a batch taking the service's thread pool and using
+# it, in which another batch may replace the pool
+service = sys.modules['__main__']
+if not getattr(service.ThreadPool, 'slowMap', False):
+    threadPool = service.ThreadPool
+    class slowMapPool(threadPool):
+        slowMap = True
+        def map(self, func, iterable, chunksize=None):
+            time.sleep(0.3)
+            return threadPool.map(self, func, iterable, chunksize)
+    service.ThreadPool = slowMapPool
+
+def run(x):
+    return dict(y=x * x)
+'''
+
+class RunScriptBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.scriptPath = os.path.join(self.tempDir, 'square.py')
+        f = open(self.scriptPath, 'w')
+        try:
+            f.write(script)
+        finally:
+            f.close()
+        port = os.path.join(self.tempDir, 'service.sock')
+        env = dict(os.environ, PYTHONPATH=scriptsDir)
+        self.service = subprocess.Popen([sys.executable, '-u', os.path.join(scriptsDir, 'python_service_runscript.py'),
+                                         port, '-1'], env=env)
+        self.client = rpcclient(port, maxconnections=4)
+        for _i in range(200):
+            try:
+                self.client.isActive('unused')
+                break
+            except Exception:
+                time.sleep(0.05)
+
+    def tearDown(self):
+        self.client.close()
+        self.service.terminate()
+        self.service.wait()
+        shutil.rmtree(self.tempDir)
+
+    def testConcurrentBatchesOfDifferentSizes(self):
+        # The second batch asks for more threads, so replaces the shared pool
+        # while the first has it but is yet to use it
+        inputs = [dict(x=x) for x in range(8)]
+        expected = [dict(y=x * x) for x in range(8)]
+        results = dict()
+        def batch(parallelism):
+            try:
+                results[parallelism] = self.client.runScriptBatch(self.scriptPath, inputs, parallelism)
+            except Exception, e:
+                results[parallelism] = e
+        threads = []
+        for parallelism in (2, 4):
+            thread = threading.Thread(target=batch, args=(parallelism,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.1)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(expected, results[2], results[2])
+        self.assertEqual(expected, results[4], results[4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,14 +18,25 @@ import java.lang.reflect.Method;
 import java.lang.reflect.Proxy;
 import java.net.MalformedURLException;
 import java.net.URL;
+import java.util.Arrays;
 import java.util.HashMap;
 import java.util.Map;
+import java.util.concurrent.Callable;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Future;
+import java.util.concurrent.LinkedBlockingQueue;
+import java.util.concurrent.ThreadFactory;
+import java.util.concurrent.ThreadPoolExecutor;
+import java.util.concurrent.TimeUnit;
 
 import org.apache.xmlrpc.XmlRpcException;
 import org.apache.xmlrpc.client.XmlRpcClient;
 import org.apache.xmlrpc.client.XmlRpcClientConfigImpl;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.internal.AnalysisRpcTypeFactoryImpl;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.internal.BinaryRpcClient;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.internal.BinaryRpcCodec;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.internal.UnixSocketBinaryRpcClient;
 import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
 
@@ -45,9 +56,32 @@ public class AnalysisRpcClient {
 			.getLogger(AnalysisRpcClient.class);
 
 	private XmlRpcClient client;
+	private BinaryRpcClient binaryClient;
 	private IRootFlattener flattener = FlatteningService.getFlattener();
 
+	/**
+	 * System property that, when set to false, stops the client using the
+	 * binary transport even if the server supports it.
+	 */
+	public static final String BINARY_TRANSPORT_PROPERTY = "org.eclipse.triquetrum.scisoft.analysis.rpc.binary";
+	/** Whether to use binaryClient, null until asked of the server */
+	private Boolean binary;
+
 	private final int port;
+	private final String socketPath;
+
+	/**
+	 * System property with the number of
+	 * {@link #requestAsync(String, Object[])} calls a client can have in
+	 * flight at once, default {@link #ASYNC_THREADS}. Further calls queue
+	 * until one completes.
+	 */
+	public static final String ASYNC_THREADS_PROPERTY = "org.eclipse.triquetrum.scisoft.analysis.rpc.async.threads";
+	/** Default of {@link #ASYNC_THREADS_PROPERTY} */
+	public static final int ASYNC_THREADS = 4;
+	private final int asyncThreads = Integer.getInteger(
+			ASYNC_THREADS_PROPERTY, ASYNC_THREADS);
+	private ExecutorService asyncExecutor;
 
 	/**
 	 * Create a new AnalysisRpc client that connects to a server on the given
@@ -58,12 +92,14 @@ public class AnalysisRpcClient {
 	 */
 	public AnalysisRpcClient(int port) {
 		this.port = port;
+		this.socketPath = null;
 		try {
 			XmlRpcClientConfigImpl config = new XmlRpcClientConfigImpl();
 			config.setServerURL(new URL("http://127.0.0.1:" + port + "/RPC2"));
 			client = new XmlRpcClient();
 			client.setConfig(config);
 			client.setTypeFactory(new AnalysisRpcTypeFactoryImpl(client));
+			binaryClient = new BinaryRpcClient(port);
 		} catch (MalformedURLException e) {
 			// This is a programming error
 			logger.error(
@@ -72,20 +108,58 @@ public class AnalysisRpcClient {
 		}
 	}
 
+	/**
+	 * Create a new AnalysisRpc client that connects to a server listening on
+	 * the Unix domain socket at the given path. Such a client always uses the
+	 * binary transport.
+	 * 
+	 * @param socketPath
+	 *            path of the server's socket
+	 * @throws UnsupportedOperationException
+	 *             if Unix domain sockets are not available, see
+	 *             {@link #isUnixSocketSupported()}
+	 */
+	public AnalysisRpcClient(String socketPath) {
+		this.port = -1;
+		this.socketPath = socketPath;
+		binaryClient = new UnixSocketBinaryRpcClient(socketPath);
+		binary = true;
+	}
+
+	/**
+	 * @return true if {@link #AnalysisRpcClient(String)} can be used, which
+	 *         needs Java 16 or newer on a Unix platform
+	 */
+	public static boolean isUnixSocketSupported() {
+		return UnixSocketBinaryRpcClient.isSupported();
+	}
+
 	private Object request_common(String destination, Object[] args,
 			boolean debug, boolean suspend) throws AnalysisRpcException {
+		return send(destination, flattenArgs(args), debug, suspend);
+	}
+
+	private Object[] flattenArgs(Object[] args) throws AnalysisRpcException {
 		try {
 			if (args == null) {
 				// No arguments, convert null to empty array
 				args = new Object[0];
 			}
-			Object[] flatargs = (Object[]) flattener.flatten(args);
+			return (Object[]) flattener.flatten(args);
+		} catch (UnsupportedOperationException e) {
+			throw new AnalysisRpcException(e);
+		}
+	}
+
+	private Object send(String destination, Object[] flatargs, boolean debug,
+			boolean suspend) throws AnalysisRpcException {
+		try {
 			final Object flatret;
 			if (debug) {
-				flatret = client.execute("Analysis.handler_debug",
+				flatret = execute("Analysis.handler_debug",
 						new Object[] { destination, flatargs, suspend });
 			} else {
-				flatret = client.execute("Analysis.handler", new Object[] {
+				flatret = execute("Analysis.handler", new Object[] {
 						destination, flatargs });
 			}
 			Object unflatret = flattener.unflatten(flatret);
@@ -100,6 +174,76 @@ public class AnalysisRpcClient {
 		}
 	}
 
+	/**
+	 * Call the server with the binary transport if it supports it, with
+	 * XML-RPC otherwise. The server is asked on the first call.
+	 */
+	private Object execute(String method, Object[] params)
+			throws XmlRpcException {
+		if (useBinary()) {
+			return binaryClient.execute(method, params);
+		}
+		return client.execute(method, params);
+	}
+
+	private synchronized boolean useBinary() throws XmlRpcException {
+		if (binary == null) {
+			if (!Boolean.parseBoolean(System.getProperty(
+					BINARY_TRANSPORT_PROPERTY, "true"))) {
+				binary = false;
+			} else {
+				try {
+					Object[] transports = (Object[]) client.execute(
+							"Analysis.transports", new Object[0]);
+					binary = Arrays.asList(transports).contains(
+							BinaryRpcCodec.NAME);
+				} catch (XmlRpcException e) {
+					if (e.code == 0) {
+						// Server not reachable, ask again next time
+						throw e;
+					}
+					// Server predates Analysis.transports
+					binary = false;
+				}
+			}
+		}
+		return binary;
+	}
+
+	private synchronized ExecutorService getAsyncExecutor() {
+		if (asyncExecutor == null) {
+			ThreadPoolExecutor executor = new ThreadPoolExecutor(asyncThreads,
+					asyncThreads, 60, TimeUnit.SECONDS,
+					new LinkedBlockingQueue<Runnable>(), new ThreadFactory() {
+						@Override
+						public Thread newThread(Runnable r) {
+							Thread thread = new Thread(r, "AnalysisRpcClient:"
+									+ (socketPath != null ? socketPath : port)
+									+ " async request");
+							// Don't keep the VM alive for idle async threads
+							thread.setDaemon(true);
+							return thread;
+						}
+					});
+			// Nor keep threads of a client no longer used
+			executor.allowCoreThreadTimeOut(true);
+			asyncExecutor = executor;
+		}
+		return asyncExecutor;
+	}
+
+	/**
+	 * Stop the threads {@link #requestAsync(String, Object[])} sends calls on,
+	 * once the calls already made have completed. The client remains usable,
+	 * a later requestAsync starts new threads.
+	 */
+	public synchronized void close() {
+		if (asyncExecutor != null) {
+			asyncExecutor.shutdown();
+			asyncExecutor = null;
+		}
+	}
+
 	/**
 	 * Issue a RPC call by calling request. The call is sent to the server on
 	 * the registered port to the handler registered with the name passed to
@@ -129,7 +273,8 @@ public class AnalysisRpcClient {
 	 *             <li> {@link AnalysisRpcRemoteException} if an exception
 	 *             occurred on the remote side of the call. </li> <li>
 	 *             {@link XmlRpcException} if the underlying transport had a
-	 *             failure and XML-RPC was used as the transport </li>
+	 *             failure, whether XML-RPC or the binary transport was
+	 *             used </li>
 	 *             </ul>
 	 */
 	public Object request(String destination, Object[] args)
@@ -137,6 +282,40 @@ public class AnalysisRpcClient {
 		return request_common(destination, args, false, false);
 	}
 
+	/**
+	 * Issue a RPC call as {@link #request(String, Object[])} does, but return
+	 * without waiting for the result.
+	 * <p>
+	 * The arguments are flattened before this method returns, so they may be
+	 * modified afterwards. The call itself is sent on one of the client's
+	 * threads, {@link #ASYNC_THREADS} unless set by
+	 * {@link #ASYNC_THREADS_PROPERTY}, so that many calls can be in flight at
+	 * once and the caller can prepare the next call while the server runs this
+	 * one. Idle threads stop after a minute, or on {@link #close()}.
+	 * 
+	 * @param destination
+	 *            target handler in server
+	 * @param args
+	 *            arguments in the server
+	 * @return a {@link Future} for the value that the delegated to method
+	 *         returns. If the call fails, {@link Future#get()} throws an
+	 *         {@link java.util.concurrent.ExecutionException} whose cause is the
+	 *         {@link AnalysisRpcException} {@link #request(String, Object[])}
+	 *         would have thrown.
+	 * @throws AnalysisRpcException
+	 *             if the arguments could not be flattened
+	 */
+	public Future<Object> requestAsync(final String destination, Object[] args)
+			throws AnalysisRpcException {
+		final Object[] flatargs = flattenArgs(args);
+		return getAsyncExecutor().submit(new Callable<Object>() {
+			@Override
+			public Object call() throws AnalysisRpcException {
+				return send(destination, flatargs, false, false);
+			}
+		});
+	}
+
 	/**
 	 * Issue a RPC call by calling request, entering debug mode if server is
 	 * available.
@@ -150,6 +329,63 @@ public class AnalysisRpcClient {
 		return request_common(destination, args, true, suspend);
 	}
 
+	/**
+	 * Issue several RPC calls in a single round trip to the server. Call
+	 * <code>i</code> is sent to the handler registered as
+	 * <code>destinations[i]</code> with the arguments <code>args[i]</code>,
+	 * exactly as {@link #request(String, Object[])} would send it.
+	 * <p>
+	 * The calls are run one after the other in the order given, or
+	 * concurrently on the server if <code>parallel</code> is true.
+	 * <p>
+	 * Unlike {@link #request(String, Object[])}, a failing call does not
+	 * cause an exception to be thrown. Instead the exception (normally an
+	 * {@link AnalysisRpcRemoteException}) is returned in place of that call's
+	 * result, and the results of the other calls are still returned.
+	 * 
+	 * @param destinations
+	 *            target handler in server for each call
+	 * @param args
+	 *            arguments for each call, may contain <code>null</code> for no
+	 *            arguments
+	 * @param parallel
+	 *            run the calls concurrently on the server
+	 * @return the value, or exception, of each call in the same order as
+	 *         destinations
+	 * @throws AnalysisRpcException
+	 *             if the batch as a whole failed, see
+	 *             {@link #request(String, Object[])}
+	 */
+	public Object[] requestBatch(String[] destinations, Object[][] args,
+			boolean parallel) throws AnalysisRpcException {
+		if (destinations.length != args.length) {
+			throw new IllegalArgumentException(
+					"destinations and args must be the same length");
+		}
+		try {
+			Object[] flatcalls = new Object[destinations.length];
+			for (int i = 0; i < destinations.length; i++) {
+				Object[] callArgs = args[i] == null ? new Object[0] : args[i];
+				flatcalls[i] = new Object[] { destinations[i],
+						flattener.flatten(callArgs) };
+			}
+			Object[] flatrets = (Object[]) execute(
+					"Analysis.handler_batch", new Object[] { flatcalls,
+							parallel });
+			// Unflatten one by one, the result as a whole must stay an
+			// Object[] even if all the calls return the same type
+			Object[] unflatrets = new Object[flatrets.length];
+			for (int i = 0; i < flatrets.length; i++) {
+				unflatrets[i] = flattener.unflatten(flatrets[i]);
+			}
+			return unflatrets;
+		} catch (XmlRpcException e) {
+			throw new AnalysisRpcException(e);
+		} catch (UnsupportedOperationException e) {
+			throw new AnalysisRpcException(e);
+		}
+	}
+
 	/**
 	 * Test if the server is up and running.
 	 * 
@@ -160,6 +396,10 @@ public class AnalysisRpcClient {
 	 */
 	public boolean isAlive() {
 		try {
+			if (socketPath != null) {
+				binaryClient.execute("Analysis.is_alive", new Object[0]);
+				return true;
+			}
 			client.execute("Analysis.is_alive", new Object[0]);
 			return true;
 		} catch (XmlRpcException e) {
@@ -181,7 +421,7 @@ public class AnalysisRpcClient {
 	public void setPyDevSetTraceParams(Map<String, Object> options)
 			throws AnalysisRpcException {
 		try {
-			client.execute("Analysis.set_pydev_settrace_params",
+			execute("Analysis.set_pydev_settrace_params",
 					new Object[] { options });
 		} catch (XmlRpcException e) {
 			throw new AnalysisRpcException(
@@ -241,12 +481,21 @@ public class AnalysisRpcClient {
 	/**
 	 * Return port number in use
 	 * 
-	 * @return port
+	 * @return port, or -1 if connected by Unix domain socket
 	 */
 	public int getPort() {
 		return port;
 	}
 
+	/**
+	 * Return the path of the Unix domain socket in use
+	 * 
+	 * @return socket path, or null if connected by TCP port
+	 */
+	public String getSocketPath() {
+		return socketPath;
+	}
+
 	/**
 	 * Create a proxy that implements the given interfaces. All methods that are
 	 * called on the proxy must be declared to throw
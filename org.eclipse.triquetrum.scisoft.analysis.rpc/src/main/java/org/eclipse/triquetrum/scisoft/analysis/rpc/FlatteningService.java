@@ -15,6 +15,7 @@ package org.eclipse.triquetrum.scisoft.analysis.rpc;
 
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.RootFlattener;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.internal.SharedMemorySegments;
 
 public class FlatteningService {
 	private static IRootFlattener instance = new RootFlattener();
@@ -28,4 +29,16 @@ public class FlatteningService {
 		return instance;
 	}
 
+	/**
+	 * Whether arrays can be passed in shared memory on this platform. If so a
+	 * Python server can be asked to send its ndarrays that way (see
+	 * setsharedmemory in scisoftpy.rpc), which the flattener unflattens to
+	 * {@link org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.NDArray}.
+	 * 
+	 * @return true if shared memory is available
+	 */
+	public static boolean isSharedMemoryAvailable() {
+		return SharedMemorySegments.isAvailable();
+	}
+
 }
@@ -0,0 +1,29 @@
+/*******************************************************************************
+ * Copyright (c) 2014-2016 Diamond Light Source Ltd., 
+ *                         Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+
+
+package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening;
+
+import java.util.Map;
+
+/**
+ * Marks an {@link IFlattener} whose {@link IFlattener#canFlatten(Object)} depends on nothing but the class of the
+ * object, and whose {@link IFlattener#canUnFlatten(Object)} for a {@link Map} depends on nothing but its
+ * {@link IFlattener#TYPE_KEY} value.
+ * <p>
+ * {@link RootFlattener} remembers which helper it found for each class and each __type__ as long as that helper, and
+ * all helpers before it, are marked so, instead of asking every helper for every object. Helpers added with
+ * {@link IRootFlattener#addHelper(IFlattener)} should implement this where they can.
+ */
+public interface IDispatchedByType {
+}
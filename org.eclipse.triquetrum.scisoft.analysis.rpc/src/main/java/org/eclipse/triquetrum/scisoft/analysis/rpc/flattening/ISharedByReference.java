@@ -0,0 +1,26 @@
+/*******************************************************************************
+ * Copyright (c) 2014-2016 Diamond Light Source Ltd., 
+ *                         Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+
+
+package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening;
+
+import java.util.Map;
+
+/**
+ * Marks an {@link IFlattener} whose objects {@link RootFlattener} flattens only once per call, however often the same
+ * object (by identity) occurs in what is flattened. Later occurrences are flattened to references to the first, and
+ * come back as the one object they were. The flattened form of such objects must be a mutable {@link Map}, as the
+ * reference id is added to it.
+ */
+public interface ISharedByReference {
+}
@@ -0,0 +1,163 @@
+/*******************************************************************************
+ * Copyright (c) 2014-2016 Diamond Light Source Ltd.,
+ *                         Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+
+package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening;
+
+import java.util.Arrays;
+
+/**
+ * The Java side form of a numpy ndarray: its shape and its elements in C (row major) order, held in a primitive
+ * array.
+ * <p>
+ * The element type is given as a numpy array-protocol type string (e.g. "&lt;f8") and determines the type of data:
+ * <table>
+ * <tr><td>&lt;f8</td><td>double[]</td></tr>
+ * <tr><td>&lt;f4</td><td>float[]</td></tr>
+ * <tr><td>&lt;i8, &lt;u8</td><td>long[]</td></tr>
+ * <tr><td>&lt;i4, &lt;u4</td><td>int[]</td></tr>
+ * <tr><td>&lt;i2, &lt;u2</td><td>short[]</td></tr>
+ * <tr><td>|i1, |u1</td><td>byte[]</td></tr>
+ * <tr><td>|b1</td><td>boolean[]</td></tr>
+ * </table>
+ * Unsigned types use the signed Java type of the same width, so values above its maximum appear negative.
+ * <p>
+ * NDArrays are flattened by NDArrayHelper and unflatten to numpy ndarrays in Python.
+ */
+public class NDArray {
+	private final String dtype;
+	private final int[] shape;
+	private final Object data;
+
+	/**
+	 * @param dtype
+	 *            numpy type string, see class description
+	 * @param shape
+	 *            of the array
+	 * @param data
+	 *            elements in C order, a primitive array of the type matching dtype
+	 * @throws IllegalArgumentException
+	 *             if data does not match dtype or shape
+	 */
+	public NDArray(String dtype, int[] shape, Object data) {
+		Class<?> componentType = getComponentType(dtype);
+		if (data == null || data.getClass().getComponentType() != componentType) {
+			throw new IllegalArgumentException("Data for dtype " + dtype + " must be a " + componentType + "[]");
+		}
+		if (java.lang.reflect.Array.getLength(data) != getSize(shape)) {
+			throw new IllegalArgumentException("Data length does not match shape " + Arrays.toString(shape));
+		}
+		this.dtype = dtype;
+		this.shape = shape.clone();
+		this.data = data;
+	}
+
+	/**
+	 * Create a one dimensional array of doubles
+	 */
+	public NDArray(double[] data) {
+		this("<f8", new int[] { data.length }, data);
+	}
+
+	/**
+	 * Create a one dimensional array of ints
+	 */
+	public NDArray(int[] data) {
+		this("<i4", new int[] { data.length }, data);
+	}
+
+	/**
+	 * @return the primitive type of elements of the given numpy type string
+	 * @throws IllegalArgumentException
+	 *             if the type is not supported
+	 */
+	public static Class<?> getComponentType(String dtype) {
+		if ("<f8".equals(dtype))
+			return Double.TYPE;
+		if ("<f4".equals(dtype))
+			return Float.TYPE;
+		if ("<i8".equals(dtype) || "<u8".equals(dtype))
+			return Long.TYPE;
+		if ("<i4".equals(dtype) || "<u4".equals(dtype))
+			return Integer.TYPE;
+		if ("<i2".equals(dtype) || "<u2".equals(dtype))
+			return Short.TYPE;
+		if ("|i1".equals(dtype) || "|u1".equals(dtype))
+			return Byte.TYPE;
+		if ("|b1".equals(dtype))
+			return Boolean.TYPE;
+		throw new IllegalArgumentException("Unsupported dtype " + dtype);
+	}
+
+	/**
+	 * @return the number of bytes of one element of the given numpy type string
+	 */
+	public static int getItemSize(String dtype) {
+		return Integer.parseInt(dtype.substring(2));
+	}
+
+	/**
+	 * @return number of elements of an array of the given shape
+	 */
+	public static int getSize(int[] shape) {
+		int size = 1;
+		for (int dim : shape) {
+			size *= dim;
+		}
+		return size;
+	}
+
+	public String getDtype() {
+		return dtype;
+	}
+
+	public int[] getShape() {
+		return shape.clone();
+	}
+
+	/**
+	 * @return the elements, not a copy
+	 */
+	public Object getData() {
+		return data;
+	}
+
+	public int getSize() {
+		return getSize(shape);
+	}
+
+	@Override
+	public int hashCode() {
+		final int prime = 31;
+		int result = 1;
+		result = prime * result + dtype.hashCode();
+		result = prime * result + Arrays.hashCode(shape);
+		return result;
+	}
+
+	@Override
+	public boolean equals(Object obj) {
+		if (this == obj)
+			return true;
+		if (obj == null || getClass() != obj.getClass())
+			return false;
+		NDArray other = (NDArray) obj;
+		if (!dtype.equals(other.dtype) || !Arrays.equals(shape, other.shape))
+			return false;
+		return Arrays.deepEquals(new Object[] { data }, new Object[] { other.data });
+	}
+
+	@Override
+	public String toString() {
+		return "NDArray(" + dtype + ", " + Arrays.toString(shape) + ")";
+	}
+}
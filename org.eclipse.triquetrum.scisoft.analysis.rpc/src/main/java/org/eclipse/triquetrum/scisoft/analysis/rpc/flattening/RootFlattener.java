@@ -14,14 +14,19 @@
 package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening;
 
 import java.io.File;
+import java.util.HashMap;
+import java.util.IdentityHashMap;
 import java.util.Iterator;
 import java.util.LinkedList;
 import java.util.List;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
 
 import org.eclipse.triquetrum.scisoft.analysis.rpc.FlatteningService;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers.ExceptionHelper;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers.ListHelper;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers.MapHelper;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers.NDArrayHelper;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers.NoneFlatteningHelper;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers.ObjectArrayHelper;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers.PassThroughFlatteningHelper;
@@ -34,12 +39,42 @@ import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers.UUIDHelper
 
 /**
  * {@link IRootFlattener} implementation to flatten/unflatten objects for transportation over XMLRPC.
+ * <p>
+ * An object of a helper marked {@link ISharedByReference} is flattened only once by each call to {@link #flatten(Object)}
+ * (including the calls helpers make for what it contains). Each further occurrence of the same object is flattened to
+ * a reference, a Map with {@link IFlattener#TYPE_KEY} {@link #REFERENCE_TYPE_NAME} and {@link #REFERENCE_ID}. The first
+ * flattened form of the object is given the same id under {@link #ID_KEY}. {@link #unflatten(Object)} turns
+ * references back into the object unflattened from that form, so it comes back shared. Python's pyflatten does the
+ * same for ndarrays and dicts.
  */
 public class RootFlattener implements IRootFlattener {
+	public static final String ID_KEY = "__id__";
+	public static final String REFERENCE_TYPE_NAME = "__ref__";
+	public static final String REFERENCE_ID = "id";
 
 	private List<IFlattener<?>> flatteningHelpers;
 	private File tempLocation;
 
+	/**
+	 * The helper found for each class flattened and each __type__ of Map unflattened, see {@link IDispatchedByType}.
+	 * Cleared when a helper is added.
+	 */
+	private final Map<Class<?>, IFlattener<?>> flattenersByClass = new ConcurrentHashMap<Class<?>, IFlattener<?>>();
+	private final Map<String, IFlattener<?>> unflattenersByType = new ConcurrentHashMap<String, IFlattener<?>>();
+
+	/**
+	 * The objects the outermost call to flatten in each thread has met so far, with their flattened form
+	 */
+	private static class Sharing {
+		final Map<Object, Map<String, Object>> seen = new IdentityHashMap<Object, Map<String, Object>>();
+		int count;
+	}
+
+	private final ThreadLocal<Sharing> flattening = new ThreadLocal<Sharing>();
+
+	/** The objects unflattened so far by the outermost call to unflatten in each thread, by {@link #ID_KEY} */
+	private final ThreadLocal<Map<Object, Object>> unflattening = new ThreadLocal<Map<Object, Object>>();
+
 	/**
 	 * Create a new {@link RootFlattener}.
 	 * <p>
@@ -58,6 +93,7 @@ public class RootFlattener implements IRootFlattener {
 		flatteningHelpers.add(new ListHelper());
 		flatteningHelpers.add(new ExceptionHelper());
 		flatteningHelpers.add(new StackTraceElementHelper());
+		flatteningHelpers.add(new NDArrayHelper());
 		flatteningHelpers.add(new MapHelper());
 		flatteningHelpers.add(new PrimitiveIntArrayHelper());
 		flatteningHelpers.add(new PrimitiveDoubleArrayHelper());
@@ -67,13 +103,97 @@ public class RootFlattener implements IRootFlattener {
 
 	@Override
 	public Object flatten(Object obj) throws UnsupportedOperationException {
+		Sharing sharing = flattening.get();
+		if (sharing == null) {
+			flattening.set(new Sharing());
+			try {
+				return flatten(obj);
+			} finally {
+				flattening.remove();
+			}
+		}
+		IFlattener<?> flatteningHelper = getFlattener(obj);
+		if (flatteningHelper == null)
+			throw new UnsupportedOperationException("Value " + obj.toString() + " is of unknown type");
+		if (!(flatteningHelper instanceof ISharedByReference))
+			return flatteningHelper.flatten(obj, this);
+
+		Map<String, Object> seen = sharing.seen.get(obj);
+		if (seen != null) {
+			Object id = seen.get(ID_KEY);
+			if (id == null) {
+				id = sharing.count++;
+				seen.put(ID_KEY, id);
+			}
+			Map<String, Object> reference = new HashMap<String, Object>();
+			reference.put(IFlattener.TYPE_KEY, REFERENCE_TYPE_NAME);
+			reference.put(REFERENCE_ID, id);
+			return reference;
+		}
+		Object flat = flatteningHelper.flatten(obj, this);
+		if (flat instanceof Map<?, ?>) {
+			@SuppressWarnings("unchecked")
+			Map<String, Object> flatMap = (Map<String, Object>) flat;
+			sharing.seen.put(obj, flatMap);
+		}
+		return flat;
+	}
+
+	/**
+	 * @return true if obj is the flattened form of a reference to an object met before
+	 */
+	private static boolean isReference(Object obj) {
+		return obj instanceof Map<?, ?> && REFERENCE_TYPE_NAME.equals(((Map<?, ?>) obj).get(IFlattener.TYPE_KEY));
+	}
+
+	/**
+	 * @return the first helper that can flatten obj, or <code>null</code> if there is none
+	 */
+	private IFlattener<?> getFlattener(Object obj) {
+		Class<?> clazz = obj == null ? null : obj.getClass();
+		if (clazz != null) {
+			IFlattener<?> cached = flattenersByClass.get(clazz);
+			if (cached != null)
+				return cached;
+		}
+		boolean byType = clazz != null;
 		for (Iterator<IFlattener<?>> iterator = flatteningHelpers.iterator(); iterator.hasNext();) {
 			IFlattener<?> flatteningHelper = iterator.next();
-			if (flatteningHelper.canFlatten(obj))
-				return flatteningHelper.flatten(obj, this);
+			byType = byType && flatteningHelper instanceof IDispatchedByType;
+			if (flatteningHelper.canFlatten(obj)) {
+				if (byType)
+					flattenersByClass.put(clazz, flatteningHelper);
+				return flatteningHelper;
+			}
 		}
+		return null;
+	}
 
-		throw new UnsupportedOperationException("Value " + obj.toString() + " is of unknown type");
+	/**
+	 * @return the first helper that can unflatten obj, or <code>null</code> if there is none
+	 */
+	private IFlattener<?> getUnFlattener(Object obj) {
+		String type = null;
+		if (obj instanceof Map<?, ?>) {
+			Object typeValue = ((Map<?, ?>) obj).get(IFlattener.TYPE_KEY);
+			if (typeValue instanceof String) {
+				type = (String) typeValue;
+				IFlattener<?> cached = unflattenersByType.get(type);
+				if (cached != null)
+					return cached;
+			}
+		}
+		boolean byType = type != null;
+		for (Iterator<IFlattener<?>> iterator = flatteningHelpers.iterator(); iterator.hasNext();) {
+			IFlattener<?> flatteningHelper = iterator.next();
+			byType = byType && flatteningHelper instanceof IDispatchedByType;
+			if (flatteningHelper.canUnFlatten(obj)) {
+				if (byType)
+					unflattenersByType.put(type, flatteningHelper);
+				return flatteningHelper;
+			}
+		}
+		return null;
 	}
 
 	/**
@@ -87,22 +207,36 @@ public class RootFlattener implements IRootFlattener {
 	 */
 	@Override
 	public Object unflatten(Object obj) {
-		for (Iterator<IFlattener<?>> iterator = flatteningHelpers.iterator(); iterator.hasNext();) {
-			IFlattener<?> flatteningHelper = iterator.next();
-			if (flatteningHelper.canUnFlatten(obj))
-				return flatteningHelper.unflatten(obj, this);
+		Map<Object, Object> shared = unflattening.get();
+		if (shared == null) {
+			unflattening.set(new HashMap<Object, Object>());
+			try {
+				return unflatten(obj);
+			} finally {
+				unflattening.remove();
+			}
+		}
+		if (isReference(obj)) {
+			Object id = ((Map<?, ?>) obj).get(REFERENCE_ID);
+			if (!shared.containsKey(id)) {
+				throw new UnsupportedOperationException("Reference to object " + id
+						+ " met before the object, objects that contain themselves cannot be unflattened");
+			}
+			return shared.get(id);
+		}
+		IFlattener<?> flatteningHelper = getUnFlattener(obj);
+		if (flatteningHelper == null)
+			throw new UnsupportedOperationException("Value " + obj.toString() + " is of unknown type");
+		Object unflat = flatteningHelper.unflatten(obj, this);
+		if (obj instanceof Map<?, ?> && ((Map<?, ?>) obj).containsKey(ID_KEY)) {
+			shared.put(((Map<?, ?>) obj).get(ID_KEY), unflat);
 		}
-		throw new UnsupportedOperationException("Value " + obj.toString() + " is of unknown type");
+		return unflat;
 	}
 
 	@Override
 	public boolean canFlatten(Object obj) {
-		for (Iterator<IFlattener<?>> iterator = flatteningHelpers.iterator(); iterator.hasNext();) {
-			IFlattener<?> flatteningHelper = iterator.next();
-			if (flatteningHelper.canFlatten(obj))
-				return true;
-		}
-		return false;
+		return getFlattener(obj) != null;
 	}
 
 	@Override
@@ -111,12 +245,7 @@ public class RootFlattener implements IRootFlattener {
 			return false;
 		}
 
-		for (Iterator<IFlattener<?>> iterator = flatteningHelpers.iterator(); iterator.hasNext();) {
-			IFlattener<?> flatteningHelper = iterator.next();
-			if (flatteningHelper.canUnFlatten(obj))
-				return true;
-		}
-		return false;
+		return isReference(obj) || getUnFlattener(obj) != null;
 	}
 
 	@Override
@@ -136,6 +265,8 @@ public class RootFlattener implements IRootFlattener {
 	@Override
 	public void addHelper(IFlattener<?> helper) {
 		flatteningHelpers.add(0, helper);
+		flattenersByClass.clear();
+		unflattenersByType.clear();
 	}
 
 }
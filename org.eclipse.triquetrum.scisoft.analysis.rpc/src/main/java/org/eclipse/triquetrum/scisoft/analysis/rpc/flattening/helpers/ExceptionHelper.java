@@ -16,9 +16,10 @@ package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 import java.util.Map;
 
 import org.eclipse.triquetrum.scisoft.analysis.rpc.AnalysisRpcRemoteException;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
-public class ExceptionHelper extends MapFlatteningHelper<Exception> {
+public class ExceptionHelper extends MapFlatteningHelper<Exception> implements IDispatchedByType {
 	public static final String EXECTYPESTR = "exctypestr";
 	public static final String EXECVALUESTR = "excvaluestr";
 	public static final String TRACEBACK = "traceback";
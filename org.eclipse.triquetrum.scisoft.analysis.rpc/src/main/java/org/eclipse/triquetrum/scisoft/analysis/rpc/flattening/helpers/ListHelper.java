@@ -15,10 +15,11 @@ package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 
 import java.util.List;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IFlattener;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
-public class ListHelper implements IFlattener<List<Object>> {
+public class ListHelper implements IFlattener<List<Object>>, IDispatchedByType {
 
 	public ListHelper() {
 	}
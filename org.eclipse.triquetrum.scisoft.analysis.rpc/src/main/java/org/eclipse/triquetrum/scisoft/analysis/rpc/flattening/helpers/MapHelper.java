@@ -17,12 +17,14 @@ import java.util.HashMap;
 import java.util.Map;
 import java.util.Map.Entry;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.ISharedByReference;
 
 import java.util.Set;
 
 @SuppressWarnings("rawtypes")
-public class MapHelper extends MapFlatteningHelper<Map> {
+public class MapHelper extends MapFlatteningHelper<Map> implements IDispatchedByType, ISharedByReference {
 
 	public static final String KEYS = "keys";
 	public static final String VALUES = "values";
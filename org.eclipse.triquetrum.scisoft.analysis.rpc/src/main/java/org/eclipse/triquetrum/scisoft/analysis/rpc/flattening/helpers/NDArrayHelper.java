@@ -0,0 +1,205 @@
+/*******************************************************************************
+ * Copyright (c) 2014-2016 Diamond Light Source Ltd.,
+ *                         Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+
+package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
+
+import java.io.IOException;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.util.HashMap;
+import java.util.Map;
+
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IFlattener;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.ISharedByReference;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.NDArray;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.internal.SharedMemorySegments;
+
+/**
+ * Flattens {@link NDArray}s in the forms Python's ndArrayHelper uses for numpy ndarrays sent inline, as the bytes of
+ * the array, or in shared memory, see {@link SharedMemorySegments}.
+ * <p>
+ * Arrays of at most {@link #INLINE_THRESHOLD_PROPERTY} (default 16384) bytes are flattened inline, larger ones in
+ * shared memory.
+ * <p>
+ * An NDArray met more than once by one call to {@link IRootFlattener#flatten(Object)} is only sent once, see
+ * {@link ISharedByReference}.
+ */
+public class NDArrayHelper implements IFlattener<NDArray>, IDispatchedByType, ISharedByReference {
+	/** Same type name as Python uses for ndarrays */
+	public static final String TYPE_NAME = "org.eclipse.triquetrum.scisoft.analysis.dataset.AbstractDataset";
+	public static final String SHMNAME = "shmname";
+	public static final String OFFSET = "offset";
+	public static final String DTYPE = "dtype";
+	public static final String SHAPE = "shape";
+	public static final String DATA = "data";
+
+	public static final String INLINE_THRESHOLD_PROPERTY = "org.eclipse.triquetrum.scisoft.analysis.rpc.inline.bytes";
+	private static final int inlineThreshold = Integer.getInteger(INLINE_THRESHOLD_PROPERTY, 16384);
+
+	@Override
+	public Object flatten(Object obj, IRootFlattener rootFlattener) {
+		NDArray array = (NDArray) obj;
+		int nbytes = array.getSize() * NDArray.getItemSize(array.getDtype());
+		Map<String, Object> outMap = new HashMap<String, Object>();
+		outMap.put(IFlattener.TYPE_KEY, TYPE_NAME);
+		outMap.put(DTYPE, array.getDtype());
+		outMap.put(SHAPE, rootFlattener.flatten(array.getShape()));
+		if (nbytes <= inlineThreshold) {
+			ByteBuffer buffer = ByteBuffer.allocate(nbytes).order(ByteOrder.LITTLE_ENDIAN);
+			put(buffer, array.getData());
+			outMap.put(DATA, buffer.array());
+			return outMap;
+		}
+		if (!SharedMemorySegments.isAvailable()) {
+			throw new UnsupportedOperationException("NDArray of " + nbytes
+					+ " bytes can only be flattened where shared memory is available");
+		}
+		SharedMemorySegments.Segment segment;
+		try {
+			segment = SharedMemorySegments.acquire(nbytes);
+		} catch (IOException e) {
+			throw new UnsupportedOperationException("Failed to get shared memory for " + array, e);
+		}
+		put(segment.getBuffer(), array.getData());
+		outMap.put(SHMNAME, segment.getName());
+		outMap.put(OFFSET, SharedMemorySegments.HEADER_SIZE);
+		return outMap;
+	}
+
+	@Override
+	public NDArray unflatten(Object obj, IRootFlattener rootFlattener) {
+		Map<?, ?> inMap = (Map<?, ?>) obj;
+		String dtype = (String) inMap.get(DTYPE);
+		int[] shape = toIntArray((Object[]) inMap.get(SHAPE));
+		if (inMap.containsKey(DATA)) {
+			checkDtype(dtype);
+			ByteBuffer buffer = ByteBuffer.wrap((byte[]) inMap.get(DATA)).order(ByteOrder.LITTLE_ENDIAN);
+			return new NDArray(dtype, shape, get(buffer, dtype, NDArray.getSize(shape)));
+		}
+		if (!inMap.containsKey(SHMNAME)) {
+			throw new UnsupportedOperationException(
+					"Only arrays sent inline or in shared memory can be unflattened to NDArray");
+		}
+		String name = (String) inMap.get(SHMNAME);
+		try {
+			try {
+				checkDtype(dtype);
+				ByteBuffer buffer = SharedMemorySegments.open(name);
+				buffer.position((Integer) inMap.get(OFFSET));
+				return new NDArray(dtype, shape, get(buffer, dtype, NDArray.getSize(shape)));
+			} finally {
+				// Free for reuse even if the array could not be read
+				SharedMemorySegments.release(name);
+			}
+		} catch (IOException e) {
+			throw new UnsupportedOperationException("Failed to read shared memory segment " + name, e);
+		}
+	}
+
+	/**
+	 * @throws UnsupportedOperationException
+	 *             if NDArray has no type for dtype
+	 */
+	private static void checkDtype(String dtype) {
+		try {
+			NDArray.getComponentType(dtype);
+		} catch (IllegalArgumentException e) {
+			throw new UnsupportedOperationException("Arrays of dtype " + dtype + " can't be unflattened to NDArray", e);
+		}
+	}
+
+	private static int[] toIntArray(Object[] array) {
+		int[] ints = new int[array.length];
+		for (int i = 0; i < ints.length; i++) {
+			ints[i] = (Integer) array[i];
+		}
+		return ints;
+	}
+
+	/**
+	 * Read size elements of the given dtype from buffer
+	 */
+	static Object get(ByteBuffer buffer, String dtype, int size) {
+		Class<?> type = NDArray.getComponentType(dtype);
+		if (type == Double.TYPE) {
+			double[] data = new double[size];
+			buffer.asDoubleBuffer().get(data);
+			return data;
+		} else if (type == Float.TYPE) {
+			float[] data = new float[size];
+			buffer.asFloatBuffer().get(data);
+			return data;
+		} else if (type == Long.TYPE) {
+			long[] data = new long[size];
+			buffer.asLongBuffer().get(data);
+			return data;
+		} else if (type == Integer.TYPE) {
+			int[] data = new int[size];
+			buffer.asIntBuffer().get(data);
+			return data;
+		} else if (type == Short.TYPE) {
+			short[] data = new short[size];
+			buffer.asShortBuffer().get(data);
+			return data;
+		} else if (type == Byte.TYPE) {
+			byte[] data = new byte[size];
+			buffer.get(data);
+			return data;
+		} else {
+			boolean[] data = new boolean[size];
+			for (int i = 0; i < size; i++) {
+				data[i] = buffer.get() != 0;
+			}
+			return data;
+		}
+	}
+
+	/**
+	 * Write the elements of data, a primitive array, to buffer
+	 */
+	static void put(ByteBuffer buffer, Object data) {
+		if (data instanceof double[]) {
+			buffer.asDoubleBuffer().put((double[]) data);
+		} else if (data instanceof float[]) {
+			buffer.asFloatBuffer().put((float[]) data);
+		} else if (data instanceof long[]) {
+			buffer.asLongBuffer().put((long[]) data);
+		} else if (data instanceof int[]) {
+			buffer.asIntBuffer().put((int[]) data);
+		} else if (data instanceof short[]) {
+			buffer.asShortBuffer().put((short[]) data);
+		} else if (data instanceof byte[]) {
+			buffer.put((byte[]) data);
+		} else {
+			for (boolean value : (boolean[]) data) {
+				buffer.put((byte) (value ? 1 : 0));
+			}
+		}
+	}
+
+	@Override
+	public boolean canFlatten(Object obj) {
+		return obj instanceof NDArray;
+	}
+
+	@Override
+	public boolean canUnFlatten(Object obj) {
+		if (obj instanceof Map<?, ?>) {
+			Map<?, ?> thisMap = (Map<?, ?>) obj;
+			return TYPE_NAME.equals(thisMap.get(IFlattener.TYPE_KEY));
+		}
+		return false;
+	}
+}
@@ -16,11 +16,12 @@ package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 import java.util.HashMap;
 import java.util.Map;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IFlattener;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.TypedNone;
 
-public class NoneFlatteningHelper implements IFlattener<Object> {
+public class NoneFlatteningHelper implements IFlattener<Object>, IDispatchedByType {
 
 	static final String TYPE_NAME = "__None__";
 	static final String TYPED_NONE_TYPE = "typedNoneType";
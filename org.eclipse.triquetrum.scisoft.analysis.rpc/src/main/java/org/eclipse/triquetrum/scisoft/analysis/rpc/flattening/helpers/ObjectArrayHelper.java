@@ -16,10 +16,11 @@ package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 import java.lang.reflect.Array;
 import java.util.Arrays;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IFlattener;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
-public class ObjectArrayHelper implements IFlattener<Object[]> {
+public class ObjectArrayHelper implements IFlattener<Object[]>, IDispatchedByType {
 
 	public ObjectArrayHelper() {
 	}
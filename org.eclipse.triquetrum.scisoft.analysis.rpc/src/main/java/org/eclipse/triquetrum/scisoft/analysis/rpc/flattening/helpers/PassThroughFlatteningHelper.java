@@ -13,10 +13,11 @@
 
 package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IFlattener;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
-public class PassThroughFlatteningHelper implements IFlattener<Object> {
+public class PassThroughFlatteningHelper implements IFlattener<Object>, IDispatchedByType {
 
 	@Override
 	public Object flatten(Object obj, IRootFlattener rootFlattener) {
@@ -13,15 +13,40 @@
 
 package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.util.HashMap;
+import java.util.Map;
+
 import org.apache.commons.lang.ArrayUtils;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IFlattener;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.NDArray;
 
+/**
+ * Flattens int[], double[] and boolean[].
+ * <p>
+ * int[] and double[] are flattened to a packed form: a Map of the elements as little-endian bytes and their numpy
+ * dtype, whose __type__ is the Java type name. Python unflattens this to an array.array or ndarray. Setting
+ * {@link #PACKED_PROPERTY} to false flattens them to arrays of boxed values instead, as for boolean[], for peers that
+ * predate the packed form.
+ */
 abstract public class PrimitiveArrayHelper implements IFlattener<Object> {
+	public static final String DTYPE = "dtype";
+	public static final String DATA = "data";
+
+	public static final String PACKED_PROPERTY = "org.eclipse.triquetrum.scisoft.analysis.rpc.packed";
+	private static final boolean packed = !"false".equalsIgnoreCase(System.getProperty(PACKED_PROPERTY));
 
 	@Override
 	public Object flatten(Object obj, IRootFlattener rootFlattener) {
-		if (obj instanceof int[]) {
+		if (packed && obj instanceof int[]) {
+			return flattenPacked(PrimitiveIntArrayHelper.TYPE_NAME, PrimitiveIntArrayHelper.PACKED_DTYPE,
+					((int[]) obj).length, obj);
+		} else if (packed && obj instanceof double[]) {
+			return flattenPacked(PrimitiveDoubleArrayHelper.TYPE_NAME, PrimitiveDoubleArrayHelper.PACKED_DTYPE,
+					((double[]) obj).length, obj);
+		} else if (obj instanceof int[]) {
 			return ArrayUtils.toObject((int[]) obj);
 		} else if (obj instanceof boolean[]) {
 			return ArrayUtils.toObject((boolean[]) obj);
@@ -31,6 +56,34 @@ abstract public class PrimitiveArrayHelper implements IFlattener<Object> {
 		throw new AssertionError();
 	}
 
+	private static Map<String, Object> flattenPacked(String typeName, String dtype, int length, Object data) {
+		ByteBuffer buffer = ByteBuffer.allocate(length * NDArray.getItemSize(dtype)).order(ByteOrder.LITTLE_ENDIAN);
+		NDArrayHelper.put(buffer, data);
+		Map<String, Object> outMap = new HashMap<String, Object>();
+		outMap.put(IFlattener.TYPE_KEY, typeName);
+		outMap.put(DTYPE, dtype);
+		outMap.put(DATA, buffer.array());
+		return outMap;
+	}
+
+	/**
+	 * @return true if obj is the packed form with the given type name
+	 */
+	protected static boolean isPacked(Object obj, String typeName) {
+		return obj instanceof Map<?, ?> && typeName.equals(((Map<?, ?>) obj).get(IFlattener.TYPE_KEY));
+	}
+
+	/**
+	 * @return the elements of the packed form obj, in a primitive array of the type of its dtype
+	 */
+	protected static Object unflattenPacked(Object obj) {
+		Map<?, ?> inMap = (Map<?, ?>) obj;
+		String dtype = (String) inMap.get(DTYPE);
+		byte[] data = (byte[]) inMap.get(DATA);
+		ByteBuffer buffer = ByteBuffer.wrap(data).order(ByteOrder.LITTLE_ENDIAN);
+		return NDArrayHelper.get(buffer, dtype, data.length / NDArray.getItemSize(dtype));
+	}
+
 	@Override
 	public boolean canFlatten(Object obj) {
 		return obj instanceof int[] || obj instanceof boolean[] || obj instanceof double[];
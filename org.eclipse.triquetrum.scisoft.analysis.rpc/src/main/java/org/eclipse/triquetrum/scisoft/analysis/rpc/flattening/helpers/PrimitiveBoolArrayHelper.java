@@ -13,9 +13,10 @@
 
 package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
-public class PrimitiveBoolArrayHelper extends PrimitiveArrayHelper {
+public class PrimitiveBoolArrayHelper extends PrimitiveArrayHelper implements IDispatchedByType {
 
 	@Override
 	public Object unflatten(Object obj, IRootFlattener rootFlattener) {
@@ -13,12 +13,18 @@
 
 package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
-public class PrimitiveDoubleArrayHelper extends PrimitiveArrayHelper {
+public class PrimitiveDoubleArrayHelper extends PrimitiveArrayHelper implements IDispatchedByType {
+	public static final String TYPE_NAME = "double[]";
+	public static final String PACKED_DTYPE = "<f8";
 
 	@Override
 	public Object unflatten(Object obj, IRootFlattener rootFlattener) {
+		if (isPacked(obj, TYPE_NAME)) {
+			return (double[]) unflattenPacked(obj);
+		}
 		Object[] array = (Object[]) obj;
 		double[] doubleArray = new double[array.length];
 		for (int i = 0; i < doubleArray.length; i++) {
@@ -29,6 +35,9 @@ public class PrimitiveDoubleArrayHelper extends PrimitiveArrayHelper {
 
 	@Override
 	public boolean canUnFlatten(Object obj) {
+		if (isPacked(obj, TYPE_NAME)) {
+			return true;
+		}
 		if (!(obj instanceof Object[])) {
 			return false;
 		}
@@ -13,12 +13,18 @@
 
 package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
-public class PrimitiveIntArrayHelper extends PrimitiveArrayHelper {
+public class PrimitiveIntArrayHelper extends PrimitiveArrayHelper implements IDispatchedByType {
+	public static final String TYPE_NAME = "int[]";
+	public static final String PACKED_DTYPE = "<i4";
 
 	@Override
 	public Object unflatten(Object obj, IRootFlattener rootFlattener) {
+		if (isPacked(obj, TYPE_NAME)) {
+			return (int[]) unflattenPacked(obj);
+		}
 		Object[] array = (Object[]) obj;
 		int[] intArray = new int[array.length];
 		for (int i = 0; i < intArray.length; i++) {
@@ -29,6 +35,9 @@ public class PrimitiveIntArrayHelper extends PrimitiveArrayHelper {
 
 	@Override
 	public boolean canUnFlatten(Object obj) {
+		if (isPacked(obj, TYPE_NAME)) {
+			return true;
+		}
 		if (!(obj instanceof Object[])) {
 			return false;
 		}
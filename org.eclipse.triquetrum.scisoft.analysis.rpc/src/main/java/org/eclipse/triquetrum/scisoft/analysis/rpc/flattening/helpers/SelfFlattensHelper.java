@@ -13,11 +13,12 @@
 
 package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IFlattener;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IFlattens;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
-public class SelfFlattensHelper implements IFlattener<Object> {
+public class SelfFlattensHelper implements IFlattener<Object>, IDispatchedByType {
 
 	static final String NULL_TYPE = "__null__";
 
@@ -15,10 +15,11 @@ package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 
 import java.util.Map;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
 public class StackTraceElementHelper extends
-		MapFlatteningHelper<StackTraceElement> {
+		MapFlatteningHelper<StackTraceElement> implements IDispatchedByType {
 	public static final String DECLARINGCLASS = "declaringClass";
 	public static final String METHODNAME = "methodName";
 	public static final String FILENAME = "fileName";
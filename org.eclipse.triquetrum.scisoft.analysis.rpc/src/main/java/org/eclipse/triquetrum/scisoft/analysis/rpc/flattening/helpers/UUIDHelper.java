@@ -16,9 +16,10 @@ package org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.helpers;
 import java.util.Map;
 import java.util.UUID;
 
+import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IDispatchedByType;
 import org.eclipse.triquetrum.scisoft.analysis.rpc.flattening.IRootFlattener;
 
-public class UUIDHelper extends SortOfEnumHelper<UUID> {
+public class UUIDHelper extends SortOfEnumHelper<UUID> implements IDispatchedByType {
 
 	public UUIDHelper() {
 		super(UUID.class);
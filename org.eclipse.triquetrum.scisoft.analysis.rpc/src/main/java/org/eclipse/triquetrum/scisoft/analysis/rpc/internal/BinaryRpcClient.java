@@ -0,0 +1,105 @@
+/*******************************************************************************
+ * Copyright (c) 2014-2016 Diamond Light Source Ltd.,
+ *                         Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+
+package org.eclipse.triquetrum.scisoft.analysis.rpc.internal;
+
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.net.HttpURLConnection;
+import java.net.MalformedURLException;
+import java.net.URL;
+
+import org.apache.xmlrpc.XmlRpcException;
+
+/**
+ * Counterpart of {@link org.apache.xmlrpc.client.XmlRpcClient} that sends calls in the encoding of
+ * {@link BinaryRpcCodec}. Connections are kept alive and reused by {@link HttpURLConnection}.
+ *
+ * @see UnixSocketBinaryRpcClient
+ */
+public class BinaryRpcClient {
+	private final URL url;
+
+	public BinaryRpcClient(int port) throws MalformedURLException {
+		url = new URL("http://127.0.0.1:" + port + BinaryRpcCodec.PATH);
+	}
+
+	/**
+	 * For subclasses that do their own {@link #post(byte[])}
+	 */
+	protected BinaryRpcClient() {
+		url = null;
+	}
+
+	/**
+	 * Perform a call, as {@link org.apache.xmlrpc.client.XmlRpcClient#execute(String, Object[])}.
+	 *
+	 * @throws XmlRpcException
+	 *             if the server returned a fault, or with code 0 if the call could not be made
+	 */
+	public Object execute(String method, Object[] params) throws XmlRpcException {
+		byte[] request = BinaryRpcCodec.encodeRequest(method, params);
+		try {
+			return BinaryRpcCodec.decodeResponse(post(request));
+		} catch (IOException e) {
+			throw new XmlRpcException("Failed to call server: " + e.getMessage(), e);
+		}
+	}
+
+	/**
+	 * POST an encoded request to the server and return the body of its response.
+	 *
+	 * @throws XmlRpcException
+	 *             if the server did not respond with HTTP status OK
+	 */
+	protected byte[] post(byte[] request) throws IOException, XmlRpcException {
+		HttpURLConnection conn = (HttpURLConnection) url.openConnection();
+		conn.setDoOutput(true);
+		conn.setRequestMethod("POST");
+		conn.setRequestProperty("Content-Type", BinaryRpcCodec.CONTENT_TYPE);
+		conn.setFixedLengthStreamingMode(request.length);
+		OutputStream out = conn.getOutputStream();
+		try {
+			out.write(request);
+		} finally {
+			out.close();
+		}
+		int status = conn.getResponseCode();
+		if (status != HttpURLConnection.HTTP_OK) {
+			// Read the error body so the connection can be reused
+			readFully(conn.getErrorStream());
+			throw new XmlRpcException("HTTP server returned unexpected status: " + status + " "
+					+ conn.getResponseMessage());
+		}
+		return readFully(conn.getInputStream());
+	}
+
+	private static byte[] readFully(InputStream in) throws IOException {
+		if (in == null) {
+			return new byte[0];
+		}
+		try {
+			ByteArrayOutputStream bytes = new ByteArrayOutputStream();
+			byte[] chunk = new byte[8192];
+			int n;
+			while ((n = in.read(chunk)) != -1) {
+				bytes.write(chunk, 0, n);
+			}
+			return bytes.toByteArray();
+		} finally {
+			in.close();
+		}
+	}
+}
@@ -0,0 +1,260 @@
+/*******************************************************************************
+ * Copyright (c) 2014-2016 Diamond Light Source Ltd.,
+ *                         Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+
+package org.eclipse.triquetrum.scisoft.analysis.rpc.internal;
+
+import java.nio.BufferUnderflowException;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.charset.Charset;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.Map.Entry;
+
+import org.apache.xmlrpc.XmlRpcException;
+
+/**
+ * Compact binary encoding of AnalysisRpc calls, used instead of XML when the server supports it. The format is
+ * described in, and must be kept in step with, the Python module scisoftpy.python.pybinrpc.
+ * <p>
+ * Only values of flattened form are carried: <code>null</code>, {@link Boolean}, {@link Integer}, {@link Long},
+ * {@link Double}, {@link String}, <code>byte[]</code>, <code>Object[]</code> (or {@link List}) and {@link Map} with
+ * {@link String} keys. Arrays of only {@link Double} or only {@link Integer} are sent as packed little-endian blocks.
+ * Decoded arrays are always <code>Object[]</code> and maps {@link HashMap}, as Apache XML-RPC would return them.
+ */
+public class BinaryRpcCodec {
+	/** Name of the transport as reported by the server's Analysis.transports */
+	public static final String NAME = "binary1";
+	/** Path the server accepts binary calls on */
+	public static final String PATH = "/ARPC";
+	public static final String CONTENT_TYPE = "application/x-analysisrpc";
+
+	private static final byte OK = 0;
+	private static final byte FAULT = 1;
+	private static final Charset UTF8 = Charset.forName("UTF-8");
+
+	/**
+	 * Encode a call of the given method.
+	 */
+	public static byte[] encodeRequest(String method, Object[] params) throws XmlRpcException {
+		Encoder encoder = new Encoder();
+		encoder.encode(method);
+		encoder.encodeArray(params);
+		return encoder.toByteArray();
+	}
+
+	/**
+	 * Decode a response.
+	 *
+	 * @return the value returned by the server
+	 * @throws XmlRpcException
+	 *             if the server returned a fault, with the fault's code and string, or if the response is malformed
+	 */
+	public static Object decodeResponse(byte[] data) throws XmlRpcException {
+		ByteBuffer buf = ByteBuffer.wrap(data).order(ByteOrder.LITTLE_ENDIAN);
+		try {
+			byte status = buf.get();
+			if (status == FAULT) {
+				Object faultCode = decode(buf);
+				Object faultString = decode(buf);
+				throw new XmlRpcException(((Integer) faultCode).intValue(), (String) faultString);
+			} else if (status != OK) {
+				throw new XmlRpcException("Malformed binary RPC response");
+			}
+			return decode(buf);
+		} catch (BufferUnderflowException e) {
+			throw new XmlRpcException("Truncated binary RPC response", e);
+		} catch (ClassCastException e) {
+			throw new XmlRpcException("Malformed binary RPC response", e);
+		}
+	}
+
+	private static Object decode(ByteBuffer buf) throws XmlRpcException {
+		byte tag = buf.get();
+		switch (tag) {
+		case 'N':
+			return null;
+		case 'T':
+			return Boolean.TRUE;
+		case 'F':
+			return Boolean.FALSE;
+		case 'i':
+			return buf.getInt();
+		case 'q':
+			return buf.getLong();
+		case 'd':
+			return buf.getDouble();
+		case 's':
+			return new String(decodeBytes(buf), UTF8);
+		case 'b':
+			return decodeBytes(buf);
+		case 'l': {
+			Object[] list = new Object[decodeLength(buf)];
+			for (int i = 0; i < list.length; i++) {
+				list[i] = decode(buf);
+			}
+			return list;
+		}
+		case 'm': {
+			int n = decodeLength(buf);
+			Map<String, Object> map = new HashMap<String, Object>();
+			for (int i = 0; i < n; i++) {
+				String key = new String(decodeBytes(buf), UTF8);
+				map.put(key, decode(buf));
+			}
+			return map;
+		}
+		case 'D': {
+			Object[] list = new Object[decodeLength(buf)];
+			for (int i = 0; i < list.length; i++) {
+				list[i] = buf.getDouble();
+			}
+			return list;
+		}
+		case 'Q': {
+			Object[] list = new Object[decodeLength(buf)];
+			for (int i = 0; i < list.length; i++) {
+				long value = buf.getLong();
+				if (value >= Integer.MIN_VALUE && value <= Integer.MAX_VALUE) {
+					list[i] = (int) value;
+				} else {
+					list[i] = value;
+				}
+			}
+			return list;
+		}
+		default:
+			throw new XmlRpcException("Unknown binary RPC tag " + tag);
+		}
+	}
+
+	private static int decodeLength(ByteBuffer buf) throws XmlRpcException {
+		int n = buf.getInt();
+		if (n < 0) {
+			throw new XmlRpcException("Binary RPC length too large: " + (n & 0xffffffffL));
+		}
+		return n;
+	}
+
+	private static byte[] decodeBytes(ByteBuffer buf) throws XmlRpcException {
+		byte[] bytes = new byte[decodeLength(buf)];
+		buf.get(bytes);
+		return bytes;
+	}
+
+	private static class Encoder {
+		private ByteBuffer buf = ByteBuffer.allocate(1024).order(ByteOrder.LITTLE_ENDIAN);
+
+		private void ensure(int n) {
+			if (buf.remaining() < n) {
+				int capacity = Math.max(buf.capacity() * 2, buf.position() + n);
+				ByteBuffer bigger = ByteBuffer.allocate(capacity).order(ByteOrder.LITTLE_ENDIAN);
+				buf.flip();
+				bigger.put(buf);
+				buf = bigger;
+			}
+		}
+
+		private void putTagAndLength(char tag, int n) {
+			ensure(5);
+			buf.put((byte) tag);
+			buf.putInt(n);
+		}
+
+		private void putBytes(char tag, byte[] bytes) {
+			putTagAndLength(tag, bytes.length);
+			ensure(bytes.length);
+			buf.put(bytes);
+		}
+
+		public void encode(Object value) throws XmlRpcException {
+			if (value == null) {
+				ensure(1);
+				buf.put((byte) 'N');
+			} else if (value instanceof Boolean) {
+				ensure(1);
+				buf.put((byte) (((Boolean) value).booleanValue() ? 'T' : 'F'));
+			} else if (value instanceof Integer || value instanceof Short || value instanceof Byte) {
+				ensure(5);
+				buf.put((byte) 'i');
+				buf.putInt(((Number) value).intValue());
+			} else if (value instanceof Long) {
+				ensure(9);
+				buf.put((byte) 'q');
+				buf.putLong(((Long) value).longValue());
+			} else if (value instanceof Double || value instanceof Float) {
+				ensure(9);
+				buf.put((byte) 'd');
+				buf.putDouble(((Number) value).doubleValue());
+			} else if (value instanceof String) {
+				putBytes('s', ((String) value).getBytes(UTF8));
+			} else if (value instanceof byte[]) {
+				putBytes('b', (byte[]) value);
+			} else if (value instanceof Object[]) {
+				encodeArray((Object[]) value);
+			} else if (value instanceof List) {
+				encodeArray(((List<?>) value).toArray());
+			} else if (value instanceof Map) {
+				Map<?, ?> map = (Map<?, ?>) value;
+				putTagAndLength('m', map.size());
+				for (Entry<?, ?> entry : map.entrySet()) {
+					byte[] key = String.valueOf(entry.getKey()).getBytes(UTF8);
+					ensure(4 + key.length);
+					buf.putInt(key.length);
+					buf.put(key);
+					encode(entry.getValue());
+				}
+			} else {
+				throw new XmlRpcException("Cannot encode " + value.getClass().getName() + " for binary RPC");
+			}
+		}
+
+		public void encodeArray(Object[] array) throws XmlRpcException {
+			if (array.length > 0 && allInstances(array, Double.class)) {
+				putTagAndLength('D', array.length);
+				ensure(8 * array.length);
+				for (Object value : array) {
+					buf.putDouble((Double) value);
+				}
+			} else if (array.length > 0 && allInstances(array, Integer.class)) {
+				putTagAndLength('Q', array.length);
+				ensure(8 * array.length);
+				for (Object value : array) {
+					buf.putLong((Integer) value);
+				}
+			} else {
+				putTagAndLength('l', array.length);
+				for (Object value : array) {
+					encode(value);
+				}
+			}
+		}
+
+		private static boolean allInstances(Object[] array, Class<?> clazz) {
+			for (Object value : array) {
+				if (value == null || value.getClass() != clazz) {
+					return false;
+				}
+			}
+			return true;
+		}
+
+		public byte[] toByteArray() {
+			byte[] bytes = new byte[buf.position()];
+			buf.flip();
+			buf.get(bytes);
+			return bytes;
+		}
+	}
+}
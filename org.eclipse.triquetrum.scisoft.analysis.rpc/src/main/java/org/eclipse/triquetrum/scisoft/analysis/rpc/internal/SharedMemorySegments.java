@@ -0,0 +1,163 @@
+/*******************************************************************************
+ * Copyright (c) 2014-2016 Diamond Light Source Ltd.,
+ *                         Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+
+package org.eclipse.triquetrum.scisoft.analysis.rpc.internal;
+
+import java.io.File;
+import java.io.IOException;
+import java.io.RandomAccessFile;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.MappedByteBuffer;
+import java.nio.channels.FileChannel;
+import java.util.ArrayList;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+
+/**
+ * Shared memory segments used to pass arrays to the other process without going through a file on disk. The layout
+ * and protocol are described in, and must be kept in step with, the Python module scisoftpy.python.pyshm.
+ * <p>
+ * In short: a segment is a file in /dev/shm whose first byte is {@link #IN_USE} while it holds an array the receiver
+ * has not read yet, and {@link #FREE} once the receiver has copied it out. The creator only reuses free segments, and
+ * those still in use {@link #RECLAIM_MILLIS} after they were handed out, as they hold a message that will never be read.
+ */
+public class SharedMemorySegments {
+	public static final File SHM_DIR = new File("/dev/shm");
+	public static final int HEADER_SIZE = 64;
+	public static final byte FREE = 0;
+	public static final byte IN_USE = 1;
+	public static final long RECLAIM_MILLIS = 300 * 1000;
+
+	/** Segments are created in multiples of this size so arrays of similar size can reuse each other's segment */
+	private static final int GRANULE = 1 << 20;
+	private static final int MAX_MAPPED = 64;
+
+	/**
+	 * A segment of this process, to write an array into
+	 */
+	public static class Segment {
+		private final File file;
+		private final MappedByteBuffer buffer;
+		private long acquired;
+
+		private Segment(File file, MappedByteBuffer buffer) {
+			this.file = file;
+			this.buffer = buffer;
+		}
+
+		public String getName() {
+			return file.getName();
+		}
+
+		/**
+		 * @return a new little-endian view of the whole segment, positioned at
+		 *         {@link SharedMemorySegments#HEADER_SIZE}
+		 */
+		public ByteBuffer getBuffer() {
+			ByteBuffer view = buffer.duplicate().order(ByteOrder.LITTLE_ENDIAN);
+			view.position(HEADER_SIZE);
+			return view;
+		}
+
+		private int getCapacity() {
+			return buffer.capacity() - HEADER_SIZE;
+		}
+	}
+
+	private static final List<Segment> segments = new ArrayList<Segment>();
+
+	/** Segments of the other process mapped to read from, by name, least recently used first */
+	private static final Map<String, MappedByteBuffer> mapped = new LinkedHashMap<String, MappedByteBuffer>(16, 0.75f,
+			true);
+
+	/**
+	 * @return true if segments can be created on this platform
+	 */
+	public static boolean isAvailable() {
+		return SHM_DIR.isDirectory() && SHM_DIR.canWrite();
+	}
+
+	/**
+	 * Return a segment with room for nbytes after the header, marked {@link #IN_USE}. The receiver marks it free
+	 * again.
+	 */
+	public static synchronized Segment acquire(int nbytes) throws IOException {
+		long now = System.currentTimeMillis();
+		for (Segment segment : segments) {
+			if (segment.getCapacity() >= nbytes
+					&& (segment.buffer.get(0) == FREE || now - segment.acquired > RECLAIM_MILLIS)) {
+				segment.buffer.put(0, IN_USE);
+				segment.acquired = now;
+				return segment;
+			}
+		}
+		long size = ((long) nbytes + HEADER_SIZE + GRANULE - 1) / GRANULE * GRANULE;
+		if (size > Integer.MAX_VALUE) {
+			throw new IOException("Array of " + nbytes + " bytes too large for a shared memory segment");
+		}
+		File file = File.createTempFile("scisoftshm-", "", SHM_DIR);
+		file.deleteOnExit();
+		RandomAccessFile raf = new RandomAccessFile(file, "rw");
+		try {
+			raf.setLength(size);
+			MappedByteBuffer buffer = raf.getChannel().map(FileChannel.MapMode.READ_WRITE, 0, size);
+			buffer.put(0, IN_USE);
+			Segment segment = new Segment(file, buffer);
+			segment.acquired = now;
+			segments.add(segment);
+			return segment;
+		} catch (IOException e) {
+			file.delete();
+			throw e;
+		} finally {
+			raf.close();
+		}
+	}
+
+	/**
+	 * Return a new little-endian view of the named segment of the other process, mapping it on first use.
+	 */
+	public static ByteBuffer open(String name) throws IOException {
+		return map(name).duplicate().order(ByteOrder.LITTLE_ENDIAN);
+	}
+
+	private static synchronized MappedByteBuffer map(String name) throws IOException {
+		if (name.length() == 0 || name.indexOf('/') >= 0 || name.startsWith(".")) {
+			throw new IOException("Invalid shared memory segment name " + name);
+		}
+		MappedByteBuffer buffer = mapped.get(name);
+		if (buffer == null) {
+			if (mapped.size() >= MAX_MAPPED) {
+				// Forget the least recently used, it is unmapped when collected
+				mapped.remove(mapped.keySet().iterator().next());
+			}
+			RandomAccessFile raf = new RandomAccessFile(new File(SHM_DIR, name), "rw");
+			try {
+				buffer = raf.getChannel().map(FileChannel.MapMode.READ_WRITE, 0, raf.length());
+			} finally {
+				raf.close();
+			}
+			mapped.put(name, buffer);
+		}
+		return buffer;
+	}
+
+	/**
+	 * Mark the named segment of the other process free for reuse, once the array in it has been copied out.
+	 */
+	public static synchronized void release(String name) throws IOException {
+		map(name).put(0, FREE);
+	}
+}
@@ -0,0 +1,224 @@
+/*******************************************************************************
+ * Copyright (c) 2014-2016 Diamond Light Source Ltd.,
+ *                         Kichwa Coders & iSencia Belgium NV.
+ * All rights reserved. This program and the accompanying materials
+ * are made available under the terms of the Eclipse Public License v1.0
+ * which accompanies this distribution, and is available at
+ * http://www.eclipse.org/legal/epl-v10.html
+ *
+ * Contributors:
+ *    DLS, Kichwa Coders - initial API and implementation and/or initial documentation
+ *    Erwin De Ley - extraction from DAWN to ease reuse in other contexts
+ *******************************************************************************/
+
+package org.eclipse.triquetrum.scisoft.analysis.rpc.internal;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.EOFException;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.SocketAddress;
+import java.nio.channels.Channels;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.Charset;
+import java.util.LinkedList;
+
+import org.apache.xmlrpc.XmlRpcException;
+
+/**
+ * {@link BinaryRpcClient} that connects to a server listening on a Unix domain socket rather than a TCP port.
+ * <p>
+ * Unix domain sockets are only available from Java 16, so they are looked up by reflection and
+ * {@link #isSupported()} is false on older VMs (and on Windows, where the Python server can't listen on one).
+ * <p>
+ * The HTTP/1.1 exchange is done here, as {@link java.net.HttpURLConnection} only speaks TCP. Idle connections are
+ * kept for reuse, one per concurrent caller.
+ */
+public class UnixSocketBinaryRpcClient extends BinaryRpcClient {
+	private static final Charset ASCII = Charset.forName("US-ASCII");
+
+	private static final Method openChannel;
+	private static final Object unixFamily;
+	private static final Method addressOf;
+
+	static {
+		Method open = null;
+		Object family = null;
+		Method of = null;
+		if (File.separatorChar == '/') {
+			try {
+				Class<?> familyClass = Class.forName("java.net.StandardProtocolFamily");
+				family = familyClass.getField("UNIX").get(null);
+				open = SocketChannel.class.getMethod("open", Class.forName("java.net.ProtocolFamily"));
+				of = Class.forName("java.net.UnixDomainSocketAddress").getMethod("of", String.class);
+			} catch (Exception e) {
+				// Before Java 16
+				open = null;
+			}
+		}
+		openChannel = open;
+		unixFamily = family;
+		addressOf = of;
+	}
+
+	private final SocketAddress address;
+	private final LinkedList<Connection> idle = new LinkedList<Connection>();
+
+	/**
+	 * @return true if Unix domain sockets can be used on this VM and platform
+	 */
+	public static boolean isSupported() {
+		return openChannel != null;
+	}
+
+	/**
+	 * @param path
+	 *            of the socket the server listens on
+	 * @throws UnsupportedOperationException
+	 *             if not {@link #isSupported()}
+	 */
+	public UnixSocketBinaryRpcClient(String path) {
+		if (!isSupported()) {
+			throw new UnsupportedOperationException("Unix domain sockets require Java 16 or newer on Unix");
+		}
+		try {
+			address = (SocketAddress) addressOf.invoke(null, path);
+		} catch (IllegalAccessException e) {
+			throw new UnsupportedOperationException(e);
+		} catch (InvocationTargetException e) {
+			throw new IllegalArgumentException("Invalid socket path " + path, e.getCause());
+		}
+	}
+
+	@Override
+	protected byte[] post(byte[] request) throws IOException, XmlRpcException {
+		Connection conn;
+		synchronized (idle) {
+			conn = idle.poll();
+		}
+		if (conn != null) {
+			try {
+				return post(conn, request);
+			} catch (IOException e) {
+				// The server closed the idle connection, retry once on a new one
+			}
+		}
+		return post(new Connection(), request);
+	}
+
+	private byte[] post(Connection conn, byte[] request) throws IOException, XmlRpcException {
+		boolean reuse = false;
+		try {
+			byte[] response = conn.post(request);
+			reuse = conn.keepAlive;
+			return response;
+		} finally {
+			if (reuse) {
+				synchronized (idle) {
+					idle.add(conn);
+				}
+			} else {
+				conn.close();
+			}
+		}
+	}
+
+	private class Connection {
+		private final SocketChannel channel;
+		private final InputStream in;
+		private final OutputStream out;
+		private boolean keepAlive;
+
+		public Connection() throws IOException {
+			try {
+				channel = (SocketChannel) openChannel.invoke(null, unixFamily);
+			} catch (IllegalAccessException e) {
+				throw new IOException(e.toString());
+			} catch (InvocationTargetException e) {
+				throw new IOException(e.getCause().toString());
+			}
+			try {
+				channel.connect(address);
+			} catch (IOException e) {
+				channel.close();
+				throw e;
+			}
+			in = new BufferedInputStream(Channels.newInputStream(channel));
+			out = new BufferedOutputStream(Channels.newOutputStream(channel));
+		}
+
+		public byte[] post(byte[] request) throws IOException, XmlRpcException {
+			String headers = "POST " + BinaryRpcCodec.PATH + " HTTP/1.1\r\n" + "Host: localhost\r\n"
+					+ "Content-Type: " + BinaryRpcCodec.CONTENT_TYPE + "\r\n" + "Content-Length: " + request.length
+					+ "\r\n\r\n";
+			out.write(headers.getBytes(ASCII));
+			out.write(request);
+			out.flush();
+
+			String statusLine = readLine();
+			String[] status = statusLine.split(" ", 3);
+			if (status.length < 2 || !status[0].startsWith("HTTP/")) {
+				throw new IOException("Malformed HTTP status line: " + statusLine);
+			}
+			int length = -1;
+			keepAlive = "HTTP/1.1".equals(status[0]);
+			String line;
+			while ((line = readLine()).length() > 0) {
+				int colon = line.indexOf(':');
+				if (colon < 0) {
+					continue;
+				}
+				String name = line.substring(0, colon).trim();
+				String value = line.substring(colon + 1).trim();
+				if ("Content-Length".equalsIgnoreCase(name)) {
+					length = Integer.parseInt(value);
+				} else if ("Connection".equalsIgnoreCase(name)) {
+					keepAlive = !"close".equalsIgnoreCase(value);
+				}
+			}
+			if (length < 0) {
+				throw new IOException("HTTP response without Content-Length");
+			}
+			byte[] body = new byte[length];
+			int n = 0;
+			while (n < length) {
+				int read = in.read(body, n, length - n);
+				if (read < 0) {
+					throw new EOFException("Truncated HTTP response");
+				}
+				n += read;
+			}
+			if (!"200".equals(status[1])) {
+				throw new XmlRpcException("HTTP server returned unexpected status: " + statusLine);
+			}
+			return body;
+		}
+
+		private String readLine() throws IOException {
+			StringBuilder line = new StringBuilder();
+			int c;
+			while ((c = in.read()) != '\n') {
+				if (c < 0) {
+					throw new EOFException("Connection closed by server");
+				}
+				if (c != '\r') {
+					line.append((char) c);
+				}
+			}
+			return line.toString();
+		}
+
+		public void close() {
+			try {
+				channel.close();
+			} catch (IOException e) {
+				// Nothing more can be done
+			}
+		}
+	}
+}